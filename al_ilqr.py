@@ -0,0 +1,109 @@
+import numpy as np
+from deadline import Deadline
+from ilqr import iterative_LQR
+
+"Augmented Lagrangian iterative LQR for state constraints"
+
+
+class augmented_Lagrangian_iLQR(iterative_LQR):
+    """
+    iterative LQR with the state constraints of a Constraint object, e.g. the
+    corridor bubbles of BubbleConstraint, on the first constraint.horizon
+    states. Every outer iteration runs iterative_LQR on the cost plus the
+    augmented Lagrangian terms lambda'c + penalty/2 |c|^2 of the active
+    constraints c <= 0, evaluated over the whole horizon at once. Between
+    outer iterations the multipliers lambda are updated and the penalty grows
+    by penalty_scaling, until the largest violation is below
+    constraint_tolerance. The multipliers of rows that constraint.update
+    reassigns, e.g. to another obstacle, restart from 0. Control limits are
+    clamped as in iterative_LQR.
+    After the solve min_cost is the cost without the constraint terms.
+    Reference:
+    ALTRO: A Fast Solver for Constrained Trajectory Optimization
+    https://roboticexplorationlab.org/papers/altro-iros.pdf
+    """
+
+    def __init__(self, sys, constraint, target_states, dt):
+        super().__init__(sys, target_states, dt)
+        self.constraint = constraint
+        self.maxOuterIter = 10
+        self.constraint_tolerance = 1e-3
+        self.penalty_initial = 1.0
+        self.penalty_scaling = 10.0
+        self.penalty_max = 1e8
+        self.penalty = self.penalty_initial
+        self.multipliers = np.zeros((constraint.horizon, 2*constraint.constraint_size))
+        self.violation = np.inf
+
+    def active_residuals(self, residuals):
+        """
+        Residuals of the constraints that are violated or have a positive
+        multiplier, 0 elsewhere, and the mask of those constraints.
+        """
+        active = (residuals > 0.0) | (self.multipliers > 0.0)
+        return np.where(active, residuals, 0.0), active
+
+    def constraint_cost(self, states):
+        c, active = self.active_residuals(self.constraint.get_residuals(states)[0])
+        return np.sum(self.multipliers*c + 0.5*self.penalty*c*c, axis=(-2, -1))
+
+    def cost_of(self, states, inputs):
+        return super().cost_of(states, inputs) + self.constraint_cost(states)
+
+    def state_cost_derivatives(self):
+        dl_dx, dl_dxdx = super().state_cost_derivatives()
+        residuals, C = self.constraint.get_residuals(self.states)
+        c, active = self.active_residuals(residuals)
+        size = self.constraint.constraint_size
+        # the upper bound rows are C x - xmax, the lower bound rows xmin - C x
+        weights = self.multipliers + self.penalty*c
+        weights = weights[:, :size] - weights[:, size:]
+        curvature = self.penalty*(active[:, :size].astype(float) + active[:, size:])
+        Tc = self.constraint.horizon
+        dl_dx[:Tc] += np.einsum('tij,ti->tj', C, weights)
+        dl_dxdx[:Tc] += np.einsum('tij,ti,tik->tjk', C, curvature, C)
+        return dl_dx, dl_dxdx
+
+    def __call__(self):
+        deadline = Deadline(self.time_budget)
+        time_budget = self.time_budget
+        # the constraints are evaluated on the trajectory the initial inputs produce
+        self.states = self.system.rollout(self.states[0, :], self.inputs)
+        self.multipliers = np.zeros((self.constraint.horizon, 2*self.constraint.constraint_size))
+        self.penalty = self.penalty_initial
+        initial_cost = super().cost_of(self.states, self.inputs)
+        iterations = 0
+        outer_iterations = 0
+        rollouts = 0
+        timed_out = False
+        try:
+            for outer in range(self.maxOuterIter):
+                if time_budget is not None:
+                    self.time_budget = deadline.remaining()
+                self.converge = False
+                changed = self.constraint.update(self.states)
+                if changed is not None:
+                    self.multipliers[np.concatenate([changed, changed], axis=-1)] = 0.0
+                super().__call__()
+                outer_iterations += 1
+                iterations += self.status['iterations']
+                rollouts += self.status['rollouts']
+                residuals = self.constraint.get_residuals(self.states)[0]
+                self.violation = max(float(np.max(residuals)), 0.0)
+                if self.violation <= self.constraint_tolerance:
+                    break
+                if self.status['timed_out'] or deadline.expired():
+                    timed_out = True
+                    break
+                self.multipliers = np.maximum(self.multipliers + self.penalty*residuals, 0.0)
+                self.penalty = min(self.penalty*self.penalty_scaling, self.penalty_max)
+        finally:
+            self.time_budget = time_budget
+        self.min_cost = super().cost_of(self.states, self.inputs)
+        self.converge = self.violation <= self.constraint_tolerance
+        self.status = {'iterations': iterations, 'outer_iterations': outer_iterations,
+                       'alpha': self.alpha, 'cost_reduction': initial_cost - self.min_cost,
+                       'converged': self.converge, 'timed_out': timed_out,
+                       'violation': self.violation, 'penalty': self.penalty,
+                       'rollouts': rollouts, 'solve_time': deadline.elapsed()}
+        return self.states
@@ -0,0 +1,217 @@
+import numpy as np
+from costs import sufficient_decrease, trajectory_cost
+from riccati import riccati_numpy
+
+"iterative LQR with Quadratic cost over a batch of independent problems"
+
+
+class batch_iterative_LQR:
+    """
+    Solves B independent iLQR problems that share the system and the cost
+    weights but have their own targets and initial inputs. The backward and
+    forward passes run over the batch dimension with vectorized NumPy, each
+    problem keeps its own line search and convergence flag. Steps are
+    accepted and problems converge by the rules of iterative_LQR: a step
+    must achieve the fraction armijo of the reduction its backward pass
+    expects, and a problem converges once the expected or achieved
+    reduction drops below tol_fun relative to its cost, or once its line
+    search fails down to steps whose expected reduction is below that. A
+    problem whose line search finds no descent stops with no_descent set.
+    Every problem has its own Levenberg-Marquardt term mu, starting from
+    LM_parameter. It grows by LM_factor for the problems whose Quu is not
+    positive definite, which repeat the backward pass, and shrinks after
+    accepted steps. A problem whose mu exceeds LM_maximum stops and is
+    reported as failed.
+    target_states: (B, T, n), inputs: (B, T - 1, m), states: (B, T, n)
+    cost function: x'Qx + u'Ru
+    """
+
+    def __init__(self, sys, target_states, dt):
+        self.target_states = target_states
+        self.batch_size = self.target_states.shape[0]
+        self.horizon = self.target_states.shape[1]
+        self.dt = dt
+        self.system = sys
+        self.n_states = sys.state_size
+        self.m_inputs = sys.control_size
+        self.Q = sys.Q
+        self.R = sys.R
+        self.Qf = sys.Q_f
+        self.maxIter = 30
+        self.LM_parameter = 0.0
+        self.LM_factor = 10.0
+        self.LM_minimum = 1e-6
+        self.LM_maximum = 1e10
+        self.alpha_terminal = 1e-4
+        self.armijo = 0.1
+        self.tol_fun = 1e-6
+        self.tol_grad = 1e-4
+        self.converge = np.zeros(self.batch_size, dtype=bool)
+        self.failed = np.zeros(self.batch_size, dtype=bool)
+        self.no_descent = np.zeros(self.batch_size, dtype=bool)
+        self.expected = np.zeros((self.batch_size, 2))
+        self.mu = np.full(self.batch_size, self.LM_parameter)
+        self.min_cost = np.zeros(self.batch_size)
+        self.status = {}
+        self.states = np.zeros(
+            (self.batch_size, self.horizon, self.n_states))
+        self.inputs = np.zeros(
+            (self.batch_size, self.horizon - 1, self.m_inputs))
+        self.k = np.zeros((self.batch_size, self.horizon - 1, self.m_inputs))
+        self.K = np.zeros(
+            (self.batch_size, self.horizon - 1, self.m_inputs, self.n_states))
+
+    def cost(self):
+        return trajectory_cost(self.states, self.inputs, self.target_states, self.Q, self.R, self.Qf)
+
+    def rollout(self, idx, alpha):
+        """
+        Closed-loop rollout of the problems idx with step size alpha around the
+        current trajectories.
+        """
+        prev_states = self.states[idx]
+        states = np.empty_like(prev_states)
+        inputs = np.empty_like(self.inputs[idx])
+        k = self.k[idx]
+        K = self.K[idx]
+        states[:, 0, :] = prev_states[:, 0, :]
+        for i in range(0, self.horizon - 1):
+            inputs[:, i, :] = self.inputs[idx, i, :] + alpha*k[:, i, :] + \
+                np.einsum('bij,bj->bi', K[:, i], states[:, i, :] - prev_states[:, i, :])
+            if self.system.control_limited:
+                inputs[:, i, :] = np.clip(
+                    inputs[:, i, :], self.system.control_lower_limit, self.system.control_upper_limit)
+            states[:, i + 1, :] = self.system.model_f_batch(
+                states[:, i, :], inputs[:, i, :])
+        return states, inputs
+
+    def active(self):
+        return ~(self.converge | self.failed | self.no_descent)
+
+    def expected_reduction(self, idx, alpha):
+        """
+        Cost reduction of the problems idx for the step size alpha, predicted
+        by the quadratic model of their last backward pass.
+        """
+        return -(alpha*self.expected[idx, 0] + alpha**2*self.expected[idx, 1])
+
+    def gradient_norm(self, idx):
+        """
+        Size of the feedforward step of the problems idx relative to their
+        inputs, see iterative_LQR.gradient_norm.
+        """
+        inputs = self.inputs[idx]
+        step = self.k[idx]
+        if self.system.control_limited:
+            step = np.clip(inputs + step, self.system.control_lower_limit,
+                           self.system.control_upper_limit) - inputs
+        return np.mean(np.max(np.abs(step)/(np.abs(inputs) + 1.0), axis=-1), axis=-1)
+
+    def forward_pass(self):
+        pending = self.active()
+        alpha = 1.0
+        while np.any(pending):
+            idx = np.flatnonzero(pending)
+            states, inputs = self.rollout(idx, alpha)
+            cost = trajectory_cost(
+                states, inputs, self.target_states[idx], self.Q, self.R, self.Qf)
+            accept = sufficient_decrease(cost, self.min_cost[idx],
+                                         self.expected_reduction(idx, alpha), self.armijo)
+            accepted = idx[accept]
+            small = self.min_cost[accepted] - cost[accept] < \
+                self.tol_fun*np.abs(self.min_cost[accepted])
+            self.converge[accepted[small]] = True
+            self.states[accepted] = states[accept]
+            self.inputs[accepted] = inputs[accept]
+            self.min_cost[accepted] = cost[accept]
+            self.mu[accepted] /= self.LM_factor
+            self.mu[accepted[self.mu[accepted] < self.LM_minimum]] = 0.0
+            pending[accepted] = False
+            # smaller steps would converge when accepted
+            idx = np.flatnonzero(pending)
+            negligible = idx[self.expected_reduction(idx, alpha/2.0) <
+                             self.tol_fun*np.abs(self.min_cost[idx])]
+            self.converge[negligible] = True
+            pending[negligible] = False
+            if alpha < self.alpha_terminal:
+                self.no_descent[pending] = True
+                break
+            alpha /= 2.0
+
+    def backward_pass(self):
+        n = self.n_states
+        m = self.m_inputs
+        T = self.horizon - 1
+        retry = self.active()
+        idx = np.flatnonzero(retry)
+        df_dx, df_du = self.system.linearize(self.states[idx], self.inputs[idx])
+        states_diff = self.states[idx] - self.target_states[idx]
+        dl_dx = 2.0*np.dot(states_diff, self.Q.T)
+        dl_du = 2.0*np.dot(self.inputs[idx], self.R.T)
+        dl_dxdx = 2.0*np.asarray(self.Q, dtype=float)
+        dl_dudu = 2.0*np.asarray(self.R, dtype=float)
+        dl_dudx = np.zeros((m, n))
+        while np.any(retry):
+            # rows of idx that are solved (again) in this sweep
+            rows = np.flatnonzero(retry[idx])
+            k = np.empty((rows.shape[0], T, m))
+            K = np.empty((rows.shape[0], T, m, n))
+            Vx = np.empty((rows.shape[0], T + 1, n))
+            Vxx = np.empty((rows.shape[0], T + 1, n, n))
+            Vx[:, -1] = np.dot(states_diff[rows, -1], 2.0*self.Qf.T)
+            Vxx[:, -1] = 2.0*self.Qf
+            failed = riccati_numpy(df_dx[rows], df_du[rows], dl_dx[rows, :-1], dl_du[rows],
+                                   dl_dxdx, dl_dudu, dl_dudx, self.mu[idx[rows]], k, K, Vx, Vxx)
+            self.k[idx[rows]] = k
+            self.K[idx[rows]] = K
+            self.expected[idx[rows]] = self.model_reduction(
+                df_du[rows], dl_du[rows], dl_dudu, self.inputs[idx[rows]], k, Vx, Vxx)
+            retry[idx[rows]] = False
+            bad = idx[rows[failed >= 0]]
+            self.mu[bad] = np.maximum(self.mu[bad]*self.LM_factor, self.LM_minimum)
+            exceeded = bad[self.mu[bad] > self.LM_maximum]
+            self.failed[exceeded] = True
+            retry[bad[self.mu[bad] <= self.LM_maximum]] = True
+
+    def model_reduction(self, df_du, dl_du, dl_dudu, inputs, k, Vx, Vxx):
+        """
+        Coefficients (B, 2) of the expected cost change alpha*dV[0] +
+        alpha^2*dV[1] of the steps k, from the Q function without
+        regularization, along the part of k that the control limits keep.
+        """
+        if self.system.control_limited:
+            k = np.clip(inputs + k, self.system.control_lower_limit,
+                        self.system.control_upper_limit) - inputs
+        Qu = dl_du + np.einsum('btnm,btn->btm', df_du, Vx[:, 1:])
+        fu_k = np.einsum('btnm,btm->btn', df_du, k)
+        kQuuk = np.einsum('btm,mj,btj->b', k, dl_dudu, k) + \
+            np.einsum('btn,btnj,btj->b', fu_k, Vxx[:, 1:], fu_k)
+        return np.stack([np.einsum('btm,btm->b', k, Qu), 0.5*kQuuk], axis=-1)
+
+    def __call__(self):
+        """
+        Returns the states, inputs, costs and convergence flags of every
+        problem in the batch.
+        """
+        self.min_cost = self.cost()
+        self.mu[:] = self.LM_parameter
+        self.failed[:] = False
+        self.no_descent[:] = False
+        iterations = 0
+        for iter in range(self.maxIter):
+            if not np.any(self.active()):
+                break
+            self.backward_pass()
+            # the steps are negligible, no need to search
+            idx = np.flatnonzero(self.active())
+            negligible = (self.expected_reduction(idx, 1.0) <
+                          self.tol_fun*np.abs(self.min_cost[idx])) | \
+                (self.mu[idx] < 1e-5) & (self.gradient_norm(idx) < self.tol_grad)
+            self.converge[idx[negligible]] = True
+            self.forward_pass()
+            iterations += 1
+        self.status = {'iterations': iterations,
+                       'converged': int(np.count_nonzero(self.converge)),
+                       'no_descent': int(np.count_nonzero(self.no_descent)),
+                       'failed': int(np.count_nonzero(self.failed))}
+        return self.states, self.inputs, self.min_cost, self.converge
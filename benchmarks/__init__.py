@@ -0,0 +1,6 @@
+"""
+Reproducible solver benchmarks, run from the repository root with
+python -m benchmarks --help
+"""
+from benchmarks.scenarios import builders, default_solvers
+from benchmarks.run import build_problems, compare, measure, run_benchmark
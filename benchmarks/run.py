@@ -0,0 +1,287 @@
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+import numpy as np
+import scipy
+import osqp
+from ilqr import iterative_LQR
+from al_ilqr import augmented_Lagrangian_iLQR
+from batch_ilqr import batch_iterative_LQR
+from sqp import sequential_QP_optimizer
+from riccati import numba_available
+from benchmarks.scenarios import builders, default_solvers, quality_cases
+
+"Timing, memory and iteration benchmarks of the solvers on seeded scenarios"
+
+solvers = ('ilqr', 'ddp', 'cilqr', 'batch_ilqr', 'sqp', 'al_ilqr')
+
+
+def build_problems(scenario, horizon, batch_size, seed):
+    """
+    batch_size independent problems of one scenario, problem j is drawn from
+    the seed sequence (seed, j) so it does not depend on the batch size.
+    """
+    builder = builders[scenario]
+    return [builder(np.random.default_rng([seed, j]), horizon) for j in range(batch_size)]
+
+
+def setup_solver(solver, problems):
+    """
+    Fresh optimizers for the problems, ready to be called.
+    """
+    if solver == 'batch_ilqr':
+        system = problems[0].system
+        target_states = np.stack([problem.target_states for problem in problems])
+        optimizer = batch_iterative_LQR(system, target_states, system.dt)
+        optimizer.states[:, 0, :] = target_states[:, 0, :]
+        optimizer.inputs[...] = np.stack([problem.init_inputs for problem in problems])
+        return [optimizer]
+    optimizers = []
+    for problem in problems:
+        system = problem.system
+        if solver == 'sqp':
+            optimizer = sequential_QP_optimizer(
+                system, problem.constraint, problem.target_states, system.dt)
+            optimizer.set_init_inputs(np.array(problem.init_inputs, dtype=float))
+            optimizers.append(optimizer)
+            continue
+        if solver in ('ilqr', 'ddp'):
+            optimizer = iterative_LQR(system, problem.target_states, system.dt)
+            optimizer.ddp = solver == 'ddp'
+        elif solver == 'cilqr':
+            import cilqr
+            optimizer = cilqr.iterative_LQR(system, problem.target_states, system.dt)
+        elif solver == 'al_ilqr':
+            optimizer = augmented_Lagrangian_iLQR(
+                system, problem.constraint, problem.target_states, system.dt)
+        else:
+            raise ValueError("unknown solver %r" % (solver,))
+        optimizer.states[0, :] = problem.target_states[0, :]
+        optimizer.inputs = np.array(problem.init_inputs, dtype=float)
+        optimizers.append(optimizer)
+    return optimizers
+
+
+def solve_all(optimizers):
+    for optimizer in optimizers:
+        optimizer()
+
+
+def measure(solver, problems, repeats=5, warmup=1):
+    """
+    Latency of solving all problems, repeated with fresh optimizers, the
+    peak memory allocated during one extra solve (tracemalloc, not timed),
+    and the iterations, costs and convergence of the last timed solve.
+    """
+    latencies = []
+    for r in range(warmup + repeats):
+        optimizers = setup_solver(solver, problems)
+        start = time.perf_counter()
+        solve_all(optimizers)
+        elapsed = time.perf_counter() - start
+        if r >= warmup:
+            latencies.append(elapsed)
+    iterations = np.array([optimizer.status['iterations'] for optimizer in optimizers])
+    cost = np.concatenate([np.atleast_1d(optimizer.min_cost) for optimizer in optimizers])
+    converged = np.concatenate([np.atleast_1d(optimizer.converge) for optimizer in optimizers])
+
+    optimizers = setup_solver(solver, problems)
+    tracemalloc.start()
+    try:
+        solve_all(optimizers)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    latencies = np.array(latencies)
+    p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+    return {'repeats': repeats,
+            'latency_min': float(latencies.min()),
+            'latency_mean': float(latencies.mean()),
+            'latency_p50': float(p50),
+            'latency_p90': float(p90),
+            'latency_p99': float(p99),
+            'latency_per_problem_p50': float(p50)/len(problems),
+            'peak_memory_bytes': int(peak),
+            'iterations_mean': float(iterations.mean()),
+            'iterations_max': int(iterations.max()),
+            'cost_mean': float(cost.mean()),
+            'converged': int(np.count_nonzero(converged))}
+
+
+def run_quality(cases=quality_cases, log=None):
+    """
+    Solve every seeded problem of the quality cases once with each of their
+    solvers. Returns one result per problem and solver with the final cost,
+    iterations and convergence, log is called with every result.
+    """
+    results = []
+    for scenario, horizon, seeds, solver_names in cases:
+        for seed in seeds:
+            problems = build_problems(scenario, horizon, 1, seed)
+            for solver in solver_names:
+                optimizer = setup_solver(solver, problems)[0]
+                result = {'scenario': scenario, 'solver': solver, 'horizon': horizon,
+                          'seed': seed}
+                try:
+                    optimizer()
+                    result.update({'cost': float(optimizer.min_cost),
+                                   'iterations': int(optimizer.status['iterations']),
+                                   'converged': bool(optimizer.converge)})
+                except (np.linalg.LinAlgError, ValueError) as e:
+                    result['error'] = "%s: %s" % (type(e).__name__, e)
+                results.append(result)
+                if log is not None:
+                    log(result)
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def metadata(config):
+    return {'timestamp': datetime.now(timezone.utc).isoformat(),
+            'git_revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'numpy': np.__version__,
+            'scipy': scipy.__version__,
+            'osqp': osqp.__version__,
+            'numba': numba_available,
+            'config': config}
+
+
+def run_benchmark(scenarios=None, solver_names=None, horizons=(50, 500, 5000),
+                  batch_sizes=(1, 4), repeats=5, warmup=1, seed=0, log=None):
+    """
+    Sweep scenarios x solvers x horizons x batch sizes. Returns the benchmark
+    document: {'metadata': ..., 'results': [...], 'quality': [...]}, one
+    result per case and the run_quality results. A case whose solver raises
+    is recorded with an error message instead of measurements. log is called
+    with every finished result.
+    """
+    scenarios = list(scenarios or builders)
+    config = {'scenarios': scenarios, 'solvers': solver_names, 'horizons': list(horizons),
+              'batch_sizes': list(batch_sizes), 'repeats': repeats, 'warmup': warmup,
+              'seed': seed}
+    results = []
+    for scenario in scenarios:
+        for horizon in horizons:
+            for batch_size in batch_sizes:
+                problems = build_problems(scenario, horizon, batch_size, seed)
+                for solver in solver_names or default_solvers[scenario]:
+                    result = {'scenario': scenario, 'solver': solver,
+                              'horizon': horizon, 'batch_size': batch_size}
+                    try:
+                        result.update(measure(solver, problems, repeats, warmup))
+                    except (np.linalg.LinAlgError, ValueError) as e:
+                        result['error'] = "%s: %s" % (type(e).__name__, e)
+                    results.append(result)
+                    if log is not None:
+                        log(result)
+    return {'metadata': metadata(config), 'results': results,
+            'quality': run_quality(log=log)}
+
+
+def case_key(result):
+    return (result['scenario'], result['solver'], result['horizon'], result['batch_size'])
+
+
+def compare(baseline, current, tolerance=0.2):
+    """
+    Cases of current whose median latency grew by more than the fraction
+    tolerance over baseline, as (case, baseline p50, current p50) tuples.
+    """
+    reference = {case_key(result): result for result in baseline['results']
+                 if 'error' not in result}
+    regressions = []
+    for result in current['results']:
+        old = reference.get(case_key(result))
+        if old is None or 'error' in result:
+            continue
+        if result['latency_p50'] > (1.0 + tolerance)*old['latency_p50']:
+            regressions.append(
+                (case_key(result), old['latency_p50'], result['latency_p50']))
+    return regressions
+
+
+def quality_key(result):
+    return (result['scenario'], result['solver'], result['horizon'], result['seed'])
+
+
+def compare_quality(baseline, current, tolerance=1e-6):
+    """
+    Seeded problems of current whose final cost grew by more than the
+    fraction tolerance over baseline, as (case, baseline cost, current cost).
+    """
+    reference = {quality_key(result): result for result in baseline.get('quality', [])
+                 if 'error' not in result}
+    regressions = []
+    for result in current['quality']:
+        old = reference.get(quality_key(result))
+        if old is None or 'error' in result:
+            continue
+        if result['cost'] > old['cost'] + tolerance*abs(old['cost']):
+            regressions.append((quality_key(result), old['cost'], result['cost']))
+    return regressions
+
+
+def print_result(result):
+    if 'seed' in result:
+        case = "%-16s %-10s T=%-5d seed=%-2d" % quality_key(result)
+    else:
+        case = "%-16s %-10s T=%-5d B=%-3d" % case_key(result)
+    if 'error' in result:
+        print(case, result['error'])
+    elif 'seed' in result:
+        print(case, "cost %.6g  iterations %d  converged %s" % (
+            result['cost'], result['iterations'], result['converged']))
+    else:
+        print(case, "p50 %.4fs  p90 %.4fs  peak %.1f MB  iterations %.1f  cost %.6g" % (
+            result['latency_p50'], result['latency_p90'], result['peak_memory_bytes']/2**20,
+            result['iterations_mean'], result['cost_mean']))
+    sys.stdout.flush()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks',
+        description="Benchmark the trajectory optimizers on seeded scenarios.")
+    parser.add_argument('--scenarios', nargs='+', choices=sorted(builders))
+    parser.add_argument('--solvers', nargs='+', choices=solvers,
+                        help="default: the solvers suited to each scenario")
+    parser.add_argument('--horizons', nargs='+', type=int, default=[50, 500, 5000])
+    parser.add_argument('--batch-sizes', nargs='+', type=int, default=[1, 4])
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--baseline', help="earlier output to compare the median latencies with")
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    document = run_benchmark(args.scenarios, args.solvers, args.horizons, args.batch_sizes,
+                             args.repeats, args.warmup, args.seed, log=print_result)
+    with open(args.output, 'w') as f:
+        json.dump(document, f, indent=1)
+    if args.baseline is None:
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(baseline, document, args.tolerance)
+    for case, old, new in regressions:
+        print("regression %s: %.4fs -> %.4fs" % (case, old, new))
+    cost_regressions = compare_quality(baseline, document)
+    for case, old, new in cost_regressions:
+        print("cost regression %s: %.6g -> %.6g" % (case, old, new))
+    return 1 if regressions or cost_regressions else 0
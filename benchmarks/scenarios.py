@@ -0,0 +1,201 @@
+import numpy as np
+from systems import Car, CarAcceleration, DubinsCar
+from constraints import BubbleConstraint
+from distance_field import SignedDistanceField
+from pool_runner import TrajectoryProblem
+
+"""
+Seeded versions of the scenarios in ilqr_demo.py and sqp_demo.py. Every
+builder takes a numpy Generator and a horizon and returns a TrajectoryProblem;
+the noise comes from the generator only, so the same seed gives the same
+problem. The default horizon is the one of the demo.
+"""
+
+
+def curved_reference(horizon, dt, ref_vel, curv, x0=None):
+    """
+    Reference states [x, y, v, theta] driving along an arc of curvature curv
+    with the speed profile ref_vel.
+    """
+    target_states = np.zeros((horizon, 4))
+    if x0 is not None:
+        target_states[0, :] = x0
+    for i in range(1, horizon):
+        target_states[i, 0] = target_states[i-1, 0] + \
+            np.cos(target_states[i-1, 3])*dt*ref_vel[i - 1]
+        target_states[i, 1] = target_states[i-1, 1] + \
+            np.sin(target_states[i-1, 3])*dt*ref_vel[i - 1]
+        target_states[i, 2] = ref_vel[i]
+        target_states[i, 3] = target_states[i-1, 3] + curv*dt
+    return target_states
+
+
+def finite_difference_inputs(noisy_targets, dt, columns):
+    return np.diff(noisy_targets[:, columns], axis=0)/dt
+
+
+def bubble_constraint(centers, radius, vel_bounds=(0, 2)):
+    constraint = BubbleConstraint(centers.shape[0])
+    constraint.setup(centers, list(radius), list(vel_bounds))
+    return constraint
+
+
+def example_acc(rng, horizon=120):
+    dt = 0.2
+    a = 1.5
+    v_max = 11
+    ref_vel = np.zeros(horizon)
+    for i in range(40, horizon):
+        if ref_vel[i - 1] > v_max:
+            a = 0
+        ref_vel[i] = ref_vel[i - 1] + a*dt
+    target_states = curved_reference(horizon, dt, ref_vel, 0.1)
+    noisy_targets = target_states.copy()
+    noisy_targets[1:, 0] += rng.uniform(0, 3, horizon - 1)
+    noisy_targets[1:, 1] += rng.uniform(0, 3, horizon - 1)
+    noisy_targets[1:, 3] += rng.uniform(0, 0.5, horizon - 1)
+    system = Car()
+    system.set_dt(dt)
+    system.set_cost(
+        np.diag([50.0, 50.0, 1000.0, 0.0]), np.diag([3000.0, 1000.0]))
+    system.set_control_limit([-1.5, -0.3], [1.5, 0.3])
+    init_inputs = finite_difference_inputs(noisy_targets, dt, [2, 3])
+    return TrajectoryProblem(system, noisy_targets, init_inputs)
+
+
+def example_jerk(rng, horizon=100):
+    dt = 0.2
+    a = 1.5
+    v_max = 11
+    ref_vel = np.zeros(horizon)
+    ref_acc = np.zeros(horizon)
+    for i in range(40, horizon):
+        if ref_vel[i - 1] > v_max:
+            a = 0
+        ref_acc[i] = a
+        ref_vel[i] = ref_vel[i - 1] + a*dt
+    reference = curved_reference(horizon, dt, ref_vel, 0.1)
+    noisy_targets = np.zeros((horizon, 5))
+    noisy_targets[:, [0, 1, 2, 4]] = reference
+    noisy_targets[1:, 3] = ref_acc[1:]
+    noisy_targets[1:, 0] += rng.uniform(0, 1, horizon - 1)
+    noisy_targets[1:, 1] += rng.uniform(0, 1, horizon - 1)
+    noisy_targets[1:, 4] += rng.uniform(0, 0.1, horizon - 1)
+    system = CarAcceleration()
+    system.set_dt(dt)
+    system.set_cost(
+        np.diag([50.0, 50.0, 1000.0, 1000, 0.0]), np.diag([3000.0, 1000.0]))
+    system.set_control_limit([-6, -0.2], [6, 0.2])
+    init_inputs = finite_difference_inputs(noisy_targets, dt, [3, 4])
+    return TrajectoryProblem(system, noisy_targets, init_inputs)
+
+
+def example_dubins(rng, horizon=200):
+    dt = 0.2
+    v = 1.0
+    curv = 0.1
+    reference = curved_reference(horizon, dt, np.full(horizon, v), v*curv)
+    noisy_targets = reference[:, [0, 1, 3]]
+    noisy_targets[1:, :] += rng.uniform(0, 1, (horizon - 1, 3))
+    system = DubinsCar()
+    system.set_dt(dt)
+    system.set_cost(
+        100*np.diag([1.0, 1.0, 1.0]), np.diag([10.0, 100.0]))
+    system.set_control_limit([0, -0.2], [2, 0.2])
+    init_inputs = np.zeros((horizon - 1, system.control_size))
+    return TrajectoryProblem(system, noisy_targets, init_inputs)
+
+
+def sqp_car(horizon, dt, terminal_scale):
+    system = Car()
+    system.set_dt(dt)
+    system.set_cost(np.diag([50.0, 50.0, 10.0, 1.0]), np.diag([300.0, 1000.0]))
+    system.Q_f = system.Q*terminal_scale
+    system.set_control_limit([-1, -0.3], [1, 0.3])
+    return system
+
+
+def random_example(rng, horizon=80):
+    dt = 0.2
+    noisy = 0.5
+    ref_vel = np.ones(horizon)
+    target_states = curved_reference(horizon, dt, ref_vel, 0.1, [0, 0, 1, 0])
+    noisy_targets = target_states.copy()
+    noisy_targets[1:, 0] += rng.uniform(0, noisy, horizon - 1)
+    noisy_targets[1:, 1] += rng.uniform(0, noisy, horizon - 1)
+    noisy_targets[1:, 3] += rng.uniform(0, 0.1, horizon - 1)
+    centers = noisy_targets[:, :2].copy()
+    system = sqp_car(horizon, dt, horizon/100)
+    init_inputs = finite_difference_inputs(noisy_targets, dt, [2, 3])
+    constraint = bubble_constraint(centers, np.full(horizon, 0.6))
+    return TrajectoryProblem(system, noisy_targets, init_inputs, constraint, 'sqp')
+
+
+def corner_example(rng, horizon=80):
+    # deterministic, rng is accepted for a uniform builder signature
+    dt = 0.2
+    turn = horizon//2
+    steps = np.arange(horizon)
+    noisy_targets = np.zeros((horizon, 4))
+    noisy_targets[0, 2] = 1
+    noisy_targets[1:turn, 0] = dt*steps[1:turn]
+    noisy_targets[turn:, 0] = dt*(turn - 1)
+    noisy_targets[turn:, 1] = dt*(steps[turn:] - turn + 1)
+    # like the demo, the speed reference copies the heading
+    noisy_targets[turn:, 2] = np.pi/2
+    noisy_targets[turn:, 3] = np.pi/2
+    centers = noisy_targets[:, :2].copy()
+    system = sqp_car(horizon, dt, horizon/100)
+    init_inputs = finite_difference_inputs(noisy_targets, dt, [2, 3])
+    constraint = bubble_constraint(centers, np.full(horizon, 0.8))
+    return TrajectoryProblem(system, noisy_targets, init_inputs, constraint, 'sqp')
+
+
+def random_example_2(rng, horizon=80):
+    dt = 0.2
+    noisy = 0.4
+    line = np.concatenate([
+        np.linspace([-0.5, 0.2], [5, 5.6], num=100),
+        np.linspace([5, 5.6], [0, 10], num=100)])
+    # the bubbles are sized by the distance field, as in the demo
+    field = SignedDistanceField.from_points(
+        line, line.min(axis=0) - 2, line.max(axis=0) + 2, 0.05)
+    ref_vel = np.ones(horizon)
+    target_states = curved_reference(horizon, dt, ref_vel, 0.2, [0, 0, 1, 0])
+    noisy_targets = target_states.copy()
+    noisy_targets[1:, 0] += rng.uniform(0, noisy, horizon - 1)
+    noisy_targets[1:, 1] += rng.uniform(0, noisy, horizon - 1)
+    noisy_targets[1:, 3] += rng.uniform(0, 0.1, horizon - 1)
+    centers = noisy_targets[:, :2].copy()
+    system = sqp_car(horizon, dt, horizon/2)
+    init_inputs = finite_difference_inputs(noisy_targets, dt, [2, 3])
+    constraint = BubbleConstraint(horizon)
+    constraint.setup_free_space(field, centers, [0, 2])
+    return TrajectoryProblem(system, noisy_targets, init_inputs, constraint, 'sqp')
+
+
+builders = {
+    'example_acc': example_acc,
+    'example_jerk': example_jerk,
+    'example_dubins': example_dubins,
+    'random_example': random_example,
+    'corner_example': corner_example,
+    'random_example_2': random_example_2,
+}
+
+# solvers benchmarked on every scenario by default
+default_solvers = {
+    'example_acc': ('ilqr', 'ddp', 'cilqr', 'batch_ilqr'),
+    'example_jerk': ('ilqr', 'ddp', 'cilqr', 'batch_ilqr'),
+    'example_dubins': ('ilqr', 'ddp', 'cilqr', 'batch_ilqr'),
+    'random_example': ('sqp', 'al_ilqr'),
+    'corner_example': ('sqp', 'al_ilqr'),
+    'random_example_2': ('sqp', 'al_ilqr'),
+}
+
+# seeded problems whose solutions are compared solver against solver, as
+# (scenario, horizon, seeds, solvers); on these cilqr used to stop in poor
+# local minima the other solvers avoid
+quality_cases = [
+    ('example_acc', 120, range(4), ('ilqr', 'cilqr')),
+]
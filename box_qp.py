@@ -0,0 +1,93 @@
+import numpy as np
+from scipy.linalg import cho_factor, cho_solve
+
+"Box constrained quadratic program solved by projected Newton"
+
+
+def box_qp(H, g, lower, upper, x0=None, maxIter=100, minGrad=1e-8,
+           minRelImprove=1e-8, stepDec=0.6, minStep=1e-22, armijo=0.1):
+    """
+    Minimize 0.5*x'Hx + g'x subject to lower <= x <= upper.
+    Reference:
+    Control-Limited Differential Dynamic Programming
+    https://homes.cs.washington.edu/~todorov/papers/TassaICRA14.pdf
+    Returns x, the termination result, the Cholesky factor of H restricted to
+    the free (unclamped) dimensions as returned by scipy.linalg.cho_factor,
+    and the boolean mask of free dimensions.
+    result:
+        -1 Hessian is not positive definite
+         0 no descent direction found
+         1 maximum main iterations exceeded
+         2 maximum line-search iterations exceeded
+         4 improvement smaller than tolerance
+         5 gradient norm smaller than tolerance
+         6 all dimensions are clamped
+    """
+    n = H.shape[0]
+    lower = np.asarray(lower, dtype=float)
+    upper = np.asarray(upper, dtype=float)
+    clamped = np.zeros(n, dtype=bool)
+    free = np.ones(n, dtype=bool)
+    Hfree = None
+    if x0 is None:
+        x = np.where(np.isfinite(lower) & np.isfinite(upper), (lower + upper)/2, 0.0)
+    else:
+        x = np.asarray(x0, dtype=float).reshape(n)
+    x = np.clip(x, lower, upper)
+    x[~np.isfinite(x)] = 0.0
+
+    value = np.dot(x, g) + 0.5*np.dot(x, np.dot(H, x))
+    old_value = 0.0
+    result = 1
+    for iter in range(maxIter):
+        if iter > 0 and (old_value - value) < minRelImprove*abs(old_value):
+            result = 4
+            break
+        old_value = value
+        grad = g + np.dot(H, x)
+
+        old_clamped = clamped
+        clamped = ((x == lower) & (grad > 0)) | ((x == upper) & (grad < 0))
+        free = ~clamped
+        if np.all(clamped):
+            result = 6
+            break
+
+        if iter == 0 or np.any(old_clamped != clamped):
+            try:
+                Hfree = cho_factor(H[np.ix_(free, free)])
+            except np.linalg.LinAlgError:
+                Hfree = None
+                result = -1
+                break
+
+        if np.linalg.norm(grad[free]) < minGrad:
+            result = 5
+            break
+
+        # Newton step on the free dimensions, clamped ones stay at the bound
+        grad_clamped = g + np.dot(H, x*clamped)
+        search = np.zeros(n)
+        search[free] = -cho_solve(Hfree, grad_clamped[free]) - x[free]
+        sdotg = np.dot(search, grad)
+        if sdotg >= 0:
+            result = 0
+            break
+
+        # projected Armijo line search
+        step = 1.0
+        xc = np.clip(x + step*search, lower, upper)
+        vc = np.dot(xc, g) + 0.5*np.dot(xc, np.dot(H, xc))
+        while (vc - old_value)/(step*sdotg) < armijo:
+            step *= stepDec
+            xc = np.clip(x + step*search, lower, upper)
+            vc = np.dot(xc, g) + 0.5*np.dot(xc, np.dot(H, xc))
+            if step < minStep:
+                result = 2
+                break
+        if result == 2:
+            # keep the last point, the failed trial can be worse
+            break
+        x = xc
+        value = vc
+    return x, result, Hfree, free
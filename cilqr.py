@@ -1,17 +1,15 @@
 import numpy as np
-import scipy.sparse as sparse
-from scipy.linalg import block_diag
-import osqp
-
-import random
-from matplotlib import pyplot as plt
-import timeit
-from systems import *
+from scipy.linalg import cho_solve
+from deadline import Deadline
+from instrumentation import phase
+from line_search import LineSearch
+from box_qp import box_qp
+from regularization import Regularization
 
 "iterative LQR with Quadratic cost"
 
 
-class iterative_LQR:
+class iterative_LQR(LineSearch):
     """
     iterative LQR can be used as a controller/trajectory optimizer.
     Reference:
@@ -20,6 +18,13 @@ class iterative_LQR:
     Iterative Linear Quadratic Regulator Design for Nonlinear Biological Movement Systems
     https://homes.cs.washington.edu/~todorov/papers/LiICINCO04.pdf
     cost function: x'Qx + u'Ru
+    The regularization, line search and convergence rules are those of
+    line_search.LineSearch; the Levenberg-Marquardt term is added to Vxx,
+    and a step whose box QP fails or whose Quu is not positive definite
+    restarts the backward pass with more regularization. The solve starts
+    from the rollout of the initial inputs: the box QP clamps the step
+    against the control limits, and around any other state trajectory it
+    saturates the inputs towards a poor local minimum.
     """
 
     def __init__(self, sys, target_states, dt):
@@ -37,54 +42,57 @@ class iterative_LQR:
         self.maxIter = 100
         self.min_cost = 0.0
         self.LM_parameter = 0.0
-        self.input_limit_lambda = 1e-4
+        self.adaptive_LM = True
+        self.regularization = Regularization()
+        self.tol_grad = 1e-4
+        self.armijo = 0.1
+        self.tol_fun = 1e-6
+        self.min_step_change = 0.1
+        self.no_descent = False
+        self.rejected_step = None
+        self.expected = np.zeros(2)
         self.alpha_terminal = 1e-2
+        self.parallel_line_search = False
+        self.time_budget = None
+        self.deadline = Deadline()
+        self.alpha = 0.0
+        self.status = {}
+        self.trace = None
+        self.line_search_trials = 0
         self.states = np.zeros(
             (self.horizon, self.n_states))
         self.inputs = np.zeros(
             (self.horizon - 1, self.m_inputs))
+        self.k = np.zeros((self.horizon - 1, self.m_inputs, 1))
 
-    def cost(self):
-        states_diff = self.states - self.target_states
-        cost = 0.0
-        for i in range(self.horizon - 1):
-            state = np.reshape(states_diff[i, :], (-1, 1))
-            control = np.reshape(self.inputs[i, :], (-1, 1))
-            cost += np.dot(np.dot(state.T, self.Q), state) + \
-                np.dot(np.dot(control.T, self.R), control)
-        state = np.reshape(states_diff[-1, :], (-1, 1))
-        cost += np.dot(np.dot(state.T, self.Qf), state)
-        return cost[0, 0]
-
-    def forward_pass(self):
-        prev_states = np.copy(self.states)
-        prev_inputs = np.copy(self.inputs)
-        alpha = 1.0
-        cnt = 50
-        while (cnt >= 0):
-            cnt -= 1
-            for i in range(0, self.horizon - 1):
-                self.inputs[i, :] = self.inputs[i, :] + alpha*np.reshape(self.k[i, :, :], (-1,)) + np.reshape(
-                    np.dot(self.K[i, :, :], np.reshape(self.states[i, :] - prev_states[i, :], (-1, 1))), (-1,))
-                if self.system.control_limited:
-                    for j in range(self.m_inputs):
-                        self.inputs[i, j] = min(max(
-                            self.inputs[i, j], self.system.control_lower_limit[j]), self.system.control_upper_limit[j])
-                self.states[i + 1, :] = self.system.model_f(
-                    self.states[i, :], self.inputs[i, :])
-            cost = self.cost()
-            if cost < self.min_cost:
-                self.min_cost = cost
-                break
-            else:
-                self.states = np.copy(prev_states)
-                self.inputs = np.copy(prev_inputs)
-                if alpha < self.alpha_terminal:
-                    self.converge = True
-                    break
-                alpha /= 2.0
+    def start_solve(self):
+        self.states = self.system.rollout(self.states[0, :], self.inputs)
 
     def backward_pass(self):
+        prev_k = self.k
+        with phase(self.trace, 'linearize'):
+            df_dx_all, df_du_all = self.system.linearize(self.states, self.inputs)
+        with phase(self.trace, 'backward_pass'):
+            while True:
+                failed = self.backward_sweep(df_dx_all, df_du_all, prev_k)
+                if failed < 0:
+                    break
+                if not (self.adaptive_LM and self.regularization.increase()):
+                    raise np.linalg.LinAlgError(
+                        "Quu is not positive definite at step %d" % failed)
+
+    def backward_sweep(self, df_dx_all, df_du_all, prev_k):
+        """
+        One sweep of the backward pass with the current regularization, which
+        also sets the expected cost change alpha*dV[0] + alpha^2*dV[1] of the
+        step from the Q function without regularization. Returns the step at
+        which the box QP failed or Quu was not positive definite, or -1.
+        Without adaptive_LM such steps fall back to an unconstrained solve
+        and the sweep always completes. A sweep stops early, returning -1,
+        once the deadline expires; the solve then stops without a forward
+        pass.
+        """
+        mu = self.regularization.value
         self.k = np.zeros((self.horizon - 1, self.m_inputs, 1))
         self.K = np.zeros((self.horizon - 1, self.m_inputs, self.n_states))
         Vx = 2.0 *\
@@ -94,144 +102,51 @@ class iterative_LQR:
         dl_dxdx = 2.0*self.Q
         dl_dudu = 2.0*self.R
         dl_dudx = np.zeros((self.m_inputs, self.n_states))
+        dV = np.zeros(2)
         for i in range(self.horizon - 2, -1, -1):
+            if self.deadline.expired():
+                return -1
             u = self.inputs[i, :]
             x = self.states[i, :]
-            df_du = self.system.compute_df_du(x, u)
-            df_dx = self.system.compute_df_dx(x, u)
+            df_du = df_du_all[i]
+            df_dx = df_dx_all[i]
             dl_dx = 2.0*np.dot(self.Q, x - self.target_states[i, :])
             dl_du = 2.0*np.dot(self.R, u)
             Qx = dl_dx + np.dot(df_dx.T, Vx)
             Qu = dl_du + np.dot(df_du.T, Vx)
-            Vxx_augmented = Vxx + self.LM_parameter * np.eye(self.n_states)
+            Vxx_augmented = Vxx + mu * np.eye(self.n_states)
             Qxx = dl_dxdx + np.dot(np.dot(df_dx.T, Vxx_augmented), df_dx)
             Quu = dl_dudu + np.dot(np.dot(df_du.T, Vxx_augmented), df_du)
             Qux = dl_dudx + np.dot(np.dot(df_du.T, Vxx_augmented), df_dx)
-            Quu_inv = np.linalg.inv(Quu)
-
-            if (self.control_limited):
-                P = sparse.csc_matrix(Quu)
-                q = 2*Qu
-                A = sparse.csc_matrix(np.eye(self.m_inputs))
-                l = self.system.control_lower_limit - self.inputs[i, :]
-                u = self.system.control_upper_limit - self.inputs[i, :]
-                prob = osqp.OSQP()
-
-                # Setup workspace and change alpha parameter
-                prob.setup(P, q, A, l, u, verbose=False)
-
-                # Solve problem
-                res = prob.solve()
-
-            k = -np.dot(Quu_inv, Qu)
-            K = -np.dot(Quu_inv, Qux)
-            if (self.control_limited):
-                flag = True
-                for it in res.y:
-                    flag = flag and abs(it) > self.input_limit_lambda
-                if flag:
-                    k = res.x;
-                    K = np.zeros((self.m_inputs, self.n_states))
-
-            self.k[i, :, :] = np.reshape(k, (-1, 1), order='F')
+            if self.control_limited:
+                lower = np.asarray(self.system.control_lower_limit) - u
+                upper = np.asarray(self.system.control_upper_limit) - u
+                k, result, Hfree, free = box_qp(
+                    Quu, Qu, lower, upper, prev_k[i, :, 0])
+                K = np.zeros((self.m_inputs, self.n_states))
+                if result < 1:
+                    if self.adaptive_LM:
+                        return i
+                    k = -np.linalg.solve(Quu, Qu)
+                    K = -np.linalg.solve(Quu, Qux)
+                elif np.any(free):
+                    K[free, :] = -cho_solve(Hfree, Qux[free, :])
+            else:
+                if self.adaptive_LM:
+                    try:
+                        np.linalg.cholesky(Quu)
+                    except np.linalg.LinAlgError:
+                        return i
+                k = -np.linalg.solve(Quu, Qu)
+                K = -np.linalg.solve(Quu, Qux)
+
+            self.k[i, :, 0] = k
             self.K[i, :, :] = K
-            Vx = Qx + np.dot(K.T, Qu)
-            Vxx = Qxx + np.dot(K.T, Qux)
-
-    def __call__(self):
-        self.min_cost = self.cost()
-        for iter in range(self.maxIter):
-            # print(iter)
-            # print(self.cost())
-            if (self.converge):
-                break
-            self.backward_pass()
-            self.forward_pass()
-        return self.states
-
-
-
-def example_acc():
-    horizon = 120
-    target_states = np.zeros((horizon, 4))
-    noisy_targets = np.zeros((horizon, 4))
-    ref_vel = np.zeros(horizon)
-    dt = 0.2
-    curv = 0.1
-    a = 1.5
-    v_max = 11
-    car_system = Car()
-    car_system.set_dt(dt)
-    car_system.set_cost(
-        np.diag([50.0, 50.0, 1000.0, 0.0]), np.diag([3000.0, 1000.0]))
-    car_system.set_control_limit([-1.5, -0.3], [1.5, 0.3])
-    car_system.Q_f = car_system.Q*2
-    init_inputs = np.zeros((horizon - 1, car_system.control_size))
-
-    for i in range(40, horizon):
-        if ref_vel[i - 1] > v_max:
-            a = 0
-        ref_vel[i] = ref_vel[i - 1] + a*dt
-    for i in range(1, horizon):
-        target_states[i, 0] = target_states[i-1, 0] + \
-            np.cos(target_states[i-1, 3])*dt*ref_vel[i - 1]
-        target_states[i, 1] = target_states[i-1, 1] + \
-            np.sin(target_states[i-1, 3])*dt*ref_vel[i - 1]
-        target_states[i, 2] = ref_vel[i]
-        target_states[i, 3] = target_states[i-1, 3] + curv*dt
-        noisy_targets[i, 0] = target_states[i, 0] + random.uniform(0, 15)
-        noisy_targets[i, 1] = target_states[i, 1] + random.uniform(0, 15)
-        noisy_targets[i, 2] = ref_vel[i]
-        noisy_targets[i, 3] = target_states[i, 3] + random.uniform(0, 0.5)
-
-    for i in range(1, horizon):
-        # init_inputs[i - 1, 0] = 0.3
-        init_inputs[i - 1, 0] = (noisy_targets[i, 2] -
-                                 noisy_targets[i - 1, 2])/dt
-        init_inputs[i - 1, 1] = (noisy_targets[i, 3] -
-                                 noisy_targets[i - 1, 3])/dt
-
-    optimizer = iterative_LQR(
-        car_system, noisy_targets, dt)
-    optimizer.inputs = init_inputs
-
-    start_time = timeit.default_timer()
-    optimizer()
-    elapsed = timeit.default_timer() - start_time
-    print("elapsed time: ", elapsed)
-
-    jerks = np.zeros(horizon)
-    for i in range(1, horizon - 1):
-        jerks[i] = (optimizer.inputs[i, 0] - optimizer.inputs[i - 1, 0])/dt
-
-    plt.figure
-    plt.title('jerks')
-    plt.plot(jerks, '--r', label='jerks', linewidth=2)
-    plt.figure(figsize=(8*1.1, 6*1.1))
-    plt.title('iLQR: state vs. time.  ')
-    plt.plot(optimizer.states[:, 2], '-b', linewidth=1.0, label='speed')
-    plt.plot(ref_vel, '-r', linewidth=1.0, label='target speed')
-    plt.ylabel('speed')
-    plt.figure(figsize=(8*1.1, 6*1.1))
-    plt.title('iLQR: inputs vs. time.  ')
-    plt.plot(optimizer.inputs[:, 0], '-r',
-             linewidth=1.0, label='Acceleration')
-    plt.plot(optimizer.inputs[:, 1], '-b',
-             linewidth=1.0, label='turning rate')
-    plt.ylabel('acceleration and turning rate input')
-    plt.figure(figsize=(8*1.1, 6*1.1))
-    plt.title('iLQR: 2D, x and y.  ')
-    plt.axis('equal')
-    plt.plot(noisy_targets[:, 0],
-             noisy_targets[:, 1], '--r', label='Target', linewidth=2)
-    plt.plot(optimizer.states[:, 0], optimizer.states[:, 1],
-             '-+k', label='iLQR', linewidth=1.0)
-    plt.legend(loc='upper left')
-    plt.xlabel('x (meters)')
-    plt.ylabel('y (meters)')
-    plt.show()
-
-if __name__ == '__main__':
-    # example_dubins()
-    # example_jerk()
-    example_acc()
+            fu_k = np.dot(df_du, k)
+            dV[0] += np.dot(k, Qu)
+            dV[1] += 0.5*(np.dot(k, np.dot(Quu, k)) - mu*np.dot(fu_k, fu_k))
+            Vx = Qx + np.dot(K.T, np.dot(Quu, k)) + np.dot(K.T, Qu) + np.dot(Qux.T, k)
+            Vxx = Qxx + np.dot(np.dot(K.T, Quu), K) + np.dot(K.T, Qux) + np.dot(Qux.T, K)
+            Vxx = 0.5*(Vxx + Vxx.T)
+        self.expected = dV
+        return -1
@@ -0,0 +1,578 @@
+import warnings
+import weakref
+import numpy as np
+from collections import OrderedDict
+
+"Symbolic differentiation of traced dynamics models into generated NumPy code"
+
+
+class Expr:
+    """
+    Node of a scalar expression graph. Nodes are interned, structurally equal
+    expressions are the same object, which gives common subexpression
+    elimination for free. Supports the arithmetic operators and the NumPy
+    ufuncs in ufunc_rules; anything else, like comparisons, raises TypeError
+    and so ends the trace.
+    """
+    __slots__ = ('op', 'args', '__weakref__')
+
+    def __init__(self, op, args):
+        self.op = op
+        self.args = args
+
+    def __add__(self, other):
+        return add(self, lift(other))
+
+    def __radd__(self, other):
+        return add(lift(other), self)
+
+    def __sub__(self, other):
+        return sub(self, lift(other))
+
+    def __rsub__(self, other):
+        return sub(lift(other), self)
+
+    def __mul__(self, other):
+        return mul(self, lift(other))
+
+    def __rmul__(self, other):
+        return mul(lift(other), self)
+
+    def __truediv__(self, other):
+        return div(self, lift(other))
+
+    def __rtruediv__(self, other):
+        return div(lift(other), self)
+
+    def __pow__(self, other):
+        return power(self, lift(other))
+
+    def __neg__(self):
+        return neg(self)
+
+    def __pos__(self):
+        return self
+
+    def __bool__(self):
+        raise TypeError("the truth value of a traced expression is unknown")
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        return apply_ufunc(ufunc, method, inputs, kwargs)
+
+    def __array_function__(self, func, types, args, kwargs):
+        return apply_function(func, args, kwargs)
+
+
+nodes = weakref.WeakValueDictionary()
+
+
+def intern(op, *args):
+    key = (op,) + args
+    node = nodes.get(key)
+    if node is None:
+        node = Expr(op, args)
+        nodes[key] = node
+    return node
+
+
+def const(value):
+    return intern('const', float(value))
+
+
+def var(index):
+    return intern('var', index)
+
+
+def is_const(e, value=None):
+    return e.op == 'const' and (value is None or e.args[0] == value)
+
+
+def lift(x):
+    if isinstance(x, Expr):
+        return x
+    if isinstance(x, (int, float, np.number)) or (isinstance(x, np.ndarray) and x.ndim == 0):
+        return const(x)
+    raise TypeError("cannot trace %r" % (x,))
+
+
+def add(a, b):
+    if is_const(a) and is_const(b):
+        return const(a.args[0] + b.args[0])
+    if is_const(a, 0.0):
+        return b
+    if is_const(b, 0.0):
+        return a
+    return intern('add', a, b)
+
+
+def sub(a, b):
+    if is_const(a) and is_const(b):
+        return const(a.args[0] - b.args[0])
+    if is_const(b, 0.0):
+        return a
+    if is_const(a, 0.0):
+        return neg(b)
+    if a is b:
+        return const(0.0)
+    return intern('sub', a, b)
+
+
+def mul(a, b):
+    if is_const(a) and is_const(b):
+        return const(a.args[0]*b.args[0])
+    if is_const(a, 0.0) or is_const(b, 0.0):
+        return const(0.0)
+    if is_const(a, 1.0):
+        return b
+    if is_const(b, 1.0):
+        return a
+    if is_const(a, -1.0):
+        return neg(b)
+    if is_const(b, -1.0):
+        return neg(a)
+    if is_const(a):
+        a, b = b, a
+    # constants last, signs folded into them, so e.g. -sin(x)*v*dt is
+    # emitted as one product with v and one with -dt
+    if is_const(b):
+        if a.op == 'neg':
+            return mul(a.args[0], const(-b.args[0]))
+        if a.op == 'mul' and is_const(a.args[1]):
+            return mul(a.args[0], const(a.args[1].args[0]*b.args[0]))
+    elif a.op == 'neg':
+        return neg(mul(a.args[0], b))
+    elif b.op == 'neg':
+        return neg(mul(a, b.args[0]))
+    return intern('mul', a, b)
+
+
+def div(a, b):
+    if is_const(b):
+        return mul(a, const(1.0/b.args[0]))
+    if is_const(a, 0.0):
+        return a
+    return intern('div', a, b)
+
+
+def neg(a):
+    if is_const(a):
+        return const(-a.args[0])
+    if a.op == 'neg':
+        return a.args[0]
+    return intern('neg', a)
+
+
+def power(a, b):
+    if not is_const(b):
+        return exp(mul(b, log(a)))
+    if is_const(b, 0.0):
+        return const(1.0)
+    if is_const(b, 1.0):
+        return a
+    if is_const(a):
+        return const(a.args[0]**b.args[0])
+    return intern('pow', a, b)
+
+
+def function(op, numpy_function):
+    def apply(a):
+        if is_const(a):
+            return const(numpy_function(a.args[0]))
+        return intern(op, a)
+    return apply
+
+
+sin = function('sin', np.sin)
+cos = function('cos', np.cos)
+tan = function('tan', np.tan)
+exp = function('exp', np.exp)
+log = function('log', np.log)
+sqrt = function('sqrt', np.sqrt)
+tanh = function('tanh', np.tanh)
+arctan = function('arctan', np.arctan)
+
+
+def arctan2(y, x):
+    if is_const(y) and is_const(x):
+        return const(np.arctan2(y.args[0], x.args[0]))
+    return intern('arctan2', y, x)
+
+
+def square(a):
+    return mul(a, a)
+
+
+ufunc_rules = {
+    np.add: add,
+    np.subtract: sub,
+    np.multiply: mul,
+    np.true_divide: div,
+    np.power: power,
+    np.negative: neg,
+    np.positive: lambda a: a,
+    np.reciprocal: lambda a: div(const(1.0), a),
+    np.square: square,
+    np.sin: sin,
+    np.cos: cos,
+    np.tan: tan,
+    np.exp: exp,
+    np.log: log,
+    np.sqrt: sqrt,
+    np.tanh: tanh,
+    np.arctan: arctan,
+    np.arctan2: arctan2,
+}
+
+
+class Vector:
+    """
+    1-D array of traced expressions standing in for the state or input
+    vector, and for vectors built from them. Components are read with
+    x[..., k] or x[k], slices and index lists give Vectors again.
+    """
+
+    def __init__(self, items):
+        self.items = list(items)
+
+    @property
+    def shape(self):
+        return (len(self.items),)
+
+    @property
+    def ndim(self):
+        return 1
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            key = tuple(k for k in key if k is not Ellipsis)
+            if len(key) != 1:
+                raise TypeError("only the last axis of a traced vector can be indexed")
+            key = key[0]
+        if isinstance(key, slice):
+            return Vector(self.items[key])
+        if isinstance(key, (list, np.ndarray)):
+            return Vector(self.items[k] for k in key)
+        return self.items[key]
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        return apply_ufunc(ufunc, method, inputs, kwargs)
+
+    def __array_function__(self, func, types, args, kwargs):
+        return apply_function(func, args, kwargs)
+
+    def __add__(self, other):
+        return np.add(self, other)
+
+    def __radd__(self, other):
+        return np.add(other, self)
+
+    def __sub__(self, other):
+        return np.subtract(self, other)
+
+    def __rsub__(self, other):
+        return np.subtract(other, self)
+
+    def __mul__(self, other):
+        return np.multiply(self, other)
+
+    def __rmul__(self, other):
+        return np.multiply(other, self)
+
+    def __truediv__(self, other):
+        return np.true_divide(self, other)
+
+    def __rtruediv__(self, other):
+        return np.true_divide(other, self)
+
+    def __pow__(self, other):
+        return np.power(self, other)
+
+    def __neg__(self):
+        return np.negative(self)
+
+
+def components(x, size):
+    """
+    x as a list of size expressions, broadcasting scalars.
+    """
+    if isinstance(x, Vector):
+        items = x.items
+    elif isinstance(x, np.ndarray) and x.ndim == 1:
+        items = list(x)
+    else:
+        return [lift(x)]*size
+    if len(items) != size:
+        raise TypeError("cannot broadcast a vector of %d to %d" % (len(items), size))
+    return [lift(item) for item in items]
+
+
+def apply_ufunc(ufunc, method, inputs, kwargs):
+    rule = ufunc_rules.get(ufunc)
+    if method != '__call__' or kwargs or rule is None:
+        return NotImplemented
+    sizes = [len(x) for x in inputs if isinstance(x, Vector) or
+             (isinstance(x, np.ndarray) and x.ndim == 1)]
+    if not sizes:
+        return rule(*[lift(x) for x in inputs])
+    columns = [components(x, sizes[0]) for x in inputs]
+    return Vector(rule(*args) for args in zip(*columns))
+
+
+def apply_function(func, args, kwargs):
+    axis = kwargs.get('axis', args[1] if len(args) > 1 else 0)
+    if func is np.stack and axis in (0, -1):
+        return Vector(lift(item) for item in args[0])
+    if func is np.concatenate and axis in (0, -1):
+        return Vector(item for x in args[0] for item in components(x, len(x)))
+    return NotImplemented
+
+
+def recording(system, names):
+    """
+    system as an instance of a subclass that adds the name of every instance
+    attribute read to the set names. It shares the attributes of system.
+    """
+    class Recording(type(system)):
+        def __getattribute__(self, name):
+            if name in object.__getattribute__(self, '__dict__'):
+                names.add(name)
+            return super().__getattribute__(name)
+    proxy = object.__new__(Recording)
+    proxy.__dict__ = system.__dict__
+    return proxy
+
+
+def trace(system, names=None):
+    """
+    Evaluate the model of system on symbolic state and input vectors.
+    Returns the n output expressions. Raises TypeError (or another error of
+    the model) if the model uses anything that cannot be traced. The names of
+    the attributes of system the model reads are added to names if given.
+    """
+    n = system.state_size
+    m = system.control_size
+    X = Vector(var(k) for k in range(n))
+    U = Vector(var(n + k) for k in range(m))
+    model = system if names is None else recording(system, names)
+    if system.overrides('model_f_batch') or not system.overrides('model_f'):
+        out = model.model_f_batch(X, U)
+    else:
+        out = model.model_f(X, U)
+    return components(out, n)
+
+
+derivative_rules = {
+    'add': lambda a, b, da, db: add(da, db),
+    'sub': lambda a, b, da, db: sub(da, db),
+    'mul': lambda a, b, da, db: add(mul(da, b), mul(a, db)),
+    'div': lambda a, b, da, db: div(sub(mul(da, b), mul(a, db)), mul(b, b)),
+    'arctan2': lambda y, x, dy, dx: div(sub(mul(x, dy), mul(y, dx)), add(mul(x, x), mul(y, y))),
+    'neg': lambda a, da: neg(da),
+    'sin': lambda a, da: mul(cos(a), da),
+    'cos': lambda a, da: neg(mul(sin(a), da)),
+    'tan': lambda a, da: mul(add(const(1.0), square(tan(a))), da),
+    'exp': lambda a, da: mul(exp(a), da),
+    'log': lambda a, da: div(da, a),
+    'sqrt': lambda a, da: div(da, mul(const(2.0), sqrt(a))),
+    'tanh': lambda a, da: mul(sub(const(1.0), square(tanh(a))), da),
+    'arctan': lambda a, da: div(da, add(const(1.0), square(a))),
+}
+
+
+def derivative(e, k, memo):
+    """
+    d e / d var(k), memo caches the derivatives of shared subexpressions.
+    """
+    key = (e, k)
+    if key in memo:
+        return memo[key]
+    if e.op == 'const':
+        d = const(0.0)
+    elif e.op == 'var':
+        d = const(1.0 if e.args[0] == k else 0.0)
+    elif e.op == 'pow':
+        a, b = e.args
+        d = mul(mul(b, power(a, const(b.args[0] - 1.0))), derivative(a, k, memo))
+    else:
+        args = e.args
+        d = derivative_rules[e.op](*args, *[derivative(a, k, memo) for a in args])
+    memo[key] = d
+    return d
+
+
+templates = {
+    'add': '%s + %s',
+    'sub': '%s - %s',
+    'mul': '%s*%s',
+    'div': '%s/%s',
+    'pow': '%s**%s',
+    'neg': '-%s',
+    'arctan2': 'np.arctan2(%s, %s)',
+}
+
+
+def emit(outputs, n):
+    """
+    Source of generated(X, U) returning one array per entry of outputs, a
+    list of (shape, {index: Expr}) with the nonzero entries.
+    """
+    header = []
+    lines = ['def generated(X, U):',
+             '    X = np.asarray(X, dtype=float)',
+             '    U = np.asarray(U, dtype=float)',
+             '    shape = X.shape[:-1]',
+             '    if shape != U.shape[:-1]:',
+             '        shape = np.broadcast_shapes(shape, U.shape[:-1])']
+    names = {}
+
+    def visit(e):
+        if e.op == 'const':
+            return repr(e.args[0])
+        if e in names:
+            return names[e]
+        if e.op == 'var':
+            k = e.args[0]
+            code = 'X[..., %d]' % k if k < n else 'U[..., %d]' % (k - n)
+        elif e.op in templates:
+            code = templates[e.op] % tuple(visit(a) for a in e.args)
+        else:
+            code = 'np.%s(%s)' % (e.op, visit(e.args[0]))
+        names[e] = 't%d' % len(names)
+        lines.append('    %s = %s' % (names[e], code))
+        return names[e]
+
+    results = []
+    for i, (shape, entries) in enumerate(outputs):
+        out = 'out%d' % i
+        # every output starts as a copy of its constant entries
+        template = np.zeros(shape)
+        assignments = []
+        for index, e in entries.items():
+            if e.op == 'const':
+                template[index] = e.args[0]
+            else:
+                assignments.append('    %s[..., %s] = %s' % (out, ', '.join(map(str, index)), visit(e)))
+        header.append('template%d = np.array(%r)' % (i, template.tolist()))
+        lines.append('    %s = np.empty(shape + %r)' % (out, shape))
+        lines.append('    %s[...] = template%d' % (out, i))
+        lines.extend(assignments)
+        results.append(out)
+    lines.append('    return %s' % ', '.join(results))
+    return '\n'.join(header + lines) + '\n'
+
+
+def generate_source(system, order=1, names=None):
+    """
+    Source of a vectorized function of (X, U) returning the same arrays as
+    System.derivatives(X, U, order). The attributes of system the model reads
+    are added to names if given, see trace.
+    """
+    n = system.state_size
+    m = system.control_size
+    f = trace(system, names)
+    memo = {}
+    J = [[derivative(f[i], k, memo) for k in range(n + m)] for i in range(n)]
+
+    def nonzero(shape, value):
+        entries = {}
+        for index in np.ndindex(*shape):
+            e = value(*index)
+            if not is_const(e, 0.0):
+                entries[index] = e
+        return shape, entries
+
+    outputs = [nonzero((n, n), lambda i, j: J[i][j]),
+               nonzero((n, m), lambda i, a: J[i][n + a])]
+    if order > 1:
+        H = {}
+
+        def hessian(i, k, l):
+            # symmetric, differentiate once per pair
+            k, l = max(k, l), min(k, l)
+            if (i, k, l) not in H:
+                H[i, k, l] = derivative(J[i][k], l, memo)
+            return H[i, k, l]
+        outputs += [nonzero((n, n, n), lambda i, j, k: hessian(i, j, k)),
+                    nonzero((n, m, m), lambda i, a, b: hessian(i, n + a, n + b)),
+                    nonzero((n, m, n), lambda i, a, j: hessian(i, n + a, j))]
+    return emit(outputs, n)
+
+
+def parameters(system, names):
+    """
+    Values of the attributes names of system. The generated code has them
+    baked in as constants, so it is regenerated when they change.
+    """
+    items = []
+    for name in names:
+        value = getattr(system, name, None)
+        if isinstance(value, np.ndarray):
+            items.append((name, value.shape, value.tobytes()))
+        elif isinstance(value, (list, tuple)):
+            try:
+                items.append((name, tuple(float(v) for v in value)))
+            except (TypeError, ValueError):
+                items.append((name, id(value)))
+        else:
+            try:
+                items.append((name, hash(value)))
+            except TypeError:
+                items.append((name, id(value)))
+    return tuple(items)
+
+
+class Generated:
+    """
+    Derivative functions of one system: the names of the attributes its model
+    reads, and the functions for the latest parameter values, at most
+    generated_cache_size of them, least recently used first.
+    """
+
+    def __init__(self):
+        self.names = None
+        self.functions = OrderedDict()
+
+
+generated = weakref.WeakKeyDictionary()
+generated_cache_size = 8
+
+
+def derivative_function(system, order=1):
+    """
+    Compiled derivative function of system, see generate_source, or None if
+    its model cannot be traced. Kept per system and values of the attributes
+    the model reads, so changing e.g. the costs does not regenerate it.
+    """
+    cache = generated.get(system)
+    if cache is None:
+        cache = generated[system] = Generated()
+    if cache.names is not None:
+        key = (order, parameters(system, cache.names))
+        if key in cache.functions:
+            cache.functions.move_to_end(key)
+            return cache.functions[key]
+    names = set()
+    try:
+        source = generate_source(system, order, names)
+    except (TypeError, ValueError, IndexError, KeyError, AttributeError) as error:
+        warnings.warn("the model of %s cannot be traced (%s: %s), its derivatives fall back "
+                      "to finite differences" % (type(system).__name__, type(error).__name__, error),
+                      stacklevel=3)
+        function = None
+    else:
+        namespace = {'np': np}
+        exec(compile(source, '<generated derivatives of %s>' % type(system).__name__,
+                     'exec'), namespace)
+        function = namespace['generated']
+    cache.names = tuple(sorted(names))
+    key = (order, parameters(system, cache.names))
+    cache.functions[key] = function
+    while len(cache.functions) > generated_cache_size:
+        cache.functions.popitem(last=False)
+    return function
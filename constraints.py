@@ -1,48 +1,274 @@
 import numpy as np
-from scipy.linalg import block_diag
+import scipy.sparse as sparse
+
+"State constraints lower <= g(x) <= upper evaluated over the whole horizon"
+
+
+def as_steps(a, horizon, shape):
+    """
+    A parameter shared by all steps (of shape shape) or given per step
+    (at least horizon steps) as an array of shape (horizon,) + shape.
+    """
+    a = np.asarray(a, dtype=float)
+    if a.ndim > len(shape):
+        a = a[:horizon]
+    return np.broadcast_to(a, (horizon,) + shape)
+
 
 class Constraint:
-    def __init__(self, state_size, constraint_size):
+    """
+    Constraints lower <= g(x_t) <= upper on the first horizon states of a
+    trajectory, constraint_size rows per step. Subclasses implement evaluate,
+    which returns g and its Jacobian for all steps in single array
+    operations, and limits. The optimizers use the linearization at the
+    current states: the Jacobian blocks C_t and the bounds of C_t x_t
+    (get_linear_bounds), or the residuals (get_residuals).
+    States may carry leading batch dimensions, (..., T, n).
+    """
+
+    def __init__(self, state_size, constraint_size, horizon=0):
         self.state_size = state_size
         self.constraint_size = constraint_size
-        self.horizon = 0
-
-class BubbleConstraint(Constraint):
-    def __init__(self, horizon):
-        super().__init__(4, 2)
         self.horizon = horizon
-    
+
+    def evaluate(self, states):
+        """
+        Values g (..., horizon, constraint_size) and Jacobian blocks
+        (..., horizon, constraint_size, state_size) at states.
+        """
+        raise NotImplementedError
+
+    def limits(self):
+        """
+        Lower and upper bounds of g, each of shape (horizon, constraint_size),
+        +-inf where unbounded.
+        """
+        raise NotImplementedError
+
+    def update(self, states):
+        """
+        Called by the optimizers with the current iterate before they
+        linearize the constraints, e.g. to associate obstacles with the steps.
+        The number of rows must not change. Returns the mask (horizon,
+        constraint_size) of the rows that now constrain something else, or
+        None if none do.
+        """
+        return None
+
+    def get_linear_bounds(self, states):
+        """
+        Jacobian blocks C_t and the bounds xmin <= C_t x_t <= xmax of the
+        constraints linearized at states, flattened over the horizon.
+        """
+        states = np.asarray(states)[..., :self.horizon, :]
+        values, blocks = self.evaluate(states)
+        offset = np.einsum('...tij,...tj->...ti', blocks, states) - values
+        lower, upper = self.limits()
+        shape = offset.shape[:-2] + (-1,)
+        return blocks, np.reshape(lower + offset, shape), np.reshape(upper + offset, shape)
+
+    def get_jacobian_blocks(self, states):
+        return self.evaluate(np.asarray(states)[..., :self.horizon, :])[1]
+
+    def get_bounds(self, states):
+        return self.get_linear_bounds(states)[1:]
+
+    def get_linear_constraint(self, states):
+        """
+        Block diagonal sparse Jacobian of the constraints over the horizon.
+        The blocks are stored densely, so the sparsity pattern does not depend
+        on the values.
+        """
+        blocks = self.get_jacobian_blocks(states)
+        return sparse.bsr_matrix((blocks, np.arange(self.horizon), np.arange(self.horizon + 1)),
+                                 shape=(self.horizon*self.constraint_size, self.horizon*self.state_size))
+
+    def get_residuals(self, states):
+        """
+        Constraints at states as residuals that are nonpositive where they are
+        satisfied: the upper bound rows g - upper followed by the lower bound
+        rows lower - g, shape (..., horizon, 2*constraint_size), and the
+        Jacobian blocks of g. Rows without a bound are -inf.
+        """
+        values, blocks = self.evaluate(np.asarray(states)[..., :self.horizon, :])
+        lower, upper = self.limits()
+        return np.concatenate([values - upper, lower - values], axis=-1), blocks
+
+
+class PositionConstraint(Constraint):
+    """
+    Base of the constraints on the position, the states at
+    position_indices (x and y by default).
+    """
+
+    def __init__(self, horizon, constraint_size, state_size=4, position_indices=(0, 1)):
+        super().__init__(state_size, constraint_size, horizon)
+        self.position_indices = np.asarray(position_indices)
+
+    def positions(self, states):
+        return states[..., self.position_indices]
+
+    def position_jacobian(self, d_dp):
+        """
+        Jacobian blocks with respect to the full state from the derivatives
+        d_dp (..., rows, len(position_indices)) with respect to the position.
+        """
+        blocks = np.zeros(d_dp.shape[:-1] + (self.state_size,))
+        blocks[..., self.position_indices] = d_dp
+        return blocks
+
+
+class BubbleConstraint(PositionConstraint):
+    """
+    Keep the position inside a circle (ball) of free space per step,
+    |p - center|^2 <= radius^2, and the speed, the state at speed_index,
+    within vel_bounds.
+    """
+
+    def __init__(self, horizon, state_size=4, position_indices=(0, 1), speed_index=2):
+        super().__init__(horizon, 2, state_size, position_indices)
+        self.speed_index = speed_index
+
     def setup(self, centers, radius, vel_bounds):
-        self.centers = centers
-        self.radius = radius
+        self.centers = np.asarray(centers, dtype=float)
+        self.radius = np.asarray(radius, dtype=float)
         self.vel_bounds = vel_bounds
 
-    def get_h(self, x, center, r):
-        h = (x[0] - center[0])**2 + (x[1] - center[1])**2 - r**2
-        return h
-    
-    def dh_dx(self, x, center):
-        dhdx = np.array([[2*(x[0] - center[0]), 2*(x[1] - center[1]), 0.0, 0.0], [0.0, 0.0, 1.0, 0.0]])
-        return dhdx
+    def setup_free_space(self, free_space, centers, vel_bounds, margin=0.0, max_radius=np.inf):
+        """
+        Bubbles around centers sized by the clearance(positions) of a map of
+        the free space, e.g. an ObstacleIndex or a SignedDistanceField,
+        keeping margin to the obstacles.
+        """
+        centers = np.asarray(centers, dtype=float)
+        radius = np.clip(free_space.clearance(centers) - margin, 0.0, max_radius)
+        self.setup(centers, radius, vel_bounds)
 
-    def get_uieq(self, state, center, r):
-        dhdx = self.dh_dx(state, center)
-        return dhdx[0, 0]*state[0] + dhdx[0, 1]*state[1] - self.get_h(state, center, r)
+    def evaluate(self, states):
+        diff = self.positions(states) - self.centers[:self.horizon]
+        values = np.stack([np.einsum('...i,...i->...', diff, diff),
+                           states[..., self.speed_index]], axis=-1)
+        blocks = self.position_jacobian(
+            np.stack([2.0*diff, np.zeros_like(diff)], axis=-2))
+        blocks[..., 1, self.speed_index] = 1.0
+        return values, blocks
 
-    def get_linear_constraint(self, states):
-        Cd = []
-        for i in range(self.horizon):
-            Ci = self.dh_dx(states[i, :], self.centers[i, :])
-            Cd.append(Ci)
-        Cu = block_diag(*Cd)
-        return Cu
+    def limits(self):
+        T = self.horizon
+        radius = as_steps(self.radius, T, ())
+        lower = np.empty((T, 2))
+        upper = np.empty((T, 2))
+        lower[:, 0] = -np.inf
+        upper[:, 0] = radius**2
+        lower[:, 1] = self.vel_bounds[0]
+        upper[:, 1] = self.vel_bounds[1]
+        return lower, upper
 
-    def get_bounds(self, states):
-        xmax = np.array([])
-        xmin = np.array([])
-        for i in range(0, self.horizon):
-            lower = np.array([-np.inf, self.vel_bounds[0]])
-            upper = np.array([self.get_uieq(states[i, :], self.centers[i, :], self.radius[i]), self.vel_bounds[1]])
-            xmax = np.append(xmax, upper)
-            xmin = np.append(xmin, lower)
-        return xmin, xmax
+
+class HalfPlaneConstraint(PositionConstraint):
+    """
+    Corridor of n_planes half planes (half spaces) per step,
+    normals[t, j].p <= offsets[t, j]. normals (n_planes, d) and offsets
+    (n_planes,) may also be shared by all steps.
+    """
+
+    def __init__(self, horizon, n_planes, state_size=4, position_indices=(0, 1)):
+        super().__init__(horizon, n_planes, state_size, position_indices)
+
+    def setup(self, normals, offsets):
+        d = len(self.position_indices)
+        self.normals = as_steps(normals, self.horizon, (self.constraint_size, d))
+        self.offsets = as_steps(offsets, self.horizon, (self.constraint_size,))
+
+    def evaluate(self, states):
+        values = np.einsum('tji,...ti->...tj', self.normals, self.positions(states))
+        blocks = np.broadcast_to(self.position_jacobian(self.normals),
+                                 values.shape + (self.state_size,)).copy()
+        return values, blocks
+
+    def limits(self):
+        return np.full((self.horizon, self.constraint_size), -np.inf), np.array(self.offsets)
+
+
+class SpeedConstraint(Constraint):
+    """
+    Bounds lower <= x[speed_index] <= upper, shared or per step.
+    """
+
+    def __init__(self, horizon, state_size=4, speed_index=2):
+        super().__init__(state_size, 1, horizon)
+        self.speed_index = speed_index
+
+    def setup(self, lower, upper):
+        self.lower = as_steps(lower, self.horizon, ())
+        self.upper = as_steps(upper, self.horizon, ())
+
+    def evaluate(self, states):
+        values = states[..., self.speed_index, None]
+        blocks = np.zeros(values.shape + (self.state_size,))
+        blocks[..., 0, self.speed_index] = 1.0
+        return values, blocks
+
+    def limits(self):
+        return np.array(self.lower)[:, None], np.array(self.upper)[:, None]
+
+
+class EllipsoidConstraint(PositionConstraint):
+    """
+    Keep the position outside n_obstacles ellipsoids (ellipses),
+    (p - center)'shape(p - center) >= 1, with shape positive definite, e.g.
+    I/r^2 for a disc of radius r. centers (n_obstacles, d) and shapes
+    (n_obstacles, d, d) may be shared by all steps or given per step.
+    """
+
+    def __init__(self, horizon, n_obstacles, state_size=4, position_indices=(0, 1)):
+        super().__init__(horizon, n_obstacles, state_size, position_indices)
+
+    def setup(self, centers, shapes):
+        d = len(self.position_indices)
+        k = self.constraint_size
+        self.centers = as_steps(centers, self.horizon, (k, d))
+        self.shapes = as_steps(shapes, self.horizon, (k, d, d))
+
+    def evaluate(self, states):
+        diff = self.positions(states)[..., None, :] - self.centers
+        shaped = np.einsum('tjab,...tjb->...tja', self.shapes, diff)
+        values = np.einsum('...i,...i->...', shaped, diff)
+        # d/dp of diff'A diff is (A + A')diff
+        d_dp = shaped + np.einsum('tjba,...tjb->...tja', self.shapes, diff)
+        return values, self.position_jacobian(d_dp)
+
+    def limits(self):
+        shape = (self.horizon, self.constraint_size)
+        return np.ones(shape), np.full(shape, np.inf)
+
+
+class StackedConstraint(Constraint):
+    """
+    Rows of several constraints on the same horizon and states, e.g. a
+    corridor with speed bounds and obstacles, as one constraint.
+    """
+
+    def __init__(self, constraints):
+        constraints = list(constraints)
+        super().__init__(constraints[0].state_size,
+                         sum(c.constraint_size for c in constraints), constraints[0].horizon)
+        if any(c.horizon != self.horizon or c.state_size != self.state_size for c in constraints):
+            raise ValueError("stacked constraints need the same horizon and state size")
+        self.constraints = constraints
+
+    def update(self, states):
+        changed = [c.update(states) for c in self.constraints]
+        if all(mask is None for mask in changed):
+            return None
+        return np.concatenate([np.zeros((self.horizon, c.constraint_size), dtype=bool)
+                               if mask is None else mask
+                               for c, mask in zip(self.constraints, changed)], axis=-1)
+
+    def evaluate(self, states):
+        values, blocks = zip(*(c.evaluate(states) for c in self.constraints))
+        return np.concatenate(values, axis=-1), np.concatenate(blocks, axis=-2)
+
+    def limits(self):
+        lower, upper = zip(*(c.limits() for c in self.constraints))
+        return np.concatenate(lower, axis=-1), np.concatenate(upper, axis=-1)
@@ -0,0 +1,43 @@
+import numpy as np
+
+"Quadratic tracking cost shared by the trajectory optimizers"
+
+
+def stage_costs(states, inputs, target_states, Q, R, Qf):
+    """
+    Per-step cost terms of x'Qx + u'Ru along a trajectory, with x the tracking
+    error to target_states and x'Qf x on the final state.
+    states and target_states have shape (..., T, n), inputs (..., T - 1, m),
+    any leading dimensions are treated as a batch of candidate trajectories.
+    Returns an array of shape (..., T).
+    """
+    states_diff = np.asarray(states) - target_states
+    inputs = np.asarray(inputs)
+    terms = np.empty(np.broadcast_shapes(
+        states_diff.shape[:-1], inputs.shape[:-2] + (states_diff.shape[-2],)))
+    x = states_diff[..., :-1, :]
+    terms[..., :-1] = np.einsum('...ti,...ti->...t', x @ Q, x) + \
+        np.einsum('...ti,...ti->...t', inputs @ R, inputs)
+    x = states_diff[..., -1, :]
+    terms[..., -1] = np.einsum('...i,...i->...', x @ Qf, x)
+    return terms
+
+
+def trajectory_cost(states, inputs, target_states, Q, R, Qf):
+    """
+    Total cost of one trajectory, or of a batch of trajectories stacked along
+    the leading dimensions, see stage_costs.
+    """
+    return stage_costs(states, inputs, target_states, Q, R, Qf).sum(axis=-1)
+
+
+def sufficient_decrease(cost, min_cost, expected_reduction, armijo):
+    """
+    Armijo test of line search trials: a cost is accepted if it lowers
+    min_cost by at least the fraction armijo of the reduction the local model
+    expects for the step. Where the model expects no reduction any decrease
+    is accepted. Works elementwise on arrays of trial costs; NaN costs are
+    never accepted.
+    """
+    reduction = min_cost - np.asarray(cost)
+    return (reduction > 0.0) & (reduction >= armijo*np.maximum(expected_reduction, 0.0))
@@ -0,0 +1,22 @@
+import time
+
+
+class Deadline:
+    """
+    Wall-clock budget of one solve. A time_budget of None never expires.
+    """
+
+    def __init__(self, time_budget=None):
+        self.start = time.perf_counter()
+        self.end = None if time_budget is None else self.start + time_budget
+
+    def remaining(self):
+        if self.end is None:
+            return float('inf')
+        return max(self.end - time.perf_counter(), 0.0)
+
+    def expired(self):
+        return self.end is not None and time.perf_counter() >= self.end
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
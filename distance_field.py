@@ -0,0 +1,155 @@
+import json
+import numpy as np
+from scipy import ndimage
+from constraints import PositionConstraint
+from spatial_index import ObstacleIndex
+
+"Signed distance field of a 2D map, rasterized once and queried by bilinear interpolation"
+
+
+def grid_nodes(lower, upper, resolution):
+    """
+    Positions (nx, ny, 2) of the nodes of a grid with spacing resolution
+    covering the box lower, upper.
+    """
+    lower = np.asarray(lower, dtype=float)
+    shape = np.ceil((np.asarray(upper, dtype=float) - lower)/resolution).astype(int) + 1
+    axes = [lower[i] + resolution*np.arange(shape[i]) for i in range(2)]
+    return np.stack(np.meshgrid(*axes, indexing='ij'), axis=-1)
+
+
+class SignedDistanceField:
+    """
+    Distance to the nearest obstacle, negative inside obstacles, sampled on
+    a grid: values[i, j] at origin + resolution*(i, j). The geometry is paid
+    once when the field is rasterized (from_occupancy, from_points,
+    from_segments) or loaded; distance and gradient queries on any batch of
+    positions (..., 2) then cost a bilinear interpolation each. Positions
+    outside the grid are clamped to its border. The interpolation adds at
+    most resolution/sqrt(2) to the error of the values at the nodes, so
+    clearance, unlike distance, subtracts it to never overestimate the free
+    space.
+    The values may be a numpy memmap: save writes the field to disk and load
+    maps it back without reading the whole grid.
+    """
+
+    def __init__(self, values, origin, resolution):
+        self.values = values
+        self.origin = np.asarray(origin, dtype=float)
+        self.resolution = float(resolution)
+        self.upper = self.origin + self.resolution*(np.array(values.shape) - 1)
+
+    @classmethod
+    def from_occupancy(cls, occupancy, origin=(0.0, 0.0), resolution=1.0):
+        """
+        Field of an occupancy grid (nx, ny), True or nonzero where occupied,
+        with cell occupancy[i, j] at origin + resolution*(i, j). The field of
+        an empty grid is the length of its diagonal everywhere.
+        """
+        occupied = np.asarray(occupancy, dtype=bool)
+        outside = ndimage.distance_transform_edt(~occupied) if np.any(occupied) \
+            else np.full(occupied.shape, np.hypot(*occupied.shape))
+        inside = ndimage.distance_transform_edt(occupied)
+        return cls(resolution*(outside - inside), origin, resolution)
+
+    @classmethod
+    def from_points(cls, points, lower, upper, resolution, radius=0.0):
+        """
+        Field of the discs of the given radius around points (N, 2), e.g. a
+        densely sampled line, on the box lower, upper.
+        """
+        nodes = grid_nodes(lower, upper, resolution)
+        return cls(ObstacleIndex(points, radius).clearance(nodes), nodes[0, 0], resolution)
+
+    @classmethod
+    def from_segments(cls, segments, lower, upper, resolution, radius=0.0):
+        """
+        Field of line segments (N, 2, 2), inflated by radius, on the box
+        lower, upper.
+        """
+        nodes = grid_nodes(lower, upper, resolution)
+        squared = np.full(nodes.shape[:-1], np.inf)
+        for a, b in np.asarray(segments, dtype=float):
+            ab = b - a
+            t = np.clip((nodes - a) @ ab/max(ab @ ab, np.finfo(float).tiny), 0.0, 1.0)
+            diff = nodes - a - t[..., None]*ab
+            np.minimum(squared, np.einsum('...i,...i->...', diff, diff), out=squared)
+        return cls(np.sqrt(squared) - radius, nodes[0, 0], resolution)
+
+    def save(self, path):
+        """
+        Write the values to path (.npy) and the grid to path.json.
+        """
+        np.save(path, np.asarray(self.values))
+        with open(str(path) + '.json', 'w') as f:
+            json.dump({'origin': self.origin.tolist(), 'resolution': self.resolution}, f)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        with open(str(path) + '.json') as f:
+            grid = json.load(f)
+        values = np.load(path, mmap_mode='r' if mmap else None)
+        return cls(values, grid['origin'], grid['resolution'])
+
+    def interpolate(self, positions, gradient=False):
+        positions = np.asarray(positions, dtype=float)
+        shape = np.array(self.values.shape)
+        # cell index and position within the cell of every position
+        scaled = (np.clip(positions, self.origin, self.upper) - self.origin)/self.resolution
+        cell = np.clip(np.floor(scaled).astype(int), 0, np.maximum(shape - 2, 0))
+        t = np.clip(scaled - cell, 0.0, 1.0)
+        i, j = cell[..., 0], cell[..., 1]
+        i1 = np.minimum(i + 1, shape[0] - 1)
+        j1 = np.minimum(j + 1, shape[1] - 1)
+        v00 = self.values[i, j]
+        v10 = self.values[i1, j]
+        v01 = self.values[i, j1]
+        v11 = self.values[i1, j1]
+        tx, ty = t[..., 0], t[..., 1]
+        low = v00 + tx*(v10 - v00)
+        high = v01 + tx*(v11 - v01)
+        distance = low + ty*(high - low)
+        if not gradient:
+            return distance
+        d_dx = (1.0 - ty)*(v10 - v00) + ty*(v11 - v01)
+        d_dy = high - low
+        return distance, np.stack([d_dx, d_dy], axis=-1)/self.resolution
+
+    def distance(self, positions):
+        """
+        Signed distances (...) at positions (..., 2).
+        """
+        return self.interpolate(positions)
+
+    def distance_gradient(self, positions):
+        """
+        Signed distances (...) and their gradients (..., 2) at positions.
+        """
+        return self.interpolate(positions, gradient=True)
+
+    def clearance(self, positions):
+        """
+        Lower bound (...) of the distance at positions, for sizing free space.
+        """
+        return self.interpolate(positions) - self.resolution/np.sqrt(2.0)
+
+
+class DistanceFieldConstraint(PositionConstraint):
+    """
+    Keep the position of every step at least margin away from the obstacles
+    of a SignedDistanceField, sdf(p) >= margin, linearized with the gradient
+    of the field.
+    """
+
+    def __init__(self, field, horizon, margin=0.0, state_size=4, position_indices=(0, 1)):
+        super().__init__(horizon, 1, state_size, position_indices)
+        self.field = field
+        self.margin = margin
+
+    def evaluate(self, states):
+        distance, d_dp = self.field.distance_gradient(self.positions(states))
+        return distance[..., None], self.position_jacobian(d_dp[..., None, :])
+
+    def limits(self):
+        shape = (self.horizon, 1)
+        return np.full(shape, float(self.margin)), np.full(shape, np.inf)
@@ -0,0 +1,60 @@
+import numpy as np
+
+"Finite difference derivatives of vectorized dynamics models"
+
+
+def finite_difference_jacobians(f, X, U, eps=1e-6):
+    """
+    Central difference Jacobians of the vectorized dynamics f(X, U), all n + m
+    perturbations are evaluated in one batched call.
+    """
+    X = np.asarray(X, dtype=float)
+    U = np.asarray(U, dtype=float)
+    n = X.shape[-1]
+    m = U.shape[-1]
+    batch_shape = np.broadcast_shapes(X.shape[:-1], U.shape[:-1])
+    X = np.broadcast_to(X, batch_shape + (n,))
+    U = np.broadcast_to(U, batch_shape + (m,))
+    step = eps*np.eye(n + m)
+    Xp = X[..., None, :] + step[:, :n]
+    Up = U[..., None, :] + step[:, n:]
+    Xm = X[..., None, :] - step[:, :n]
+    Um = U[..., None, :] - step[:, n:]
+    # (..., n + m, n) -> (..., n, n + m)
+    J = np.swapaxes(f(Xp, Up) - f(Xm, Um), -1, -2)/(2.0*eps)
+    return J[..., :n], J[..., n:]
+
+
+def finite_difference_hessians(f, X, U, eps=1e-4):
+    """
+    Hessians df_dxdx (..., n, n, n), df_dudu (..., n, m, m) and df_dudx
+    (..., n, m, n) of every output of f(X, U), central differences of
+    finite_difference_jacobians.
+    """
+    X = np.asarray(X, dtype=float)
+    U = np.asarray(U, dtype=float)
+    n = X.shape[-1]
+    m = U.shape[-1]
+    step = eps*np.eye(n + m)
+    Jp = np.concatenate(finite_difference_jacobians(
+        f, X[..., None, :] + step[:, :n], U[..., None, :] + step[:, n:]), axis=-1)
+    Jm = np.concatenate(finite_difference_jacobians(
+        f, X[..., None, :] - step[:, :n], U[..., None, :] - step[:, n:]), axis=-1)
+    # (..., n + m, n, n + m) -> (..., n, n + m, n + m), symmetric in the last two
+    H = np.moveaxis(Jp - Jm, -3, -1)/(2.0*eps)
+    H = 0.5*(H + np.swapaxes(H, -1, -2))
+    return H[..., :n, :n], H[..., n:, n:], H[..., n:, :n]
+
+
+def check_jacobians(system, states, inputs, eps=1e-6):
+    """
+    Largest absolute differences between system.linearize and central finite
+    differences of system.model_f_batch along a trajectory, as a dict with
+    keys 'df_dx' and 'df_du'. Use it to validate hand-written Jacobians.
+    """
+    inputs = np.asarray(inputs, dtype=float)
+    states = np.asarray(states, dtype=float)[..., :inputs.shape[-2], :]
+    df_dx, df_du = system.linearize(states, inputs)
+    fd_dx, fd_du = finite_difference_jacobians(system.model_f_batch, states, inputs, eps)
+    return {'df_dx': float(np.max(np.abs(df_dx - fd_dx))),
+            'df_du': float(np.max(np.abs(df_du - fd_du)))}
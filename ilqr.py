@@ -1,9 +1,14 @@
 import numpy as np
+from deadline import Deadline
+from instrumentation import phase
+from line_search import LineSearch
+from regularization import Regularization
+from riccati import riccati_backward
 
 "iterative LQR with Quadratic cost"
 
 
-class iterative_LQR:
+class iterative_LQR(LineSearch):
     """
     iterative LQR can be used as a controller/trajectory optimizer.
     Reference:
@@ -12,6 +17,12 @@ class iterative_LQR:
     Iterative Linear Quadratic Regulator Design for Nonlinear Biological Movement Systems
     https://homes.cs.washington.edu/~todorov/papers/LiICINCO04.pdf
     cost function: x'Qx + u'Ru
+    Set ddp to True for differential dynamic programming, which adds the
+    second order dynamics terms (System.hessians) to the backward pass. It
+    starts from the rollout of the initial inputs, and iterations in which
+    the second order terms make Quu indefinite take a Gauss-Newton step.
+    The regularization, line search and convergence rules are those of
+    line_search.LineSearch; the Levenberg-Marquardt term is added to Vxx.
     """
 
     def __init__(self, sys, target_states, dt):
@@ -28,87 +39,113 @@ class iterative_LQR:
         self.maxIter = 30
         self.min_cost = 0.0
         self.LM_parameter = 0.0
+        self.adaptive_LM = True
+        self.regularization = Regularization()
+        self.tol_grad = 1e-4
+        self.armijo = 0.1
+        self.tol_fun = 1e-6
+        self.min_step_change = 0.1
+        self.no_descent = False
+        self.rejected_step = None
+        self.expected = np.zeros(2)
+        self.alpha_terminal = 1e-4
+        self.parallel_line_search = False
+        self.time_budget = None
+        self.deadline = Deadline()
+        self.alpha = 0.0
+        self.status = {}
+        self.trace = None
+        self.line_search_trials = 0
+        self.use_numba = False
+        self.ddp = False
+        self.ddp_fallbacks = 0
         self.states = np.zeros(
             (self.horizon, self.n_states))
         self.inputs = np.zeros(
             (self.horizon - 1, self.m_inputs))
+        self.k = np.zeros((self.horizon - 1, self.m_inputs, 1))
+        self.K = np.zeros((self.horizon - 1, self.m_inputs, self.n_states))
+        self.Vx = np.zeros((self.horizon, self.n_states))
+        self.Vxx = np.zeros((self.horizon, self.n_states, self.n_states))
+        self.dl_dxdx = 2.0*np.asarray(self.Q, dtype=float)
+        self.dl_dudu = 2.0*np.asarray(self.R, dtype=float)
+        self.dl_dudx = np.zeros((self.m_inputs, self.n_states))
 
-    def cost(self):
+    def state_cost_derivatives(self):
+        """
+        Gradients (T, n) and Hessians (T, n, n) of the cost with respect to
+        the states along the trajectory, the last entries are those of the
+        terminal cost.
+        """
         states_diff = self.states - self.target_states
-        cost = 0.0
-        for i in range(self.horizon - 1):
-            state = np.reshape(states_diff[i, :], (-1, 1))
-            control = np.reshape(self.inputs[i, :], (-1, 1))
-            cost += np.dot(np.dot(state.T, self.Q), state) + \
-                np.dot(np.dot(control.T, self.R), control)
-        state = np.reshape(states_diff[-1, :], (-1, 1))
-        cost += np.dot(np.dot(state.T, self.Qf), state)
-        return cost[0, 0]
+        dl_dx = 2.0*np.dot(states_diff, self.Q.T)
+        dl_dx[-1, :] = 2.0*np.dot(self.Qf, states_diff[-1, :])
+        dl_dxdx = np.empty((self.horizon, self.n_states, self.n_states))
+        dl_dxdx[:-1] = self.dl_dxdx
+        dl_dxdx[-1] = 2.0*self.Qf
+        return dl_dx, dl_dxdx
 
-    def forward_pass(self):
-        prev_states = np.copy(self.states)
-        prev_inputs = np.copy(self.inputs)
-        alpha = 1.0
-        cnt = 50
-        while (cnt >= 0):
-            cnt -= 1
-            for i in range(0, self.horizon - 1):
-                self.inputs[i, :] = self.inputs[i, :] + alpha*np.reshape(self.k[i, :, :], (-1,)) + np.reshape(
-                    np.dot(self.K[i, :, :], np.reshape(self.states[i, :] - prev_states[i, :], (-1, 1))), (-1,))
-                if self.system.control_limited:
-                    for j in range(self.m_inputs):
-                        self.inputs[i, j] = min(max(
-                            self.inputs[i, j], self.system.control_lower_limit[j]), self.system.control_upper_limit[j])
-                self.states[i + 1, :] = self.system.model_f(
-                    self.states[i, :], self.inputs[i, :])
-            cost = self.cost()
-            if cost < self.min_cost:
-                self.min_cost = cost
-                break
-            else:
-                self.states = np.copy(prev_states)
-                self.inputs = np.copy(prev_inputs)
-                if alpha < 1e-4:
-                    self.converge = True
-                    break
-                alpha /= 2.0
+    def dynamics_hessians(self):
+        """
+        Hessians of every dynamics output with respect to [u x] along the
+        current trajectory, shape (T - 1, n, m + n, m + n).
+        """
+        m = self.m_inputs
+        df_dxdx, df_dudu, df_dudx = self.system.hessians(self.states, self.inputs)
+        f_hess = np.empty(df_dxdx.shape[:2] + (m + self.n_states, m + self.n_states))
+        f_hess[..., :m, :m] = df_dudu
+        f_hess[..., :m, m:] = df_dudx
+        f_hess[..., m:, :m] = np.swapaxes(df_dudx, -1, -2)
+        f_hess[..., m:, m:] = df_dxdx
+        return f_hess
 
     def backward_pass(self):
-        self.k = np.zeros((self.horizon - 1, self.m_inputs, 1))
-        self.K = np.zeros((self.horizon - 1, self.m_inputs, self.n_states))
-        Vx = 2.0 *\
-            np.dot(
-                self.Qf, self.states[-1, :] - self.target_states[-1, :])
-        Vxx = 2.0*self.Qf
-        dl_dxdx = 2.0*self.Q
-        dl_dudu = 2.0*self.R
-        dl_dudx = np.zeros((self.m_inputs, self.n_states))
-        for i in range(self.horizon - 2, -1, -1):
-            u = self.inputs[i, :]
-            x = self.states[i, :]
-            df_du = self.system.compute_df_du(x, u)
-            df_dx = self.system.compute_df_dx(x, u)
-            dl_dx = 2.0*np.dot(self.Q, x - self.target_states[i, :])
-            dl_du = 2.0*np.dot(self.R, u)
-            Qx = dl_dx + np.dot(df_dx.T, Vx)
-            Qu = dl_du + np.dot(df_du.T, Vx)
-            Vxx_augmented = Vxx + self.LM_parameter * np.eye(self.n_states)
-            Qxx = dl_dxdx + np.dot(np.dot(df_dx.T, Vxx_augmented), df_dx)
-            Quu = dl_dudu + np.dot(np.dot(df_du.T, Vxx_augmented), df_du)
-            Qux = dl_dudx + np.dot(np.dot(df_du.T, Vxx_augmented), df_dx)
-            Quu_inv = np.linalg.inv(Quu)
-            k = -np.dot(Quu_inv, Qu)
-            K = -np.dot(Quu_inv, Qux)
-            self.k[i, :, :] = np.reshape(k, (-1, 1), order='F')
-            self.K[i, :, :] = K
-            Vx = Qx + np.dot(K.T, Qu)
-            Vxx = Qxx + np.dot(K.T, Qux)
+        f_hess = None
+        with phase(self.trace, 'linearize'):
+            df_dx, df_du = self.system.linearize(self.states, self.inputs)
+            if self.ddp:
+                f_hess = self.dynamics_hessians()
+        with phase(self.trace, 'backward_pass'):
+            dl_dx, dl_dxdx = self.state_cost_derivatives()
+            dl_du = 2.0*np.dot(self.inputs, self.R.T)
+            self.Vx[-1, :] = dl_dx[-1]
+            self.Vxx[-1, :, :] = dl_dxdx[-1]
+            while True:
+                failed = riccati_backward(df_dx, df_du, dl_dx[:-1], dl_du, dl_dxdx[:-1], self.dl_dudu,
+                                          self.dl_dudx, self.regularization.value, self.k[:, :, 0],
+                                          self.K, self.Vx, self.Vxx, f_hess, use_numba=self.use_numba)
+                if failed < 0:
+                    break
+                if f_hess is not None:
+                    # the second order terms can make Quu indefinite far from
+                    # a minimum, take a Gauss-Newton step instead
+                    self.ddp_fallbacks += 1
+                    f_hess = None
+                    continue
+                if not (self.adaptive_LM and self.regularization.increase()):
+                    raise np.linalg.LinAlgError(
+                        "Quu is not positive definite at step %d" % failed)
+            # expected cost change alpha*dV[0] + alpha^2*dV[1] of the step,
+            # from the Q function without regularization, along the part of
+            # the feedforward step that the control limits keep
+            k = self.k[:, :, 0]
+            if self.system.control_limited:
+                k = np.clip(self.inputs + k, self.system.control_lower_limit,
+                            self.system.control_upper_limit) - self.inputs
+            Qu = dl_du + np.einsum('tnm,tn->tm', df_du, self.Vx[1:])
+            fu_k = np.einsum('tnm,tm->tn', df_du, k)
+            kQuuk = np.einsum('tm,mj,tj->', k, self.dl_dudu, k) + \
+                np.einsum('tn,tnj,tj->', fu_k, self.Vxx[1:], fu_k)
+            if f_hess is not None:
+                m = self.m_inputs
+                kQuuk += np.einsum('tn,tnab,ta,tb->', self.Vx[1:], f_hess[:, :, :m, :m], k, k)
+            self.expected = np.array([np.sum(k*Qu), 0.5*kQuuk])
+
+    def start_solve(self):
+        if self.ddp:
+            # expand around the trajectory the initial inputs actually produce
+            self.states = self.system.rollout(self.states[0, :], self.inputs)
+            self.ddp_fallbacks = 0
 
-    def __call__(self):
-        self.min_cost = self.cost()
-        for iter in range(self.maxIter):
-            if (self.converge):
-                break
-            self.backward_pass()
-            self.forward_pass()
-        return self.states
+    def solve_status(self):
+        return {'ddp_fallbacks': self.ddp_fallbacks}
@@ -0,0 +1,109 @@
+import csv
+import io
+import json
+import math
+import time
+from contextlib import nullcontext
+
+"Optional per-iteration timing and convergence traces of the optimizers"
+
+null_phase = nullcontext()
+
+
+class PhaseTimer:
+    __slots__ = ('record', 'name', 'start')
+
+    def __init__(self, record, name):
+        self.record = record
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.record[self.name] += time.perf_counter() - self.start
+        return False
+
+
+def phase(trace, name):
+    """
+    Context manager timing one phase of the current iteration of trace, or a
+    shared no-op if tracing is disabled (trace is None).
+    """
+    if trace is None or trace.current is None:
+        return null_phase
+    return trace.phase(name)
+
+
+class SolverTrace:
+    """
+    Per-iteration trace of one or more solves. Assign an instance to the
+    trace attribute of an optimizer to enable it. Every iteration records the
+    time spent in each phase (seconds), the cost, the accepted step size alpha,
+    the number of line search trials and, for iLQR, the Levenberg-Marquardt
+    regularization or, for SQP, the OSQP iteration count. An infinite cost,
+    before SQP has accepted a step, is recorded as None.
+    """
+    phases = ('linearize', 'backward_pass', 'qp_assembly', 'qp_solve', 'rollout', 'cost')
+    columns = ('solve', 'iteration', 'time') + phases + \
+        ('cost_value', 'alpha', 'line_search_trials', 'regularization', 'qp_iterations')
+
+    def __init__(self):
+        self.iterations = []
+        self.current = None
+        self.solves = 0
+        self.solve_iterations = 0
+        self.start = 0.0
+
+    def begin_solve(self):
+        # an iteration left open by a solve that raised does not take the
+        # records of this one
+        self.current = None
+        self.solves += 1
+        self.solve_iterations = 0
+
+    def begin_iteration(self):
+        self.current = dict.fromkeys(self.phases, 0.0)
+        self.current['solve'] = self.solves
+        self.current['iteration'] = self.solve_iterations
+        self.solve_iterations += 1
+        self.iterations.append(self.current)
+        self.start = time.perf_counter()
+
+    def end_iteration(self, cost, alpha):
+        self.current['time'] = time.perf_counter() - self.start
+        self.current['cost_value'] = float(cost) if math.isfinite(cost) else None
+        self.current['alpha'] = float(alpha)
+        self.current = None
+
+    def phase(self, name):
+        return PhaseTimer(self.current, name)
+
+    def record(self, **fields):
+        if self.current is not None:
+            self.current.update(fields)
+
+    def totals(self):
+        """
+        Total time per phase over all recorded iterations.
+        """
+        return {name: sum(record[name] for record in self.iterations) for name in self.phases}
+
+    def to_json(self, path=None):
+        text = json.dumps(self.iterations, indent=1)
+        if path is not None:
+            with open(path, 'w') as f:
+                f.write(text)
+        return text
+
+    def to_csv(self, path=None):
+        out = io.StringIO()
+        writer = csv.DictWriter(out, fieldnames=self.columns, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(self.iterations)
+        text = out.getvalue()
+        if path is not None:
+            with open(path, 'w', newline='') as f:
+                f.write(text)
+        return text
@@ -0,0 +1,271 @@
+import numpy as np
+from costs import sufficient_decrease, trajectory_cost
+from deadline import Deadline
+from instrumentation import phase
+
+"Line search and outer loop shared by the iterative LQR optimizers"
+
+
+class LineSearch:
+    """
+    Outer loop and forward pass of iterative LQR. The optimizer provides the
+    backward_pass, which sets the gains k, K and the expected cost change
+    alpha*expected[0] + alpha^2*expected[1] of the step.
+    The forward pass rolls out the step at step sizes 1, 1/2, ... down to
+    alpha_terminal, serially or (parallel_line_search) as one batched
+    rollout, and accepts a step if it achieves the fraction armijo of the
+    expected reduction. The solve converges once the expected or achieved
+    reduction drops below tol_fun relative to the cost.
+    With adaptive_LM (default) the Levenberg-Marquardt term of the backward
+    pass follows the schedule in regularization.py starting from
+    LM_parameter, its bounds are set on the regularization attribute. After
+    a rejected line search the regularization grows until the step changes
+    by min_step_change relative to the rejected one. If no line search can
+    improve the cost the solve stops: converged if the last search went
+    down to steps whose expected reduction is below tol_fun relative to
+    the cost, with no_descent set otherwise.
+    """
+
+    def cost_of(self, states, inputs):
+        """
+        Cost of a trajectory or of a batch of trajectories (see
+        trajectory_cost). Subclasses adding cost terms override it together
+        with state_cost_derivatives.
+        """
+        return trajectory_cost(states, inputs, self.target_states, self.Q, self.R, self.Qf)
+
+    def cost(self):
+        return self.cost_of(self.states, self.inputs)
+
+    def line_search_alphas(self):
+        """
+        Step sizes 1, 1/2, 1/4, ... down to the first one below alpha_terminal,
+        the same sequence the serial line search tries.
+        """
+        n_alphas = int(np.floor(np.log2(1.0/self.alpha_terminal))) + 2
+        return 0.5**np.arange(n_alphas)
+
+    def forward_pass_batch(self):
+        """
+        Line search that rolls out all candidate step sizes together as one
+        batched rollout and keeps the lowest cost step that improves on min_cost.
+        """
+        alphas = self.line_search_alphas()
+        states = np.empty((alphas.shape[0], self.horizon, self.n_states))
+        inputs = np.empty((alphas.shape[0], self.horizon - 1, self.m_inputs))
+        states[:, 0, :] = self.states[0, :]
+        with phase(self.trace, 'rollout'):
+            for i in range(0, self.horizon - 1):
+                inputs[:, i, :] = self.inputs[i, :] + alphas[:, None]*self.k[i, :, 0] + \
+                    np.dot(states[:, i, :] - self.states[i, :], self.K[i].T)
+                if self.system.control_limited:
+                    inputs[:, i, :] = np.clip(inputs[:, i, :], self.system.control_lower_limit,
+                                              self.system.control_upper_limit)
+                states[:, i + 1, :] = self.system.model_f_batch(
+                    states[:, i, :], inputs[:, i, :])
+        with phase(self.trace, 'cost'):
+            costs = self.cost_of(states, inputs)
+        self.line_search_trials = alphas.shape[0]
+        accepted = sufficient_decrease(costs, self.min_cost, self.expected_reduction(alphas),
+                                       self.armijo)
+        if np.any(accepted):
+            best = np.argmin(np.where(accepted, costs, np.inf))
+            self.accept_step(costs[best])
+            self.alpha = alphas[best]
+            self.states = states[best]
+            self.inputs = inputs[best]
+        else:
+            self.reject_step(alphas[-1]/2.0)
+
+    def forward_pass(self):
+        self.alpha = 0.0
+        if self.parallel_line_search:
+            self.forward_pass_batch()
+            return
+        prev_states = np.copy(self.states)
+        prev_inputs = np.copy(self.inputs)
+        alpha = 1.0
+        cnt = 50
+        self.line_search_trials = 0
+        while (cnt >= 0):
+            cnt -= 1
+            self.line_search_trials += 1
+            with phase(self.trace, 'rollout'):
+                for i in range(0, self.horizon - 1):
+                    self.inputs[i, :] = self.inputs[i, :] + alpha*self.k[i, :, 0] + \
+                        np.dot(self.K[i, :, :], self.states[i, :] - prev_states[i, :])
+                    if self.system.control_limited:
+                        self.inputs[i, :] = np.clip(self.inputs[i, :],
+                                                    self.system.control_lower_limit,
+                                                    self.system.control_upper_limit)
+                    self.states[i + 1, :] = self.system.model_f_batch(
+                        self.states[i, :], self.inputs[i, :])
+            with phase(self.trace, 'cost'):
+                cost = self.cost()
+            if sufficient_decrease(cost, self.min_cost, self.expected_reduction(alpha),
+                                   self.armijo):
+                self.accept_step(cost)
+                self.alpha = alpha
+                break
+            else:
+                self.states = np.copy(prev_states)
+                self.inputs = np.copy(prev_inputs)
+                if alpha < self.alpha_terminal or self.negligible(alpha/2.0):
+                    self.reject_step(alpha/2.0)
+                    break
+                if self.deadline.expired():
+                    break
+                alpha /= 2.0
+
+    def expected_reduction(self, alpha):
+        """
+        Cost reduction the quadratic model of the last backward pass predicts
+        for the step size alpha (scalar or array).
+        """
+        return -(alpha*self.expected[0] + alpha**2*self.expected[1])
+
+    def negligible(self, alpha):
+        """
+        Whether the step size alpha is expected to reduce the cost by less
+        than tol_fun relative to the cost, accepting it would converge.
+        """
+        return self.expected_reduction(alpha) < self.tol_fun*abs(self.min_cost)
+
+    def accept_step(self, cost):
+        """
+        Take cost as the new minimum, converging if the improvement is below
+        tol_fun relative to the previous cost.
+        """
+        if self.min_cost - cost < self.tol_fun*abs(self.min_cost):
+            self.converge = True
+        self.min_cost = cost
+        self.rejected_step = None
+
+    def gradient_norm(self):
+        """
+        Size of the feedforward step relative to the inputs, without the part
+        that the control limits clip away.
+        """
+        step = self.k[:, :, 0]
+        if self.system.control_limited:
+            step = np.clip(self.inputs + step, self.system.control_lower_limit,
+                           self.system.control_upper_limit) - self.inputs
+        return np.mean(np.max(np.abs(step)/(np.abs(self.inputs) + 1.0), axis=1))
+
+    def reject_step(self, alpha):
+        """
+        No step size down to alpha (exclusive) improved the cost. With
+        adaptive_LM the next backward pass is more regularized; the solve
+        stops once the regularization exceeds its maximum, or right away
+        without adaptive_LM.
+        """
+        self.rejected_step = np.copy(self.k[:, :, 0])
+        self.rejected_negligible = self.negligible(alpha)
+        if not self.adaptive_LM or \
+                not self.regularization.increase(self.regularization.rejection_factor):
+            self.stop_descent()
+
+    def stop_descent(self):
+        """
+        Stop after a rejected line search: converged if the search only left
+        steps that would converge when accepted, no_descent otherwise.
+        """
+        if self.rejected_negligible:
+            self.converge = True
+        else:
+            self.no_descent = True
+
+    def step_changed(self):
+        """
+        Whether the feedforward step moved by more than min_step_change
+        relative to the step of the last rejected line search.
+        """
+        change = np.linalg.norm(self.k[:, :, 0] - self.rejected_step)
+        return change > self.min_step_change*np.linalg.norm(self.rejected_step)
+
+    def regularized_backward_pass(self):
+        """
+        Backward pass that, after a rejected line search, keeps raising the
+        regularization until the step changes: searching along the same step
+        again would only repeat the failed rollouts. Sets no_descent once the
+        regularization exceeds its maximum.
+        """
+        self.backward_pass()
+        while self.rejected_step is not None and not self.deadline.expired() and \
+                not self.step_changed():
+            if not self.regularization.increase(self.regularization.rejection_factor):
+                self.stop_descent()
+                break
+            self.backward_pass()
+
+    def start_solve(self):
+        """
+        Called at the start of every solve, after the deadline is set.
+        """
+        pass
+
+    def solve_status(self):
+        """
+        Entries of status specific to the optimizer.
+        """
+        return {}
+
+    def __call__(self):
+        self.deadline = Deadline(self.time_budget)
+        if self.trace is not None:
+            self.trace.begin_solve()
+        self.start_solve()
+        self.regularization.reset(self.LM_parameter)
+        self.no_descent = False
+        self.rejected_step = None
+        self.min_cost = self.cost()
+        initial_cost = self.min_cost
+        self.alpha = 0.0
+        iterations = 0
+        rollouts = 0
+        timed_out = False
+        for iter in range(self.maxIter):
+            if self.converge or self.no_descent:
+                break
+            if self.deadline.expired():
+                timed_out = True
+                break
+            if self.trace is not None:
+                self.trace.begin_iteration()
+            self.regularized_backward_pass()
+            if self.deadline.expired():
+                # the gains of an interrupted backward pass are incomplete
+                timed_out = True
+            if self.converge or self.no_descent or timed_out:
+                if self.trace is not None:
+                    self.trace.end_iteration(self.min_cost, 0.0)
+                break
+            if self.negligible(1.0) or \
+                    self.adaptive_LM and self.regularization.value < 1e-5 and \
+                    self.gradient_norm() < self.tol_grad:
+                # the step is negligible, no need to search; right after a
+                # rejected search it is only small for the regularization
+                if self.rejected_step is None:
+                    self.converge = True
+                else:
+                    self.stop_descent()
+                if self.trace is not None:
+                    self.trace.end_iteration(self.min_cost, 0.0)
+                break
+            self.forward_pass()
+            iterations += 1
+            rollouts += self.line_search_trials
+            if self.adaptive_LM and self.alpha > 0.0:
+                self.regularization.decrease()
+            if self.trace is not None:
+                self.trace.record(line_search_trials=self.line_search_trials,
+                                  regularization=self.regularization.value)
+                self.trace.end_iteration(self.min_cost, self.alpha)
+        self.status = {'iterations': iterations, 'alpha': self.alpha,
+                       'cost_reduction': initial_cost - self.min_cost,
+                       'converged': self.converge, 'no_descent': self.no_descent,
+                       'timed_out': timed_out, 'rollouts': rollouts,
+                       'regularization': self.regularization.summary(),
+                       'solve_time': self.deadline.elapsed()}
+        self.status.update(self.solve_status())
+        return self.states
@@ -0,0 +1,96 @@
+import numpy as np
+from sqp import sequential_QP_optimizer
+
+"Receding horizon control around the trajectory optimizers"
+
+
+def shift(a):
+    """
+    Drop the first step of a trajectory array and repeat the last one.
+    """
+    return np.concatenate([a[1:], a[-1:]])
+
+
+class receding_horizon_MPC:
+    """
+    Receding horizon controller in the style of the real-time iteration. It
+    wraps an iterative_LQR (ilqr.py or cilqr.py) or a sequential_QP_optimizer
+    with a fixed horizon. The first tick is a full solve. Later ticks shift
+    the previous solution by one step, hold the last input as the tail, and
+    run at most maxIter iterations from there. iLQR is warm started with a
+    closed-loop rollout of the shifted feedback gains from the new initial
+    state. SQP is warm started with the shifted QP primal/dual solution.
+    Reference:
+    From linear to nonlinear MPC: bridging the gap via the real-time iteration
+    http://cse.lab.imtlucca.it/~bemporad/publications/papers/ijc_rtiltv.pdf
+    """
+
+    def __init__(self, optimizer, maxIter=1):
+        self.optimizer = optimizer
+        self.system = optimizer.system
+        self.maxIter = maxIter
+        self.ticks = 0
+
+    def warm_start_ilqr(self, x0):
+        opt = self.optimizer
+        nominal_inputs = shift(opt.inputs)
+        nominal_states = shift(opt.states)
+        nominal_states[-1, :] = self.system.model_f(
+            opt.states[-1, :], nominal_inputs[-1, :])
+        K = shift(opt.K)
+        states = np.empty_like(nominal_states)
+        inputs = np.empty_like(nominal_inputs)
+        states[0, :] = x0
+        for i in range(opt.horizon - 1):
+            inputs[i, :] = nominal_inputs[i, :] + \
+                np.dot(K[i, :, :], states[i, :] - nominal_states[i, :])
+            if self.system.control_limited:
+                inputs[i, :] = np.clip(
+                    inputs[i, :], self.system.control_lower_limit, self.system.control_upper_limit)
+            states[i + 1, :] = self.system.model_f_batch(states[i, :], inputs[i, :])
+        opt.states = states
+        opt.inputs = inputs
+        opt.K[...] = K
+        opt.k[...] = shift(opt.k)
+
+    def warm_start_sqp(self, x0):
+        opt = self.optimizer
+        opt.set_init_inputs(shift(opt.inputs))
+        opt.x0 = x0
+        opt.reset_states = False
+        opt.shift_qp_solution()
+
+    def __call__(self, x0, target_states):
+        """
+        One control tick from the measured state x0 towards target_states of
+        shape (horizon, n). Returns the input to apply now, the whole planned
+        trajectory stays on the optimizer.
+        """
+        opt = self.optimizer
+        x0 = np.asarray(x0, dtype=float)
+        sqp = isinstance(opt, sequential_QP_optimizer)
+        if sqp:
+            opt.set_target_states(target_states)
+        else:
+            opt.target_states = target_states
+        if self.ticks == 0:
+            if sqp:
+                opt.x0 = x0
+            else:
+                opt.states = self.system.rollout(x0, opt.inputs)
+            opt.converge = False
+            opt()
+        else:
+            if sqp:
+                self.warm_start_sqp(x0)
+            else:
+                self.warm_start_ilqr(x0)
+            opt.converge = False
+            maxIter = opt.maxIter
+            opt.maxIter = self.maxIter
+            try:
+                opt()
+            finally:
+                opt.maxIter = maxIter
+        self.ticks += 1
+        return opt.inputs[0, :]
@@ -0,0 +1,17 @@
+from matplotlib import pyplot as plt
+
+"Plots of optimizer results, kept out of the solver modules so they import without matplotlib"
+
+
+def plot_trajectory(optimizer, title, label):
+    """
+    x-y plot of the optimized states of an optimizer against its targets.
+    """
+    plt.figure(figsize=(8*1.1, 6*1.1))
+    plt.title(title)
+    plt.axis('equal')
+    plt.plot(optimizer.target_states[:, 0], optimizer.target_states[:, 1],
+             '--r', label='Target', linewidth=2)
+    plt.plot(optimizer.states[:, 0], optimizer.states[:, 1],
+             '-+k', label=label, linewidth=1.0)
+    plt.show()
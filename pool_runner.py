@@ -0,0 +1,101 @@
+import multiprocessing
+from collections import namedtuple
+import numpy as np
+from ilqr import iterative_LQR
+from sqp import sequential_QP_optimizer
+
+"Fan independent trajectory optimization problems out over a process pool"
+
+TrajectoryProblem = namedtuple(
+    'TrajectoryProblem', ['system', 'target_states', 'init_inputs', 'constraint', 'solver'],
+    defaults=[None, 'ilqr'])
+TrajectoryProblem.__doc__ = """
+One problem for solve_problems. solver is 'ilqr' (ilqr.py), 'cilqr' (the
+constrained iLQR in cilqr.py), 'al_ilqr' (augmented_Lagrangian_iLQR) or 'sqp'
+(sequential_QP_optimizer); the last two also need a constraint. The initial state is target_states[0].
+"""
+
+SolveResult = namedtuple(
+    'SolveResult', ['index', 'states', 'inputs', 'cost', 'converged'])
+
+worker_systems = []
+worker_optimizers = {}
+
+
+def init_worker(systems):
+    """
+    Pool initializer, the systems are sent to every worker once and tasks
+    refer to them by their position in the list.
+    """
+    global worker_systems
+    worker_systems = systems
+    worker_optimizers.clear()
+
+
+def get_optimizer(solver, system_index, target_states, constraint):
+    """
+    Optimizer for one task. SQP optimizers are kept per worker, system and
+    horizon, so their OSQP workspace is reused and warm started across tasks.
+    """
+    system = worker_systems[system_index]
+    if solver == 'sqp':
+        key = (solver, system_index, target_states.shape[0])
+        optimizer = worker_optimizers.get(key)
+        if optimizer is None:
+            optimizer = sequential_QP_optimizer(
+                system, constraint, target_states, system.dt)
+            worker_optimizers[key] = optimizer
+        else:
+            optimizer.constraint = constraint
+            optimizer.set_target_states(target_states)
+        return optimizer
+    if solver == 'ilqr':
+        optimizer = iterative_LQR(system, target_states, system.dt)
+    elif solver == 'cilqr':
+        import cilqr
+        optimizer = cilqr.iterative_LQR(system, target_states, system.dt)
+    elif solver == 'al_ilqr':
+        from al_ilqr import augmented_Lagrangian_iLQR
+        optimizer = augmented_Lagrangian_iLQR(system, constraint, target_states, system.dt)
+    else:
+        raise ValueError("unknown solver %r" % (solver,))
+    optimizer.states[0, :] = target_states[0, :]
+    return optimizer
+
+
+def solve_task(task):
+    index, system_index, target_states, init_inputs, constraint, solver = task
+    optimizer = get_optimizer(solver, system_index, target_states, constraint)
+    if solver == 'sqp':
+        optimizer.set_init_inputs(np.array(init_inputs, dtype=float))
+    else:
+        optimizer.inputs = np.array(init_inputs, dtype=float)
+    optimizer()
+    return SolveResult(index, optimizer.states, optimizer.inputs,
+                       float(optimizer.min_cost), bool(optimizer.converge))
+
+
+def solve_problems(problems, processes=None, chunksize=1):
+    """
+    Solve a list of TrajectoryProblem across processes worker processes.
+    Yields a SolveResult for every problem as soon as it is solved, so the
+    results arrive out of order, use SolveResult.index to match them to the
+    problems. processes=1 solves everything in the calling process.
+    """
+    systems = []
+    system_ids = {}
+    tasks = []
+    for index, problem in enumerate(problems):
+        if id(problem.system) not in system_ids:
+            system_ids[id(problem.system)] = len(systems)
+            systems.append(problem.system)
+        tasks.append((index, system_ids[id(problem.system)], problem.target_states,
+                      problem.init_inputs, problem.constraint, problem.solver))
+    if processes == 1:
+        init_worker(systems)
+        for task in tasks:
+            yield solve_task(task)
+        return
+    with multiprocessing.Pool(processes, initializer=init_worker, initargs=(systems,)) as pool:
+        for result in pool.imap_unordered(solve_task, tasks, chunksize):
+            yield result
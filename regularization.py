@@ -0,0 +1,51 @@
+"Adaptive Levenberg-Marquardt regularization of the iLQR backward pass"
+
+
+class Regularization:
+    """
+    Levenberg-Marquardt schedule of Tassa et al. The value is added to Vxx
+    in the backward pass. It grows when Quu is not positive definite or no
+    step is accepted, and shrinks after accepted steps, with a growth factor
+    that itself grows on repeated failures. A rejected line search costs a
+    full set of rollouts, so it grows the value by the larger
+    rejection_factor. Values below minimum become 0.
+    Reference:
+    Synthesis and Stabilization of Complex Behaviors through Online Trajectory Optimization
+    https://homes.cs.washington.edu/~todorov/papers/TassaIROS12.pdf
+    """
+
+    def __init__(self, minimum=1e-6, maximum=1e10, factor=1.6, rejection_factor=10.0):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.factor = factor
+        self.rejection_factor = rejection_factor
+        self.reset(0.0)
+
+    def reset(self, value):
+        self.value = value
+        self.delta = 1.0
+        self.peak = value
+        self.increases = 0
+        self.decreases = 0
+
+    def increase(self, factor=None):
+        """
+        Returns False once the value exceeds maximum.
+        """
+        factor = self.factor if factor is None else factor
+        self.delta = max(factor, self.delta*factor)
+        self.value = max(self.minimum, self.value*self.delta)
+        self.peak = max(self.peak, self.value)
+        self.increases += 1
+        return self.value <= self.maximum
+
+    def decrease(self):
+        self.delta = min(1.0/self.factor, self.delta/self.factor)
+        self.value = self.value*self.delta
+        if self.value < self.minimum:
+            self.value = 0.0
+        self.decreases += 1
+
+    def summary(self):
+        return {'final': self.value, 'peak': self.peak,
+                'increases': self.increases, 'decreases': self.decreases}
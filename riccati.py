@@ -0,0 +1,271 @@
+import numpy as np
+from importlib.util import find_spec
+from scipy.linalg import cho_factor, cho_solve
+
+"Riccati recursion of the iLQR backward pass"
+
+# numba is imported and the kernel compiled on first use only
+numba_available = find_spec('numba') is not None
+riccati_numba = None
+
+
+def riccati_numpy(fx, fu, lx, lu, lxx, luu, lux, mu, k, K, Vx, Vxx, f_hess=None):
+    """
+    Backward Riccati recursion over the horizon, writing into preallocated
+    buffers.
+    fx (T, n, n), fu (T, n, m): dynamics Jacobians
+    f_hess (T, n, m + n, m + n): optional Hessians of every dynamics output
+    with respect to [u x]. If given, the second order terms Vx'f_hess of
+    differential dynamic programming are added to the Q function.
+    lx (T, n), lu (T, m): cost gradients, lxx (n, n) or per step (T, n, n),
+    luu (m, m), lux (m, n): cost Hessians, mu: Levenberg-Marquardt term added to Vxx.
+    k (T, m), K (T, m, n): feedforward and feedback gains
+    Vx (T + 1, n), Vxx (T + 1, n, n): value function, the last entry must hold
+    the terminal value on entry.
+    Returns -1 on success, otherwise the step at which Quu is not positive
+    definite. With a leading batch dimension on the trajectory arrays (fx,
+    fu, lx, lu, k, K, Vx, Vxx, f_hess and a per step lxx) the problems are
+    solved together, see riccati_numpy_batch.
+    """
+    if fx.ndim == 4:
+        return riccati_numpy_batch(fx, fu, lx, lu, lxx, luu, lux, mu, k, K, Vx, Vxx, f_hess)
+    T = fx.shape[0]
+    n = fx.shape[1]
+    m = fu.shape[2]
+    # G = [fu fx], and H = G'[Vxx G, Vx] + L holds [[Quu Qux Qu], [Qxu Qxx Qx]],
+    # W holds the transpose of [Vxx G, Vx] so that every product writes into a
+    # contiguous buffer
+    G = np.concatenate([fu, fx], axis=2)
+    L = np.empty((T, m + n, m + n + 1))
+    L[:, :m, :m] = luu
+    L[:, :m, m:m + n] = lux
+    L[:, m:, :m] = lux.T
+    L[:, m:, m:m + n] = lxx
+    L[:, :m, -1] = lu
+    L[:, m:, -1] = lx
+    W = np.empty((m + n + 1, n))
+    H = np.empty((m + n, m + n + 1))
+    V = np.empty((n, n + 1))
+    Vxx_aug = np.empty((n, n))
+    for i in range(T - 1, -1, -1):
+        if mu != 0.0:
+            np.copyto(Vxx_aug, Vxx[i + 1])
+            Vxx_aug.flat[::n + 1] += mu
+            np.dot(G[i].T, Vxx_aug.T, out=W[:-1])
+        else:
+            np.dot(G[i].T, Vxx[i + 1].T, out=W[:-1])
+        W[-1] = Vx[i + 1]
+        np.dot(G[i].T, W.T, out=H)
+        H += L[i]
+        if f_hess is not None:
+            H[:, :-1] += np.dot(Vx[i + 1], f_hess[i].reshape(n, -1)).reshape(m + n, m + n)
+        try:
+            factor = cho_factor(H[:m, :m], check_finite=False)
+        except np.linalg.LinAlgError:
+            return i
+        # solution = Quu^-1 [Qux Qu] = -[K k]
+        solution = cho_solve(factor, H[:m, m:], check_finite=False)
+        np.negative(solution[:, :n], out=K[i])
+        np.negative(solution[:, n], out=k[i])
+        # [Vxx Vx] = [Qxx Qx] + K'[Qux Qu]
+        np.dot(K[i].T, H[:m, m:], out=V)
+        V += H[m:, m:]
+        Vxx[i] = V[:, :n]
+        Vx[i] = V[:, n]
+    return -1
+
+
+def riccati_numpy_batch(fx, fu, lx, lu, lxx, luu, lux, mu, k, K, Vx, Vxx, f_hess=None):
+    """
+    Backward Riccati recursion of B problems at once, the arrays of
+    riccati_numpy with a leading dimension B and mu a scalar or one value per
+    problem (B,). Returns the step at which Quu of every problem is not
+    positive definite, -1 where the recursion succeeded. The gains and value
+    function of the failed problems are meaningless from that step on, the
+    other problems are not affected.
+    """
+    B, T, n = fx.shape[:3]
+    m = fu.shape[-1]
+    G = np.concatenate([fu, fx], axis=-1)
+    L = np.empty((B, T, m + n, m + n + 1))
+    L[..., :m, :m] = luu
+    L[..., :m, m:m + n] = lux
+    L[..., m:, :m] = lux.T
+    L[..., m:, m:m + n] = lxx
+    L[..., :m, -1] = lu
+    L[..., m:, -1] = lx
+    mu = np.broadcast_to(np.asarray(mu, dtype=float), (B,))[:, None, None]*np.eye(n)
+    W = np.empty((B, n, m + n + 1))
+    failed = np.full(B, -1)
+    eye = np.eye(m)
+    for i in range(T - 1, -1, -1):
+        Gi = G[:, i]
+        np.matmul(Vxx[:, i + 1] + mu, Gi, out=W[..., :-1])
+        W[..., -1] = Vx[:, i + 1]
+        H = np.matmul(np.swapaxes(Gi, -1, -2), W) + L[:, i]
+        if f_hess is not None:
+            H[..., :-1] += np.einsum('bn,bnij->bij', Vx[:, i + 1], f_hess[:, i])
+        Quu = H[:, :m, :m]
+        active = np.flatnonzero(failed < 0)
+        try:
+            np.linalg.cholesky(Quu[active])
+        except np.linalg.LinAlgError:
+            for b in active:
+                try:
+                    np.linalg.cholesky(Quu[b])
+                except np.linalg.LinAlgError:
+                    failed[b] = i
+        done = failed >= 0
+        if np.any(done):
+            # keep the recursion of the problems that failed finite
+            Quu = np.where(done[:, None, None], eye, Quu)
+            H[done] = 0.0
+        # solution = Quu^-1 [Qux Qu] = -[K k]
+        solution = np.linalg.solve(Quu, H[:, :m, m:])
+        np.negative(solution[..., :n], out=K[:, i])
+        np.negative(solution[..., n], out=k[:, i])
+        # [Vxx Vx] = [Qxx Qx] + K'[Qux Qu]
+        V = H[:, m:, m:] + np.matmul(np.swapaxes(K[:, i], -1, -2), H[:, :m, m:])
+        Vxx[:, i] = V[..., :n]
+        Vx[:, i] = V[..., n]
+    return failed
+
+
+def riccati_loops(fx, fu, lx, lu, lxx, luu, lux, mu, k, K, Vx, Vxx, second_order, f_hess):
+    """
+    Same recursion as riccati_numpy written with scalar loops and an inline
+    Cholesky factorization, meant to be compiled with numba. lxx is per step
+    (T, n, n), f_hess is only read if second_order is True.
+    """
+    n = fx.shape[1]
+    m = fu.shape[2]
+    fxV = np.empty((n, n))
+    fuV = np.empty((m, n))
+    Qx = np.empty(n)
+    Qu = np.empty(m)
+    Qxx = np.empty((n, n))
+    Quu = np.empty((m, m))
+    Qux = np.empty((m, n))
+    L = np.zeros((m, m))
+    y = np.empty(m)
+    z = np.empty(m)
+    for i in range(fx.shape[0] - 1, -1, -1):
+        for a in range(n):
+            s = lx[i, a]
+            for b in range(n):
+                s += fx[i, b, a]*Vx[i + 1, b]
+            Qx[a] = s
+        for a in range(m):
+            s = lu[i, a]
+            for b in range(n):
+                s += fu[i, b, a]*Vx[i + 1, b]
+            Qu[a] = s
+        # fx'(Vxx + mu*I) and fu'(Vxx + mu*I)
+        for a in range(n):
+            for b in range(n):
+                s = mu*fx[i, b, a]
+                for c in range(n):
+                    s += fx[i, c, a]*Vxx[i + 1, c, b]
+                fxV[a, b] = s
+        for a in range(m):
+            for b in range(n):
+                s = mu*fu[i, b, a]
+                for c in range(n):
+                    s += fu[i, c, a]*Vxx[i + 1, c, b]
+                fuV[a, b] = s
+        for a in range(n):
+            for b in range(n):
+                s = lxx[i, a, b]
+                for c in range(n):
+                    s += fxV[a, c]*fx[i, c, b]
+                Qxx[a, b] = s
+        for a in range(m):
+            for b in range(m):
+                s = luu[a, b]
+                for c in range(n):
+                    s += fuV[a, c]*fu[i, c, b]
+                Quu[a, b] = s
+            for b in range(n):
+                s = lux[a, b]
+                for c in range(n):
+                    s += fuV[a, c]*fx[i, c, b]
+                Qux[a, b] = s
+        if second_order:
+            for c in range(n):
+                v = Vx[i + 1, c]
+                for a in range(m):
+                    for b in range(m):
+                        Quu[a, b] += v*f_hess[i, c, a, b]
+                    for b in range(n):
+                        Qux[a, b] += v*f_hess[i, c, a, m + b]
+                for a in range(n):
+                    for b in range(n):
+                        Qxx[a, b] += v*f_hess[i, c, m + a, m + b]
+        # Quu = L L'
+        for a in range(m):
+            for b in range(a + 1):
+                s = Quu[a, b]
+                for c in range(b):
+                    s -= L[a, c]*L[b, c]
+                if a == b:
+                    if s <= 0.0:
+                        return i
+                    L[a, a] = np.sqrt(s)
+                else:
+                    L[a, b] = s/L[b, b]
+        # [k K] = -Quu^-1 [Qu Qux], one column at a time
+        for col in range(n + 1):
+            for a in range(m):
+                if col == 0:
+                    s = -Qu[a]
+                else:
+                    s = -Qux[a, col - 1]
+                for c in range(a):
+                    s -= L[a, c]*y[c]
+                y[a] = s/L[a, a]
+            for a in range(m - 1, -1, -1):
+                s = y[a]
+                for c in range(a + 1, m):
+                    s -= L[c, a]*z[c]
+                z[a] = s/L[a, a]
+            for a in range(m):
+                if col == 0:
+                    k[i, a] = z[a]
+                else:
+                    K[i, a, col - 1] = z[a]
+        for a in range(n):
+            s = Qx[a]
+            for c in range(m):
+                s += K[i, c, a]*Qu[c]
+            Vx[i, a] = s
+            for b in range(n):
+                s = Qxx[a, b]
+                for c in range(m):
+                    s += K[i, c, a]*Qux[c, b]
+                Vxx[i, a, b] = s
+    return -1
+
+
+def get_riccati_numba():
+    global riccati_numba
+    if riccati_numba is None:
+        import numba
+        riccati_numba = numba.njit(cache=True)(riccati_loops)
+    return riccati_numba
+
+
+def riccati_backward(fx, fu, lx, lu, lxx, luu, lux, mu, k, K, Vx, Vxx, f_hess=None, use_numba=False):
+    """
+    Run the backward recursion with the numba kernel if requested and
+    available, otherwise with the NumPy kernel. See riccati_numpy, batches of
+    problems always run with the NumPy kernel.
+    """
+    if use_numba and numba_available and fx.ndim == 3:
+        second_order = f_hess is not None
+        if not second_order:
+            f_hess = np.zeros((0, 0, 0, 0))
+        if lxx.ndim == 2:
+            lxx = np.ascontiguousarray(np.broadcast_to(lxx, (fx.shape[0],) + lxx.shape))
+        return get_riccati_numba()(fx, fu, lx, lu, lxx, luu, lux, float(mu), k, K, Vx, Vxx,
+                                   second_order, f_hess)
+    return riccati_numpy(fx, fu, lx, lu, lxx, luu, lux, mu, k, K, Vx, Vxx, f_hess)
@@ -0,0 +1,66 @@
+import numpy as np
+import scipy.sparse as sparse
+
+
+class SparsityPattern:
+    """
+    Fixed CSC sparsity pattern of a matrix assembled from groups of entries,
+    e.g. the stacked Jacobian blocks of a QP constraint matrix.
+    Each group is added once with the row and column indices of its entries,
+    compile() builds the CSC structure, and to_csc() then only scatters new
+    values into the data vector. Entries are kept even if their value is zero,
+    so the pattern stays the same between iterations.
+    """
+
+    def __init__(self, shape):
+        self.shape = shape
+        self.groups = {}
+        self.slots = {}
+        self.indices = None
+        self.indptr = None
+        self.nnz = 0
+
+    def add(self, name, rows, cols):
+        rows, cols = np.broadcast_arrays(np.asarray(rows), np.asarray(cols))
+        self.groups[name] = (rows, cols)
+
+    def add_blocks(self, name, row_offsets, col_offsets, block_shape):
+        """
+        Dense blocks of shape block_shape with their top left corners at
+        (row_offsets[k], col_offsets[k]), values are given as (K, r, c).
+        """
+        rows = np.asarray(row_offsets)[:, None, None] + \
+            np.arange(block_shape[0])[None, :, None]
+        cols = np.asarray(col_offsets)[:, None, None] + \
+            np.arange(block_shape[1])[None, None, :]
+        self.add(name, rows, cols)
+
+    def compile(self):
+        rows = np.concatenate([r.ravel() for r, c in self.groups.values()])
+        cols = np.concatenate([c.ravel() for r, c in self.groups.values()])
+        self.nnz = rows.shape[0]
+        order = np.arange(1, self.nnz + 1, dtype=float)
+        pattern = sparse.coo_matrix(
+            (order, (rows, cols)), shape=self.shape).tocsc()
+        if pattern.nnz != self.nnz:
+            raise ValueError("overlapping entries in sparsity pattern")
+        pattern.sort_indices()
+        self.indices = pattern.indices
+        self.indptr = pattern.indptr
+        slots = np.empty(self.nnz, dtype=int)
+        slots[pattern.data.astype(int) - 1] = np.arange(self.nnz)
+        offset = 0
+        for name, (r, c) in self.groups.items():
+            self.slots[name] = slots[offset:offset + r.size].reshape(r.shape)
+            offset += r.size
+        return self
+
+    def to_csc(self, values):
+        """
+        values maps each group name to an array broadcastable to the shape of
+        its indices.
+        """
+        data = np.empty(self.nnz)
+        for name, slot in self.slots.items():
+            data[slot] = values[name]
+        return sparse.csc_matrix((data, self.indices, self.indptr), shape=self.shape)
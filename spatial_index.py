@@ -0,0 +1,122 @@
+import numpy as np
+from scipy.spatial import cKDTree
+from constraints import BubbleConstraint, EllipsoidConstraint
+
+"KD-tree over obstacle or map points for building constraints along a trajectory"
+
+
+class ObstacleIndex:
+    """
+    KD-tree over obstacle or map points (N, d), each inflated by radius.
+    Queries take positions of any leading shape (..., d) and cost O(log N)
+    per position, so building constraints is sub-linear in the map size.
+    """
+
+    def __init__(self, points, radius=0.0):
+        self.points = np.asarray(points, dtype=float)
+        self.radius = float(radius)
+        self.tree = cKDTree(self.points)
+
+    def __len__(self):
+        return self.points.shape[0]
+
+    def nearest(self, positions, k=1):
+        """
+        Distances to the centers and indices of the k nearest points, each of
+        shape (..., k), sorted by distance. Missing neighbors (k > N) have
+        distance inf and index N.
+        """
+        distances, indices = self.tree.query(positions, k=k)
+        if k == 1:
+            distances = distances[..., None]
+            indices = indices[..., None]
+        return distances, indices
+
+    def clearance(self, positions):
+        """
+        Radius of the free space around every position, the distance to the
+        nearest inflated point.
+        """
+        return self.nearest(positions)[0][..., 0] - self.radius
+
+    def bubble_constraint(self, centers, vel_bounds, margin=0.0, max_radius=np.inf, **kwargs):
+        """
+        BubbleConstraint with a bubble of free space around each of the
+        centers (T, d), keeping margin to the nearest point.
+        """
+        constraint = BubbleConstraint(len(centers), **kwargs)
+        constraint.setup_free_space(self, centers, vel_bounds, margin, max_radius)
+        return constraint
+
+
+class NearestObstacleConstraint(EllipsoidConstraint):
+    """
+    Keep the position of every step outside the discs of its k nearest
+    points of an ObstacleIndex, with radius index.radius + margin. setup
+    associates the obstacles with the steps of a trajectory, and update,
+    which the optimizers call before linearizing, re-queries the steps that
+    moved further than half the gap between their k-th and (k+1)-th nearest
+    point since their last query. Within that distance their k nearest
+    points cannot change, so the association is exact at every update.
+    An obstacle that stays among the k nearest of a step keeps its row, and
+    update returns the mask of the rows that now hold another obstacle.
+    The values are squared distances scaled by the squared radius, so the
+    screening_margin of sequential_QP_optimizer is in those units.
+    """
+
+    def __init__(self, index, horizon, k=4, margin=0.0, state_size=4, position_indices=(0, 1)):
+        if not index.radius + margin > 0.0:
+            raise ValueError("the obstacle radius plus margin must be positive, got %g"
+                             % (index.radius + margin))
+        k = min(k, len(index))
+        super().__init__(horizon, k, state_size, position_indices)
+        self.index = index
+        d = len(self.position_indices)
+        self.shapes = np.broadcast_to(np.eye(d)/(index.radius + margin)**2, (horizon, k, d, d))
+        self.centers = np.zeros((horizon, k, d))
+        self.obstacles = np.full((horizon, k), -1)
+        self.query_positions = np.zeros((horizon, d))
+        self.slack = np.full(horizon, -np.inf)
+        self.queries = 0
+
+    def setup(self, states):
+        self.slack[:] = -np.inf
+        self.obstacles[:] = -1
+        self.update(states)
+
+    def update(self, states):
+        positions = self.positions(np.asarray(states)[:self.horizon])
+        moved = np.linalg.norm(positions - self.query_positions, axis=-1) > self.slack
+        if not np.any(moved):
+            return None
+        k = self.constraint_size
+        distances, indices = self.index.nearest(positions[moved], k + 1)
+        previous = self.obstacles[moved]
+        obstacles = self.keep_rows(previous, indices[:, :k])
+        self.obstacles[moved] = obstacles
+        self.centers[moved] = self.index.points[obstacles]
+        self.query_positions[moved] = positions[moved]
+        # distances[:, k] is inf if there is no (k+1)-th point
+        self.slack[moved] = 0.5*(distances[:, k] - distances[:, k - 1])
+        self.queries += int(np.count_nonzero(moved))
+        changed = np.zeros((self.horizon, k), dtype=bool)
+        changed[moved] = obstacles != previous
+        return changed
+
+    @staticmethod
+    def keep_rows(previous, nearest):
+        """
+        The obstacles nearest (m, k) arranged so that those already in
+        previous (m, k) keep their column, the others fill the freed columns
+        in order of distance.
+        """
+        kept = (previous[:, :, None] == nearest[:, None, :]).any(axis=2)
+        new = ~(nearest[:, :, None] == previous[:, None, :]).any(axis=2)
+        obstacles = np.where(kept, previous, -1)
+        # the j-th free column of a row takes its j-th new obstacle
+        columns = np.argsort(kept, axis=1, kind='stable')
+        sources = np.argsort(~new, axis=1, kind='stable')
+        fill = np.arange(nearest.shape[1]) < np.count_nonzero(new, axis=1)[:, None]
+        rows = np.broadcast_to(np.arange(nearest.shape[0])[:, None], fill.shape)
+        obstacles[rows[fill], columns[fill]] = nearest[rows[fill], sources[fill]]
+        return obstacles
@@ -1,8 +1,66 @@
 import osqp
 import numpy as np
-from matplotlib import pyplot as plt
 import scipy.sparse as sparse
-from scipy.linalg import block_diag
+from collections import OrderedDict
+from importlib.metadata import version
+from costs import sufficient_decrease, trajectory_cost
+from deadline import Deadline
+from instrumentation import phase
+from sparse_pattern import SparsityPattern
+
+P_cache = OrderedDict()
+P_cache_size = 16
+
+# the OSQP time_limit that disables the limit: 0 before OSQP 1.0, which
+# requires a positive limit and defaults to 1e10
+no_time_limit = 0.0 if int(version('osqp').split('.')[0]) < 1 else 1e10
+
+# OSQP statuses whose solution the SQP steps towards
+qp_solved = ('solved', 'solved inaccurate')
+# OSQP status of a QP stopped by the time_limit the time_budget sets
+qp_timed_out = 'run time limit reached'
+
+
+def cost_hessian(Q, R, Qf, horizon):
+    """
+    Block diagonal QP cost matrix diag(Q, ..., Q, Qf, R, ..., R). It only
+    depends on the weights and the horizon, so the matrices are kept in a
+    least recently used cache of at most P_cache_size entries.
+    """
+    Q = np.asarray(Q, dtype=float)
+    R = np.asarray(R, dtype=float)
+    Qf = np.asarray(Qf, dtype=float)
+    key = (horizon, Q.shape, R.shape, Q.tobytes(), R.tobytes(), Qf.tobytes())
+    P = P_cache.get(key)
+    if P is not None:
+        P_cache.move_to_end(key)
+        return P
+    P = sparse.block_diag([sparse.kron(sparse.eye(horizon - 1), Q), Qf,
+                           sparse.kron(sparse.eye(horizon - 1), R)]).tocsc()
+    P_cache[key] = P
+    while len(P_cache) > P_cache_size:
+        P_cache.popitem(last=False)
+    return P
+
+
+def same_sparsity(A, B):
+    return A.shape == B.shape and np.array_equal(A.indptr, B.indptr) and \
+        np.array_equal(A.indices, B.indices)
+
+
+def shift_blocks(v, blocks):
+    """
+    Shift every segment of v by one step. blocks lists (segment size, step
+    size) in order, the last step of each segment is repeated.
+    """
+    shifted = []
+    start = 0
+    for size, step in blocks:
+        segment = v[start:start + size]
+        shifted.append(np.concatenate([segment[step:], segment[size - step:]]))
+        start += size
+    return np.concatenate(shifted)
+
 
 class sequential_QP_optimizer:
     """
@@ -13,6 +71,20 @@ class sequential_QP_optimizer:
     A Linear Time Varying Model Predictive Control Approach to the Integrated 
     Vehicle Dynamics Control Problem in Autonomous Systems
     https://ieeexplore.ieee.org/document/4434137
+    A line search step is accepted if it achieves the fraction armijo of the
+    cost reduction the QP objective predicts for it, and the solve converges
+    once the achieved reduction drops below cost_eps relative to the cost.
+    With screening, a QP only contains the constraint rows (state constraints
+    and input bounds) within screening_margin of being active at the current
+    iterate, and the rows within screening_band steps of those. Screening
+    starts once a step has been accepted with all rows. The QP solution and
+    the accepted step are checked against all rows; if a left out row is
+    violated, the step is undone, the row stays in the QP for the rest of
+    the solve and the QP is solved again in the same iteration.
+    The constraints are linearized at the rollout of the inputs, also when
+    reset_states linearizes the dynamics at the target states, which may lie
+    inside obstacles. A QP that OSQP does not solve (e.g. infeasible) ends
+    the solve unconverged, with its status in status['qp_status'].
     """
     def __init__(self, sys, constraint, target_states, dt):
         self.target_states = target_states
@@ -30,10 +102,36 @@ class sequential_QP_optimizer:
         self.min_cost = 0.0
         self.eps = 1e-2
         self.cost_eps = 1e-6
+        self.armijo = 0.1
         self.states = np.zeros((self.horizon, self.n_states))
         self.inputs = np.zeros((self.horizon - 1, self.m_inputs))
         self.u0 = self.inputs[0, :]
         self.init_input_fixed = False
+        self.reset_states = True
+        self.time_budget = None
+        self.deadline = Deadline()
+        self.alpha = 0.0
+        self.status = {}
+        self.trace = None
+        self.line_search_trials = 0
+        self.qp_time_limited = False
+        self.qp_solver = None
+        self.qp_P = None
+        self.qp_P_full = None
+        self.qp_A = None
+        self.A_pattern = None
+        self.A_pattern_key = None
+        self.screening = False
+        self.screening_margin = 0.5
+        self.screening_band = 2
+        self.screening_keep = None
+        self.qp_keep = None
+        self.qp_inequalities = None
+        self.qp_rows = None
+        self.qp_n_rows = 0
+        self.qp_x = None
+        self.qp_y = None
+        self.constraint_states = None
         self.x0 = self.target_states[0, :]
         self.umin = -np.ones(self.m_inputs)*np.inf
         self.umax = np.ones(self.m_inputs)*np.inf
@@ -42,130 +140,412 @@ class sequential_QP_optimizer:
             self.umax = self.system.control_upper_limit
 
     def cost(self):
-        states_diff = self.states - self.target_states
-        cost = 0.0
-        for i in range(self.horizon - 1):
-            state = np.reshape(states_diff[i, :], (-1, 1))
-            control = np.reshape(self.inputs[i, :], (-1, 1))
-            cost += np.dot(np.dot(state.T, self.Q), state) + \
-                np.dot(np.dot(control.T, self.R), control)
-        state = np.reshape(states_diff[-1, :], (-1, 1))
-        cost += np.dot(np.dot(state.T, self.Qf), state)
-        return cost[0, 0]
+        return trajectory_cost(self.states, self.inputs, self.target_states, self.Q, self.R, self.Qf)
 
     def sim(self, x0, inputs):
-        states = np.zeros((self.horizon, self.n_states))
-        states[0, :] = x0
-        for i in range(self.horizon - 1):
-            states[i + 1, :] = self.system.model_f(states[i], inputs[i])
-        return states
+        return self.system.rollout(x0, inputs)
 
     def set_init_inputs(self, init_inputs):
         self.inputs = init_inputs
         self.u0 = init_inputs[0, :]
 
+    def set_target_states(self, target_states):
+        """
+        Point the optimizer at a new reference, e.g. for the next problem or
+        planning cycle. The OSQP workspace and the constraint pattern are kept.
+        """
+        self.target_states = target_states
+        self.horizon = self.target_states.shape[0]
+        self.x0 = self.target_states[0, :]
+
     def plot(self):
-        plt.figure(figsize=(8*1.1, 6*1.1))
-        plt.title('SQP: 2D, x and y.  ')
-        plt.axis('equal')
-        plt.plot(self.target_states[:, 0], self.target_states[:, 1],
-                 '--r', label='Target', linewidth=2)
-        plt.plot(self.states[:, 0], self.states[:, 1],
-                 '-+k', label='MPC', linewidth=1.0)
-        plt.show()
+        from plotting import plot_trajectory
+        plot_trajectory(self, 'SQP: 2D, x and y.  ', 'MPC')
 
     def compute_P_q(self):
-        P = sparse.block_diag([sparse.kron(sparse.eye(self.horizon - 1), self.Q), self.Qf,
-                               sparse.kron(sparse.eye(self.horizon - 1), self.R)]).tocsc()
-        q = -self.Q.dot(self.target_states[0, :])
-        for i in range(1, self.horizon - 1):
-            q = np.hstack([q, -self.Q.dot(self.target_states[i, :])])
-        q = np.hstack([q, -self.Qf.dot(self.target_states[-1, :]),
-                       np.zeros((self.horizon - 1)*self.m_inputs)])
+        P = cost_hessian(self.Q, self.R, self.Qf, self.horizon)
+        n_x = self.horizon*self.n_states
+        q = np.zeros(n_x + (self.horizon - 1)*self.m_inputs)
+        q[:n_x - self.n_states] = -np.dot(self.target_states[:-1, :], self.Q.T).ravel()
+        q[n_x - self.n_states:n_x] = -self.Qf.dot(self.target_states[-1, :])
         return P, q
 
+    def setup_A_pattern(self, keep=None):
+        """
+        Sparsity pattern of the QP constraint matrix, in row order: initial
+        state (and initial input), linearized dynamics, state constraints and
+        input bounds, of which only the rows in the mask keep are included if
+        given. It only depends on the problem sizes (and keep), so it is
+        built once and compute_A_l_u only rewrites its data vector.
+        """
+        n = self.n_states
+        m = self.m_inputs
+        T = self.horizon
+        c = self.constraint.constraint_size
+        Tc = self.constraint.horizon
+        key = (T, n, m, c, Tc, self.init_input_fixed, None if keep is None else keep.tobytes())
+        if self.A_pattern is not None and self.A_pattern_key == key:
+            return self.A_pattern
+        n_x = T*n
+        n_u = (T - 1)*m
+        n_init = n + m if self.init_input_fixed else n
+        n_eq = n_init + (T - 1)*n
+        if keep is None:
+            keep = np.ones(Tc*c + n_u, dtype=bool)
+        # row of every kept inequality in the QP
+        position = n_eq + np.cumsum(keep) - 1
+        pattern = SparsityPattern((n_eq + np.count_nonzero(keep), n_x + n_u))
+        pattern.add('init_x', np.arange(n), np.arange(n))
+        if self.init_input_fixed:
+            pattern.add('init_u', n + np.arange(m), n_x + np.arange(m))
+        steps = np.arange(T - 1)
+        pattern.add_blocks('Ad', n_init + steps*n, steps*n, (n, n))
+        pattern.add('I', n_init + np.arange((T - 1)*n), n + np.arange((T - 1)*n))
+        pattern.add_blocks('Bd', n_init + steps*n, n_x + steps*m, (n, m))
+        rows = np.flatnonzero(keep[:Tc*c])
+        pattern.add('C', position[rows][:, None], (rows//c*n)[:, None] + np.arange(n))
+        rows = np.flatnonzero(keep[Tc*c:])
+        pattern.add('Du', position[Tc*c + rows], n_x + rows)
+        self.A_pattern = pattern.compile()
+        self.A_pattern_key = key
+        return self.A_pattern
+
     def compute_A_l_u(self):
-        Ad = []
-        Bd = []
-        for i in range(self.horizon - 1):
-            Ai = self.system.compute_df_dx(
-                self.states[i, :], self.inputs[i, :])
-            Bi = self.system.compute_df_du(
-                self.states[i, :], self.inputs[i, :])
-            Ad.append(Ai)
-            Bd.append(Bi)
-        Bu = sparse.csr_matrix(block_diag(*Bd))
-        Ax = sparse.csr_matrix(block_diag(*Ad))
-        off_set = np.zeros(
-            ((self.horizon - 1)*self.n_states, self.n_states))
-        Ax = sparse.hstack([Ax, off_set])
-        Ax = Ax + np.hstack(
-            [off_set, -np.eye(self.n_states*(self.horizon - 1))])
-        Aeq = sparse.hstack([Ax, Bu])
-        init_x = np.zeros((self.n_states, Aeq.shape[1]))
-        init_u = np.zeros((self.m_inputs, Aeq.shape[1]))
-        for i in range(self.n_states):
-            init_x[i, i] = 1
-        for i in range(self.m_inputs):
-            init_u[i, self.horizon*self.n_states + i] = 1
+        with phase(self.trace, 'linearize'):
+            Ad, Bd = self.system.linearize(self.states, self.inputs)
+        with phase(self.trace, 'qp_assembly'):
+            return self.assemble_A_l_u(Ad, Bd)
+
+    def screen_rows(self, states, C, xmin, xmax):
+        """
+        Mask of the inequality rows (state constraints, then input bounds)
+        that are within screening_margin of being active at states, dilated
+        by screening_band steps, plus the rows kept after a violation.
+        """
+        c = self.constraint.constraint_size
+        Tc = self.constraint.horizon
+        values = np.einsum('tij,tj->ti', C, states[:Tc])
+        near_c = np.maximum(values - np.reshape(xmax, (Tc, c)),
+                            np.reshape(xmin, (Tc, c)) - values) > -self.screening_margin
+        near_u = np.maximum(self.inputs - self.umax, self.umin - self.inputs) > -self.screening_margin
+        masks = []
+        for near in (near_c, near_u):
+            keep = near.copy()
+            for step in range(1, self.screening_band + 1):
+                keep[step:] |= near[:-step]
+                keep[:-step] |= near[step:]
+            masks.append(keep.ravel())
+        keep = np.concatenate(masks)
+        if self.screening_keep is not None:
+            keep |= self.screening_keep
+        return keep
+
+    def qp_violations(self, solution):
+        """
+        Mask of the inequality rows left out of the last QP that its
+        solution violates.
+        """
+        C, xmin, xmax = self.qp_inequalities
+        Tc = self.constraint.horizon
+        n_x = self.horizon*self.n_states
+        states = np.reshape(solution[:n_x], (self.horizon, self.n_states))
+        inputs = np.reshape(solution[n_x:], (-1, self.m_inputs))
+        values = np.einsum('tij,tj->ti', C, states[:Tc]).ravel()
+        violated_c = np.maximum(values - xmax, xmin - values) > 0.0
+        violated_u = np.maximum(inputs - self.umax, self.umin - inputs) > 0.0
+        violated = np.concatenate([violated_c, violated_u.ravel()])
+        return violated & ~self.qp_keep
+
+    def screened_violations(self):
+        """
+        Mask of the inequality rows left out of the last QP that the current
+        trajectory violates.
+        """
+        self.constraint.update(self.states)
+        residuals = self.constraint.get_residuals(self.states)[0]
+        c = self.constraint.constraint_size
+        violated_c = np.maximum(residuals[:, :c], residuals[:, c:]) > 0.0
+        violated_u = np.maximum(self.inputs - self.umax, self.umin - self.inputs) > 0.0
+        violated = np.concatenate([violated_c.ravel(), violated_u.ravel()])
+        return violated & ~self.qp_keep
+
+    def assemble_A_l_u(self, Ad, Bd):
+        states = self.states if self.constraint_states is None else self.constraint_states
+        self.constraint.update(states)
+        C, xmin, xmax = self.constraint.get_linear_bounds(states)
+        keep = None
+        if self.screening and np.isfinite(self.min_cost):
+            # not before a step has been accepted with all rows, undoing
+            # that step would fall back to the target states
+            keep = self.screen_rows(states, C, xmin, xmax)
+            self.qp_inequalities = (C, xmin, xmax)
+        self.qp_keep = keep
+        pattern = self.setup_A_pattern(keep)
+        lineq = np.hstack([xmin, np.tile(self.umin, self.horizon - 1)])
+        uineq = np.hstack([xmax, np.tile(self.umax, self.horizon - 1)])
+        C = C.reshape(-1, self.n_states)
+        if keep is not None:
+            lineq = lineq[keep]
+            uineq = uineq[keep]
+            C = C[keep[:C.shape[0]]]
+        A = pattern.to_csc({'init_x': 1.0, 'init_u': 1.0, 'Ad': Ad, 'I': -1.0, 'Bd': Bd,
+                            'C': C, 'Du': 1.0})
+        d = -self.states[1:, :] + \
+            np.einsum('tij,tj->ti', Ad, self.states[:-1, :]) + \
+            np.einsum('tij,tj->ti', Bd, self.inputs)
         if self.init_input_fixed:
-            Aeq = sparse.vstack([init_x, init_u, Aeq])
+            leq = np.hstack([self.x0, self.u0, d.ravel()])
         else:
-            Aeq = sparse.vstack([init_x, Aeq])
-        Cu = self.constraint.get_linear_constraint(self.states)
-        Du = np.eye((self.horizon - 1)*self.m_inputs)
-        Aineq = sparse.csr_matrix(block_diag(Cu, Du))
-        A = sparse.vstack([Aeq, Aineq]).tocsc()
-        leq = []
-        leq.extend(self.x0)
-        if self.init_input_fixed:
-            leq.extend(self.u0)
-        for i in range(0, self.horizon - 1):
-            d = -self.states[i + 1, :] + \
-                np.dot(Ad[i], self.states[i, :]) + \
-                np.dot(Bd[i], self.inputs[i, :])
-            leq.extend(d)
+            leq = np.hstack([self.x0, d.ravel()])
         ueq = leq
-        xmin, xmax = self.constraint.get_bounds(self.states)
-        uineq = np.hstack([xmax, np.kron(np.ones(self.horizon - 1), self.umax)])
-        lineq = np.hstack([xmin, np.kron(np.ones(self.horizon - 1), self.umin)])
         l = np.hstack([leq, lineq])
         u = np.hstack([ueq, uineq])
+        # rows of A among the rows of the unscreened constraint matrix
+        self.qp_n_rows = leq.shape[0] + xmin.shape[0] + (self.horizon - 1)*self.m_inputs
+        self.qp_rows = None
+        if keep is not None:
+            self.qp_rows = np.concatenate([np.arange(leq.shape[0]), leq.shape[0] + np.flatnonzero(keep)])
         return A, l, u
 
+    def solve_qp(self, P, q, A, l, u):
+        """
+        Solve the QP subproblem in a persistent OSQP workspace. As long as the
+        sparsity of P and A is unchanged only the new values are pushed with
+        update(), and OSQP warm starts from the previous primal/dual solution,
+        also across calls of the optimizer. Otherwise the workspace is set up
+        again and warm started from the previous solution if the sizes match.
+        The dual solution is kept for all rows of the unscreened constraint
+        matrix, so warm starts stay aligned when screening changes the rows.
+        A solution with a status other than qp_solved is not kept, and the
+        workspace is warm started from the last kept one again.
+        """
+        if P is self.qp_P_full:
+            P_full, P = P, self.qp_P
+        else:
+            P_full, P = P, sparse.triu(P, format='csc')
+            P.sort_indices()
+        A = A.tocsc()
+        A.sort_indices()
+        if self.qp_solver is not None and same_sparsity(P, self.qp_P) and same_sparsity(A, self.qp_A):
+            if np.array_equal(P.data, self.qp_P.data):
+                self.qp_solver.update(q=q, l=l, u=u, Ax=A.data)
+            else:
+                self.qp_solver.update(q=q, l=l, u=u, Px=P.data, Ax=A.data)
+        else:
+            prev_solver = self.qp_solver
+            self.qp_solver = osqp.OSQP()
+            self.qp_solver.setup(P, q, A, l, u, verbose=False)
+            if prev_solver is not None and self.qp_x is not None and \
+                    self.qp_P.shape == P.shape and self.qp_y.shape[0] == self.qp_n_rows:
+                self.qp_solver.warm_start(x=self.qp_x, y=self.screened_duals())
+        self.qp_P_full = P_full
+        self.qp_P = P
+        self.qp_A = A
+        if self.time_budget is not None:
+            # the limit must stay positive, no_time_limit disables it
+            self.qp_solver.update_settings(
+                time_limit=max(self.deadline.remaining(), 1e-6))
+            self.qp_time_limited = True
+        elif self.qp_time_limited:
+            self.qp_solver.update_settings(time_limit=no_time_limit)
+            self.qp_time_limited = False
+        with phase(self.trace, 'qp_solve'):
+            res = self.qp_solver.solve()
+        if self.trace is not None:
+            self.trace.record(qp_iterations=res.info.iter)
+        if res.info.status not in qp_solved:
+            if self.qp_x is not None and self.qp_x.shape == res.x.shape and \
+                    self.qp_y.shape[0] == self.qp_n_rows:
+                self.qp_solver.warm_start(x=self.qp_x, y=self.screened_duals())
+            return res
+        self.qp_x = res.x
+        if self.qp_rows is None:
+            self.qp_y = res.y
+        else:
+            self.qp_y = np.zeros(self.qp_n_rows)
+            self.qp_y[self.qp_rows] = res.y
+        return res
+
+    def screened_duals(self):
+        """
+        The dual solution restricted to the rows of the current QP.
+        """
+        return self.qp_y if self.qp_rows is None else self.qp_y[self.qp_rows]
+
+    def shift_qp_solution(self):
+        """
+        Shift the last QP primal/dual solution one step ahead, repeating the
+        last step as the tail, and warm start the OSQP workspace with it for
+        the next receding horizon solve.
+        """
+        if self.qp_x is None:
+            return
+        n = self.n_states
+        m = self.m_inputs
+        n_init = n + m if self.init_input_fixed else n
+        c = self.constraint.constraint_size
+        x_blocks = [(self.horizon*n, n), ((self.horizon - 1)*m, m)]
+        y_blocks = [(n_init, n_init), ((self.horizon - 1)*n, n),
+                    (self.constraint.horizon*c, c), ((self.horizon - 1)*m, m)]
+        if sum(size for size, step in x_blocks) != self.qp_x.shape[0] or \
+                sum(size for size, step in y_blocks) != self.qp_y.shape[0]:
+            return
+        self.qp_x = shift_blocks(self.qp_x, x_blocks)
+        self.qp_y = shift_blocks(self.qp_y, y_blocks)
+        self.qp_solver.warm_start(x=self.qp_x, y=self.screened_duals())
+
+    def expected_reduction(self, P, q, solution):
+        """
+        Function of the step size alpha returning the cost reduction that the
+        QP objective, half the trajectory cost, predicts for the step from the
+        current trajectory towards the QP solution.
+        """
+        z = np.concatenate([self.states.ravel(), self.inputs.ravel()])
+        d = solution - z
+        Pd = P.dot(d)
+        slope = 2.0*(np.dot(z, Pd) + np.dot(q, d))
+        curvature = np.dot(d, Pd)
+        return lambda alpha: -(alpha*slope + alpha**2*curvature)
+
+    def keep_screened_rows(self, violated):
+        """
+        Keep the rows in the mask violated in the QP for the rest of the solve.
+        """
+        if self.screening_keep is None:
+            self.screening_keep = violated
+        else:
+            self.screening_keep |= violated
+
+    def line_search(self, P, q, solution):
+        """
+        Step from the current trajectory towards the QP solution with step
+        sizes 1, 1/2, ... Sets alpha to the accepted step size, 0 if none.
+        Returns whether the deadline expired during the search.
+        """
+        prev_states = np.copy(self.states)
+        prev_inputs = np.copy(self.inputs)
+        solved_inputs = np.reshape(
+            solution[self.horizon*self.n_states:], (-1, self.m_inputs))
+        d_u = solved_inputs - self.inputs
+        expected = self.expected_reduction(P, q, solution)
+        alpha = 1.0
+        cost = np.inf
+        self.alpha = 0.0
+        self.line_search_trials = 0
+        while True:
+            self.line_search_trials += 1
+            self.inputs = prev_inputs + alpha*d_u
+            with phase(self.trace, 'rollout'):
+                self.states = self.sim(self.x0, self.inputs)
+            with phase(self.trace, 'cost'):
+                cost = self.cost()
+            if sufficient_decrease(cost, self.min_cost, expected(alpha), self.armijo):
+                # print("cost reduced, continue next qp, cost: ", cost)
+                if self.min_cost - cost < self.cost_eps*abs(self.min_cost):
+                    self.converge = True
+                self.min_cost = cost
+                self.alpha = alpha
+                return False
+            # print("cost not redeuced, reduce learning rate, alpha: ", alpha)
+            self.states = np.copy(prev_states)
+            self.inputs = np.copy(prev_inputs)
+            if alpha < self.eps or abs(1 - cost/self.min_cost) < self.cost_eps:
+                self.converge = True
+                return False
+            if self.deadline.expired():
+                return True
+            alpha /= 2.0
+
     def __call__(self):
+        self.deadline = Deadline(self.time_budget)
+        if self.trace is not None:
+            self.trace.begin_solve()
         P, q = self.compute_P_q()
-        self.states = self.target_states
-        self.min_cost = np.inf
+        initial_inputs = np.copy(self.inputs)
+        initial_states = self.sim(self.x0, initial_inputs)
+        if self.reset_states:
+            initial_cost = trajectory_cost(initial_states, initial_inputs,
+                                           self.target_states, self.Q, self.R, self.Qf)
+            self.states = self.target_states
+            self.min_cost = np.inf
+        else:
+            self.states = initial_states
+            self.min_cost = self.cost()
+            initial_cost = self.min_cost
+        # the rollout, not the target states, until a step is accepted
+        self.constraint_states = initial_states
         self.converge = False
+        self.alpha = 0.0
+        self.screening_keep = None
+        iterations = 0
+        screening_fallbacks = 0
+        timed_out = False
+        qp_status = None
 
         for iter in range(self.maxIter):
             if self.converge:
                 break
-            A, l, u = self.compute_A_l_u()
-            prob = osqp.OSQP()
-            prob.setup(P, q, A, l, u, warm_start=False, verbose=False)
-            res = prob.solve()
+            if iter > 0 and self.deadline.expired():
+                timed_out = True
+                break
+            if self.trace is not None:
+                self.trace.begin_iteration()
+            with phase(self.trace, 'linearize'):
+                Ad, Bd = self.system.linearize(self.states, self.inputs)
+            iterations += 1
             prev_states = np.copy(self.states)
             prev_inputs = np.copy(self.inputs)
-            solved_inputs = np.reshape(
-                res.x[self.horizon*self.n_states:], (-1, 2))
-            d_u = solved_inputs - self.inputs
-            alpha = 1.0
-            cost = np.inf
+            prev_cost = self.min_cost
             while True:
-                self.inputs = prev_inputs + alpha*d_u
-                self.states = self.sim(self.x0, self.inputs)
-                cost = self.cost()
-                if (cost < self.min_cost):
-                    # print("cost reduced, continue next qp, cost: ", cost)
-                    self.min_cost = cost
+                with phase(self.trace, 'qp_assembly'):
+                    A, l, u = self.assemble_A_l_u(Ad, Bd)
+                res = self.solve_qp(P, q, A, l, u)
+                qp_status = res.info.status
+                if qp_status not in qp_solved:
                     break
-                else:
-                    # print("cost not redeuced, reduce learning rate, alpha: ", alpha)
-                    self.states = np.copy(prev_states)
-                    self.inputs = np.copy(prev_inputs)
-                    if alpha < self.eps or abs(1 - cost/self.min_cost) < self.cost_eps:
-                        self.converge = True
-                        break
-                    alpha /= 2.0
+                if self.qp_keep is not None:
+                    violated = self.qp_violations(res.x)
+                    if np.any(violated):
+                        # the QP did not see these rows, solve it again with them
+                        self.keep_screened_rows(violated)
+                        screening_fallbacks += 1
+                        continue
+                timed_out = self.line_search(P, q, res.x) or timed_out
+                if self.alpha > 0.0 and self.qp_keep is not None:
+                    violated = self.screened_violations()
+                    if np.any(violated):
+                        # undo the step and solve the QP again with these rows
+                        self.keep_screened_rows(violated)
+                        self.states = prev_states
+                        self.inputs = prev_inputs
+                        self.min_cost = prev_cost
+                        self.alpha = 0.0
+                        self.converge = False
+                        screening_fallbacks += 1
+                        continue
+                break
+            if qp_status not in qp_solved:
+                if qp_status == qp_timed_out or self.deadline.expired():
+                    timed_out = True
+                if self.trace is not None:
+                    self.trace.end_iteration(self.min_cost, 0.0)
+                break
+            if self.alpha > 0.0:
+                self.constraint_states = None
+            if self.trace is not None:
+                self.trace.record(line_search_trials=self.line_search_trials)
+                self.trace.end_iteration(self.min_cost, self.alpha)
+        qp_failed = qp_status is not None and qp_status not in qp_solved
+        if (timed_out or qp_failed) and initial_cost < self.min_cost:
+            # the first step is taken unconditionally, fall back to the rollout
+            # of the initial inputs if it is still the best trajectory
+            self.states = initial_states
+            self.inputs = initial_inputs
+            self.min_cost = initial_cost
+            self.alpha = 0.0
+        self.status = {'iterations': iterations, 'alpha': self.alpha,
+                       'cost_reduction': initial_cost - self.min_cost,
+                       'converged': self.converge, 'timed_out': timed_out,
+                       'qp_status': qp_status, 'qp_rows': A.shape[0] if iterations else 0,
+                       'screening_fallbacks': screening_fallbacks,
+                       'solve_time': self.deadline.elapsed()}
@@ -1,6 +1,7 @@
 from systems import *
 from sqp import *
 from constraints import *
+from distance_field import SignedDistanceField
 import time
 import random
 import numpy as np
@@ -174,15 +175,6 @@ def corner_example():
     plt.show()
 
 
-def min_dist(line_x, line_y, x, y):
-    min_dist = np.inf
-    for i in range(line_x.shape[0]):
-        dist = ((x - line_x[i])**2 + (y - line_y[i])**2)**0.5
-        if dist < min_dist:
-            min_dist = dist
-    return min_dist
-
-
 def random_example_2():
 
     x1 = -0.5
@@ -196,6 +188,10 @@ def random_example_2():
         (np.linspace(x1, x2, num=100), np.linspace(x2, x3, num=100)), axis=0)
     line_y = np.concatenate(
         (np.linspace(y1, y2, num=100), np.linspace(y2, y3, num=100)), axis=0)
+    line = np.stack([line_x, line_y], axis=1)
+    # rasterized once, the bubbles are sized by interpolating the field
+    field = SignedDistanceField.from_points(
+        line, line.min(axis=0) - 2, line.max(axis=0) + 2, 0.05)
 
     horizon = 80
     target_states = np.zeros((horizon, 4))
@@ -232,12 +228,8 @@ def random_example_2():
         init_inputs[i - 1, 1] = (noisy_targets[i, 3] -
                                  noisy_targets[i - 1, 3])/dt
     constraint = BubbleConstraint(horizon)
-    radius = []
     vel_bounds = [0, 2]
-    for i in range(horizon):
-        r = min_dist(line_x, line_y, noisy_targets[i, 0], noisy_targets[i, 1])
-        radius.append(r)
-    constraint.setup(centers, radius, vel_bounds)
+    constraint.setup_free_space(field, centers, vel_bounds)
     start = time.time()
     mpc_optimizer = sequential_QP_optimizer(
         system, constraint, noisy_targets, dt)
@@ -262,7 +254,7 @@ def random_example_2():
     for i in range(mpc_optimizer.horizon):
         x = mpc_optimizer.target_states[i, 0]
         y = mpc_optimizer.target_states[i, 1]
-        r = radius[i]
+        r = constraint.radius[i]
         currentAxis.add_patch(Circle((x, y), radius=r, alpha=1))
     plt.show()
 
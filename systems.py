@@ -1,4 +1,22 @@
 import numpy as np
+from codegen import derivative_function
+from finite_difference import finite_difference_jacobians, finite_difference_hessians
+
+
+def map_steps(f, X, U):
+    """
+    Apply the single-step function f(x, u) to every state/input pair of X of
+    shape (..., n) and U of shape (..., m), the leading dimensions broadcast.
+    """
+    X = np.asarray(X, dtype=float)
+    U = np.asarray(U, dtype=float)
+    if X.ndim == 1 and U.ndim == 1:
+        return f(X, U)
+    batch_shape = np.broadcast_shapes(X.shape[:-1], U.shape[:-1])
+    X = np.broadcast_to(X, batch_shape + X.shape[-1:]).reshape(-1, X.shape[-1])
+    U = np.broadcast_to(U, batch_shape + U.shape[-1:]).reshape(-1, U.shape[-1])
+    out = np.array([f(x, u) for x, u in zip(X, U)])
+    return out.reshape(batch_shape + out.shape[1:])
 
 
 class System:
@@ -23,6 +41,110 @@ class System:
         self.control_lower_limit = lower_limit
         self.control_upper_limit = upper_limit
 
+    def model_f(self, x, u):
+        if not self.overrides('model_f_batch'):
+            raise NotImplementedError(
+                type(self).__name__ + " must override model_f or model_f_batch")
+        return self.model_f_batch(x, u)
+
+    def model_f_batch(self, X, U):
+        """
+        Propagate a batch of states X of shape (N, n) under inputs U of shape
+        (N, m), any number of leading dimensions is allowed. Subclasses should
+        override this with a vectorized version, the default falls back to one
+        model_f call per row.
+        """
+        if not self.overrides('model_f'):
+            raise NotImplementedError(
+                type(self).__name__ + " must override model_f or model_f_batch")
+        return map_steps(self.model_f, X, U)
+
+    def rollout(self, x0, U, states=None):
+        """
+        Simulate the open-loop inputs U of shape (..., T - 1, m) from x0 of
+        shape (..., n). The leading dimensions are broadcast, so a batch of
+        input sequences can be rolled out together. Returns the states of shape
+        (..., T, n), written into the preallocated buffer states if given.
+        """
+        U = np.asarray(U)
+        horizon = U.shape[-2] + 1
+        if states is None:
+            batch_shape = np.broadcast_shapes(np.shape(x0)[:-1], U.shape[:-2])
+            states = np.empty(batch_shape + (horizon, self.state_size))
+        states[..., 0, :] = x0
+        for i in range(horizon - 1):
+            states[..., i + 1, :] = self.model_f_batch(
+                states[..., i, :], U[..., i, :])
+        return states
+
+    def overrides(self, name):
+        return getattr(type(self), name) is not getattr(System, name)
+
+    def derivatives(self, X, U, order=1):
+        """
+        Jacobians df_dx (..., n, n) and df_du (..., n, m) of the dynamics,
+        with order=2 followed by the Hessians of every output df_dxdx
+        (..., n, n, n), df_dudu (..., n, m, m) and df_dudx (..., n, m, n).
+        The model is traced and differentiated symbolically into vectorized
+        NumPy code (codegen.py), which is generated once per system and values
+        of the attributes the model reads. Models that cannot be traced, e.g.
+        because they branch on the state, fall back to central finite
+        differences of model_f_batch with a warning.
+        """
+        generated = derivative_function(self, order)
+        if generated is not None:
+            return generated(X, U)
+        jacobians = finite_difference_jacobians(self.model_f_batch, X, U)
+        if order == 1:
+            return jacobians
+        return jacobians + finite_difference_hessians(self.model_f_batch, X, U)
+
+    def compute_df_dx(self, x, u):
+        return self.compute_df_dx_batch(x, u)
+
+    def compute_df_du(self, x, u):
+        return self.compute_df_du_batch(x, u)
+
+    def compute_df_dx_batch(self, X, U):
+        """
+        The default differentiates the model, subclasses may override this or
+        compute_df_dx with hand-written Jacobians.
+        """
+        if self.overrides('compute_df_dx'):
+            return map_steps(self.compute_df_dx, X, U)
+        return self.derivatives(X, U)[0]
+
+    def compute_df_du_batch(self, X, U):
+        if self.overrides('compute_df_du'):
+            return map_steps(self.compute_df_du, X, U)
+        return self.derivatives(X, U)[1]
+
+    def hessians(self, states, inputs):
+        """
+        Second derivatives of the dynamics along a trajectory, shapes as in
+        linearize. Returns df_dxdx (T, n, n, n), df_dudu (T, n, m, m) and
+        df_dudx (T, n, m, n), where df_dxdx[t, i] is the Hessian of output i
+        with respect to the state. Subclasses may override this with
+        hand-written Hessians, the default differentiates the model.
+        """
+        inputs = np.asarray(inputs)
+        states = np.asarray(states)[..., :inputs.shape[-2], :]
+        return self.derivatives(states, inputs, order=2)[2:]
+
+    def linearize(self, states, inputs):
+        """
+        Jacobians of the dynamics along a whole trajectory. states has shape
+        (T, n) or (T + 1, n), inputs has shape (T, m), the last state is
+        ignored if present. Returns df_dx of shape (T, n, n) and df_du of
+        shape (T, n, m). Leading batch dimensions are carried through.
+        """
+        inputs = np.asarray(inputs)
+        states = np.asarray(states)[..., :inputs.shape[-2], :]
+        if not any(self.overrides(name) for name in (
+                'compute_df_dx', 'compute_df_du', 'compute_df_dx_batch', 'compute_df_du_batch')):
+            return self.derivatives(states, inputs)
+        return self.compute_df_dx_batch(states, inputs), self.compute_df_du_batch(states, inputs)
+
 
 class Car(System):
     def __init__(self):
@@ -30,30 +152,29 @@ class Car(System):
         self.dt = 0.2
         self.control_bound = np.array([0.5, 5])
 
-    def model_f(self, x, u):
-        theta = x[3]
-        v = x[2]
-        acc = u[0]
-        theta_rate = u[1]
-        x_next = np.reshape(x, (-1, 1), order='F') + np.array(
-            [[v*np.cos(theta)], [v*np.sin(theta)], [acc], [theta_rate]])*self.dt
-        return np.reshape(x_next, (-1,))
-
-    def compute_df_dx(self, x, u):
-        theta = x[3]
-        v = x[2]
-        df_dx = np.array([[1.0, 0.0, np.cos(theta)*self.dt, -np.sin(theta)*v*self.dt],
-                          [0.0, 1.0, np.sin(theta)*self.dt, np.cos(theta)*v*self.dt],
-                          [0.0, 0.0,  1.0, 0.0],
-                          [0.0, 0.0,  0.0, 1.0]
-                          ])
+    def model_f_batch(self, X, U):
+        theta = X[..., 3]
+        v = X[..., 2]
+        acc = U[..., 0]
+        theta_rate = U[..., 1]
+        return X + np.stack(
+            [v*np.cos(theta), v*np.sin(theta), acc, theta_rate], axis=-1)*self.dt
+
+    def compute_df_dx_batch(self, X, U):
+        theta = X[..., 3]
+        v = X[..., 2]
+        df_dx = np.zeros(X.shape[:-1] + (4, 4))
+        df_dx[..., [0, 1, 2, 3], [0, 1, 2, 3]] = 1.0
+        df_dx[..., 0, 2] = np.cos(theta)*self.dt
+        df_dx[..., 0, 3] = -np.sin(theta)*v*self.dt
+        df_dx[..., 1, 2] = np.sin(theta)*self.dt
+        df_dx[..., 1, 3] = np.cos(theta)*v*self.dt
         return df_dx
 
-    def compute_df_du(self, x, u):
-        df_du = np.array([[0.0, 0.0],
-                          [0.0, 0.0],
-                          [1.0, 0.0],
-                          [0.0, 1.0]])*self.dt
+    def compute_df_du_batch(self, X, U):
+        df_du = np.zeros(X.shape[:-1] + (4, 2))
+        df_du[..., 2, 0] = self.dt
+        df_du[..., 3, 1] = self.dt
         return df_du
 
 class CarAcceleration(System):
@@ -61,61 +182,62 @@ class CarAcceleration(System):
         super().__init__(5, 2)
         self.dt = 0.2
 
-    def model_f(self, x, u):
-        theta = x[4]
-        v = x[2]
-        acc = x[3]
-        jerk = u[0]
-        theta_rate = u[1]
-        x_next = np.reshape(x, (-1, 1), order='F') + np.array(
-            [[v*np.cos(theta)], [v*np.sin(theta)], [acc], [jerk], [theta_rate]])*self.dt
-        return np.reshape(x_next, (-1,))
-
-    def compute_df_dx(self, x, u):
-        theta = x[4]
-        v = x[2]
-        df_dx = np.array([[1.0, 0.0, np.cos(theta)*self.dt, 0.0, -np.sin(theta)*v*self.dt],
-                          [0.0, 1.0, np.sin(theta)*self.dt, 0.0, np.cos(theta)*v*self.dt],
-                          [0.0, 0.0,  1.0, self.dt, 0.0],
-                          [0.0, 0.0,  0.0, 1.0, 0.0],
-                          [0.0, 0.0,  0.0, 0.0, 1.0]])
+    def model_f_batch(self, X, U):
+        theta = X[..., 4]
+        v = X[..., 2]
+        acc = X[..., 3]
+        jerk = U[..., 0]
+        theta_rate = U[..., 1]
+        return X + np.stack(
+            [v*np.cos(theta), v*np.sin(theta), acc, jerk, theta_rate], axis=-1)*self.dt
+
+    def compute_df_dx_batch(self, X, U):
+        theta = X[..., 4]
+        v = X[..., 2]
+        df_dx = np.zeros(X.shape[:-1] + (5, 5))
+        df_dx[..., [0, 1, 2, 3, 4], [0, 1, 2, 3, 4]] = 1.0
+        df_dx[..., 0, 2] = np.cos(theta)*self.dt
+        df_dx[..., 0, 4] = -np.sin(theta)*v*self.dt
+        df_dx[..., 1, 2] = np.sin(theta)*self.dt
+        df_dx[..., 1, 4] = np.cos(theta)*v*self.dt
+        df_dx[..., 2, 3] = self.dt
         return df_dx
 
-    def compute_df_du(self, x, u):
-        df_du = np.array([[0.0, 0.0],
-                          [0.0, 0.0],
-                          [0.0, 0.0],
-                          [1.0, 0.0],
-                          [0.0, 1.0]])*self.dt
-        return df_du    
+    def compute_df_du_batch(self, X, U):
+        df_du = np.zeros(X.shape[:-1] + (5, 2))
+        df_du[..., 3, 0] = self.dt
+        df_du[..., 4, 1] = self.dt
+        return df_du
 
 class DubinsCar(System):
     def __init__(self):
         super().__init__(3, 2)
         self.dt = 0.2
 
-    def model_f(self, x, u):
-        theta = x[2]
-        v = u[0]
-        curvature = u[1]
-        x_next = np.reshape(x, (-1, 1), order='F') + np.array(
-            [[v*np.cos(theta)], [v*np.sin(theta)], [v*curvature]])*self.dt
-        return np.reshape(x_next, (-1,))
-
-    def compute_df_dx(self, x, u):
-        theta = x[2]
-        v = u[0]
-        df_dx = np.array([[1.0, 0.0,  -np.sin(theta)*v*self.dt],
-                          [0.0, 1.0,   np.cos(theta)*v*self.dt],
-                          [0.0, 0.0,  1.0]
-                          ])
+    def model_f_batch(self, X, U):
+        theta = X[..., 2]
+        v = U[..., 0]
+        curvature = U[..., 1]
+        return X + np.stack(
+            [v*np.cos(theta), v*np.sin(theta), v*curvature], axis=-1)*self.dt
+
+    def compute_df_dx_batch(self, X, U):
+        theta = X[..., 2]
+        v = U[..., 0]
+        df_dx = np.zeros(X.shape[:-1] + (3, 3))
+        df_dx[..., [0, 1, 2], [0, 1, 2]] = 1.0
+        df_dx[..., 0, 2] = -np.sin(theta)*v*self.dt
+        df_dx[..., 1, 2] = np.cos(theta)*v*self.dt
         return df_dx
 
-    def compute_df_du(self, x, u):
-        theta = x[2]
-        v = u[0]
-        curvature = u[1]
-        df_du = np.array([[np.cos(theta), 0.0],
-                          [np.sin(theta), 0.0],
-                          [curvature, v]])*self.dt
+    def compute_df_du_batch(self, X, U):
+        theta = X[..., 2]
+        v = U[..., 0]
+        curvature = U[..., 1]
+        df_du = np.zeros(X.shape[:-1] + (3, 2))
+        df_du[..., 0, 0] = np.cos(theta)*self.dt
+        df_du[..., 1, 0] = np.sin(theta)*self.dt
+        df_du[..., 2, 0] = curvature*self.dt
+        df_du[..., 2, 1] = v*self.dt
         return df_du
+
@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+from benchmarks.run import build_problems, setup_solver
+
+
+def max_violation(problem, states):
+    problem.constraint.update(states)
+    return np.max(problem.constraint.get_residuals(states)[0])
+
+
+@pytest.mark.parametrize('horizon', [60, 80])
+def test_brings_the_bubble_violation_under_tolerance(horizon):
+    problem = build_problems('corner_example', horizon, 1, 0)[0]
+    unconstrained = setup_solver('ilqr', [problem])[0]
+    unconstrained()
+    # the corner is cut without the constraints
+    assert max_violation(problem, unconstrained.states) > 0.1
+
+    optimizer = setup_solver('al_ilqr', [problem])[0]
+    optimizer()
+    assert optimizer.converge
+    assert optimizer.status['outer_iterations'] > 1
+    assert max_violation(problem, optimizer.states) <= optimizer.constraint_tolerance
+    assert np.all(optimizer.multipliers >= 0.0)
+    # the reported cost is the trajectory cost without the constraint terms
+    assert optimizer.min_cost == pytest.approx(unconstrained.cost_of(optimizer.states,
+                                                                     optimizer.inputs))
+    assert optimizer.min_cost >= unconstrained.min_cost
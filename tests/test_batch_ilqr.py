@@ -0,0 +1,18 @@
+import numpy as np
+import pytest
+from benchmarks.run import build_problems, setup_solver
+
+
+@pytest.mark.parametrize('scenario, horizon', [('example_acc', 120), ('example_jerk', 100)])
+def test_batch_matches_the_serial_solver(scenario, horizon):
+    problems = build_problems(scenario, horizon, 4, 0)
+    serial = setup_solver('ilqr', problems)
+    for optimizer in serial:
+        optimizer()
+    batch = setup_solver('batch_ilqr', problems)[0]
+    states, inputs, costs, converged = batch()
+    np.testing.assert_allclose(costs, [optimizer.min_cost for optimizer in serial], rtol=1e-6)
+    np.testing.assert_array_equal(converged, [optimizer.converge for optimizer in serial])
+    assert batch.status['iterations'] <= max(optimizer.status['iterations'] for optimizer in serial) + 1
+    for b, optimizer in enumerate(serial):
+        np.testing.assert_allclose(states[b], optimizer.states, atol=1e-3)
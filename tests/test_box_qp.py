@@ -0,0 +1,103 @@
+import itertools
+import numpy as np
+import pytest
+from scipy.linalg import cho_solve
+from scipy.optimize import minimize
+from box_qp import box_qp
+
+
+def objective(H, g, x):
+    return np.dot(x, g) + 0.5*np.dot(x, np.dot(H, x))
+
+
+def brute_force(H, g, lower, upper):
+    """
+    Minimum over every assignment of the dimensions to the lower bound, the
+    upper bound or the free set whose free solution lies in the box.
+    """
+    n = H.shape[0]
+    best = None
+    for sides in itertools.product((0, 1, 2), repeat=n):
+        sides = np.array(sides)
+        x = np.where(sides == 0, lower, upper)
+        free = sides == 2
+        if np.any(free):
+            x[free] = -np.linalg.solve(H[np.ix_(free, free)],
+                                       g[free] + np.dot(H[np.ix_(free, ~free)], x[~free]))
+        if np.all(x >= lower - 1e-12) and np.all(x <= upper + 1e-12) and \
+                (best is None or objective(H, g, x) < objective(H, g, best)):
+            best = x
+    return best
+
+
+def random_problem(rng, n, scale=1.0):
+    A = rng.normal(size=(n, n))
+    H = np.dot(A, A.T) + 0.1*np.eye(n)
+    g = scale*rng.normal(size=n)
+    lower = -rng.uniform(0.1, 1.0, n)
+    upper = rng.uniform(0.1, 1.0, n)
+    return H, g, lower, upper
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_matches_brute_force(seed):
+    H, g, lower, upper = random_problem(np.random.default_rng(seed), 3, scale=3.0)
+    x, result, Hfree, free = box_qp(H, g, lower, upper)
+    assert result >= 1
+    np.testing.assert_allclose(x, brute_force(H, g, lower, upper), atol=1e-6)
+    if np.any(free):
+        # the factor gives the feedback gains of the free dimensions
+        b = np.arange(np.count_nonzero(free), dtype=float)
+        np.testing.assert_allclose(cho_solve(Hfree, b),
+                                   np.linalg.solve(H[np.ix_(free, free)], b))
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_matches_scipy(seed):
+    H, g, lower, upper = random_problem(np.random.default_rng(seed), 8, scale=3.0)
+    x, result, Hfree, free = box_qp(H, g, lower, upper)
+    reference = minimize(lambda y: objective(H, g, y), np.zeros(8),
+                         jac=lambda y: g + np.dot(H, y), method='L-BFGS-B',
+                         bounds=list(zip(lower, upper)), options={'ftol': 1e-15, 'gtol': 1e-12})
+    assert result >= 1
+    assert objective(H, g, x) <= reference.fun + 1e-9
+    np.testing.assert_allclose(x, reference.x, atol=1e-5)
+
+
+def test_fully_clamped():
+    H = np.array([[2.0, 0.5], [0.5, 1.0]])
+    g = np.array([-10.0, 10.0])
+    lower = np.array([-1.0, -1.0])
+    upper = np.array([1.0, 1.0])
+    x, result, Hfree, free = box_qp(H, g, lower, upper)
+    assert result == 6
+    assert not np.any(free)
+    np.testing.assert_array_equal(x, [1.0, -1.0])
+
+
+@pytest.mark.parametrize('x0', [[0.0, 0.0, 0.0], [1.0, -1.0, 1.0], [5.0, 5.0, -5.0]])
+def test_warm_start(x0):
+    H, g, lower, upper = random_problem(np.random.default_rng(3), 3, scale=3.0)
+    expected = brute_force(H, g, lower, upper)
+    x, result, Hfree, free = box_qp(H, g, lower, upper, np.array(x0))
+    assert result >= 1
+    np.testing.assert_allclose(x, expected, atol=1e-6)
+    # starting at the solution stops right away on the same point
+    x, result, Hfree, free = box_qp(H, g, lower, upper, expected)
+    assert result in (5, 6)
+    np.testing.assert_allclose(x, expected, atol=1e-9)
+
+
+def test_indefinite_hessian_needs_regularization():
+    H = np.array([[1.0, 0.0], [0.0, -1.0]])
+    g = np.array([0.3, 0.1])
+    lower = np.array([-1.0, -1.0])
+    upper = np.array([1.0, 1.0])
+    x, result, Hfree, free = box_qp(H, g, lower, upper)
+    assert result == -1
+    assert Hfree is None
+    # enough regularization makes the free block positive definite
+    regularized = H + 2.0*np.eye(2)
+    x, result, Hfree, free = box_qp(regularized, g, lower, upper)
+    assert result >= 1
+    np.testing.assert_allclose(x, brute_force(regularized, g, lower, upper), atol=1e-6)
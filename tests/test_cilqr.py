@@ -0,0 +1,20 @@
+import numpy as np
+import pytest
+from benchmarks.run import build_problems, setup_solver
+
+
+@pytest.mark.parametrize('parallel_line_search', [False, True])
+@pytest.mark.parametrize('seed', range(4))
+def test_reaches_the_minimum_of_ilqr(seed, parallel_line_search):
+    problems = build_problems('example_acc', 120, 1, seed)
+    reference = setup_solver('ilqr', problems)[0]
+    reference()
+    optimizer = setup_solver('cilqr', problems)[0]
+    optimizer.parallel_line_search = parallel_line_search
+    optimizer()
+    assert optimizer.converge
+    assert optimizer.min_cost <= reference.min_cost*(1 + 1e-5)
+    assert optimizer.status['iterations'] <= 3*reference.status['iterations']
+    system = optimizer.system
+    assert np.all(optimizer.inputs >= np.asarray(system.control_lower_limit) - 1e-9)
+    assert np.all(optimizer.inputs <= np.asarray(system.control_upper_limit) + 1e-9)
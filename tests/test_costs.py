@@ -0,0 +1,45 @@
+import numpy as np
+from costs import stage_costs, trajectory_cost
+
+
+def random_trajectories(rng, batch=(), T=12, n=4, m=2):
+    states = rng.normal(size=batch + (T, n))
+    inputs = rng.normal(size=batch + (T - 1, m))
+    target_states = rng.normal(size=(T, n))
+    A = rng.normal(size=(n, n))
+    Q = np.dot(A, A.T)
+    R = np.diag(rng.uniform(1.0, 2.0, m))
+    Qf = 3.0*Q
+    return states, inputs, target_states, Q, R, Qf
+
+
+def loop_cost(states, inputs, target_states, Q, R, Qf):
+    terms = []
+    for i in range(inputs.shape[0]):
+        x = states[i] - target_states[i]
+        terms.append(np.dot(x, np.dot(Q, x)) + np.dot(inputs[i], np.dot(R, inputs[i])))
+    x = states[-1] - target_states[-1]
+    terms.append(np.dot(x, np.dot(Qf, x)))
+    return np.array(terms)
+
+
+def test_stage_costs_match_a_loop_over_the_steps():
+    states, inputs, target_states, Q, R, Qf = random_trajectories(np.random.default_rng(0))
+    expected = loop_cost(states, inputs, target_states, Q, R, Qf)
+    np.testing.assert_allclose(stage_costs(states, inputs, target_states, Q, R, Qf), expected)
+    np.testing.assert_allclose(trajectory_cost(states, inputs, target_states, Q, R, Qf),
+                               expected.sum())
+
+
+def test_batches_are_costed_per_trajectory():
+    states, inputs, target_states, Q, R, Qf = random_trajectories(
+        np.random.default_rng(1), batch=(3, 5))
+    costs = trajectory_cost(states, inputs, target_states, Q, R, Qf)
+    assert costs.shape == (3, 5)
+    for index in np.ndindex(3, 5):
+        np.testing.assert_allclose(
+            costs[index], loop_cost(states[index], inputs[index], target_states, Q, R, Qf).sum())
+    # candidates that share the inputs, as in a line search over the states only
+    costs = trajectory_cost(states[0], inputs[0, 0], target_states, Q, R, Qf)
+    np.testing.assert_allclose(costs, [trajectory_cost(s, inputs[0, 0], target_states, Q, R, Qf)
+                                       for s in states[0]])
@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+from benchmarks.run import build_problems, setup_solver
+
+
+def solve(solver, problem):
+    optimizer = setup_solver(solver, [problem])[0]
+    optimizer()
+    return optimizer
+
+
+@pytest.mark.parametrize('scenario, horizon', [('example_acc', 120), ('example_jerk', 100)])
+def test_ddp_reaches_the_ilqr_minimum_in_fewer_iterations(scenario, horizon):
+    for seed in range(3):
+        problem = build_problems(scenario, horizon, 1, seed)[0]
+        ilqr = solve('ilqr', problem)
+        ddp = solve('ddp', problem)
+        assert ddp.status['converged']
+        assert ddp.min_cost <= ilqr.min_cost*(1 + 1e-6)
+        assert ddp.status['iterations'] < ilqr.status['iterations']
+
+
+def test_indefinite_second_order_terms_fall_back_to_gauss_newton():
+    problem = build_problems('example_dubins', 200, 1, 0)[0]
+    ilqr = solve('ilqr', problem)
+    ddp = solve('ddp', problem)
+    assert ddp.status['ddp_fallbacks'] > 0
+    assert ddp.status['converged']
+    np.testing.assert_allclose(ddp.min_cost, ilqr.min_cost, rtol=1e-6)
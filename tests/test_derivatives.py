@@ -0,0 +1,110 @@
+import numpy as np
+import pytest
+from systems import System, Car, CarAcceleration, DubinsCar
+from finite_difference import finite_difference_jacobians, finite_difference_hessians
+
+
+class BranchingCar(System):
+    """
+    Car that only implements model_f and branches on the state.
+    """
+
+    def __init__(self):
+        super().__init__(4, 2)
+        self.dt = 0.2
+
+    def model_f(self, x, u):
+        v = x[2] if x[2] > 0 else 0.5*x[2]
+        return x + self.dt*np.array([v*np.cos(x[3]), v*np.sin(x[3]), u[0], u[1]])
+
+
+class ClippedCar(System):
+    """
+    Vectorized car with np.where, np.maximum and np.minimum.
+    """
+
+    def __init__(self):
+        super().__init__(4, 2)
+        self.dt = 0.2
+
+    def model_f_batch(self, X, U):
+        v = np.maximum(X[..., 2], 0.0)
+        acc = np.minimum(U[..., 0], 1.0)
+        rate = np.where(X[..., 3] > 0, U[..., 1], 0.5*U[..., 1])
+        return X + self.dt*np.stack([v*np.cos(X[..., 3]), v*np.sin(X[..., 3]), acc, rate], axis=-1)
+
+
+def random_steps(system, count=6, seed=0):
+    rng = np.random.default_rng(seed)
+    X = rng.uniform(-1.0, 1.0, (count, system.state_size))
+    U = rng.uniform(-0.5, 0.5, (count, system.control_size))
+    # keep away from the kinks, where finite differences are not comparable
+    X[:, 2:] += np.sign(X[:, 2:])*0.2
+    return X, U
+
+
+@pytest.mark.parametrize('system', [Car(), CarAcceleration(), DubinsCar()])
+def test_generated_jacobians_match_hand_written(system):
+    X, U = random_steps(system)
+    df_dx, df_du = system.derivatives(X, U)
+    np.testing.assert_array_equal(df_dx, system.compute_df_dx_batch(X, U))
+    np.testing.assert_array_equal(df_du, system.compute_df_du_batch(X, U))
+
+
+@pytest.mark.parametrize('system', [Car(), DubinsCar()])
+def test_generated_hessians_match_finite_differences(system):
+    X, U = random_steps(system)
+    hessians = system.derivatives(X, U, order=2)[2:]
+    for generated, reference in zip(hessians, finite_difference_hessians(system.model_f_batch, X, U)):
+        np.testing.assert_allclose(generated, reference, atol=1e-5)
+
+
+@pytest.mark.parametrize('system, slow_scale', [(BranchingCar(), 0.5), (ClippedCar(), 0.0)])
+def test_untraceable_models_fall_back_to_finite_differences(system, slow_scale):
+    X, U = random_steps(system)
+    with pytest.warns(UserWarning, match='cannot be traced'):
+        df_dx, df_du, df_dxdx, df_dudu, df_dudx = system.derivatives(X, U, order=2)
+    fd_dx, fd_du = finite_difference_jacobians(system.model_f_batch, X, U)
+    np.testing.assert_allclose(df_dx, fd_dx)
+    np.testing.assert_allclose(df_du, fd_du)
+    assert df_dxdx.shape == (6, 4, 4, 4)
+    assert df_dudu.shape == (6, 4, 2, 2)
+    assert df_dudx.shape == (6, 4, 2, 4)
+    # the branch taken for negative speeds
+    v_scale = np.where(X[:, 2] > 0, 1.0, slow_scale)
+    np.testing.assert_allclose(df_dx[:, 0, 2], v_scale*np.cos(X[:, 3])*system.dt, atol=1e-8)
+
+
+def test_cost_changes_keep_the_generated_function():
+    import codegen
+    system = Car()
+    system.set_cost(np.eye(4), np.eye(2))
+    X, U = random_steps(system)
+    system.derivatives(X, U)
+    function = codegen.derivative_function(system)
+    system.set_cost(2.0*np.eye(4), np.eye(2))
+    assert codegen.derivative_function(system) is function
+    system.set_dt(0.1)
+    assert codegen.derivative_function(system) is not function
+    np.testing.assert_allclose(system.derivatives(X, U)[1][:, 2, 0], 0.1)
+    for k in range(2*codegen.generated_cache_size):
+        system.set_dt(0.01*(k + 1))
+        system.derivatives(X, U)
+    assert len(codegen.generated[system].functions) == codegen.generated_cache_size
+
+
+@pytest.mark.parametrize('system', [Car(), CarAcceleration(), DubinsCar()])
+def test_linearize_stacks_the_jacobians_of_every_step(system):
+    system.set_dt(0.2)
+    X, U = random_steps(system, count=7)
+    states = system.rollout(X[0], U[:-1])
+    df_dx, df_du = system.linearize(states, U[:-1])
+    assert df_dx.shape == (6, system.state_size, system.state_size)
+    assert df_du.shape == (6, system.state_size, system.control_size)
+    fd_dx, fd_du = finite_difference_jacobians(system.model_f_batch, states[:-1], U[:-1])
+    for i in range(6):
+        np.testing.assert_allclose(df_dx[i], system.compute_df_dx(states[i], U[i]))
+        np.testing.assert_allclose(df_du[i], system.compute_df_du(states[i], U[i]))
+        np.testing.assert_allclose(states[i + 1], system.model_f(states[i], U[i]))
+    np.testing.assert_allclose(df_dx, fd_dx, atol=1e-6)
+    np.testing.assert_allclose(df_du, fd_du, atol=1e-6)
@@ -0,0 +1,25 @@
+import numpy as np
+from constraints import BubbleConstraint
+from distance_field import SignedDistanceField
+from spatial_index import ObstacleIndex
+
+
+def test_empty_occupancy_grid_is_finite():
+    field = SignedDistanceField.from_occupancy(np.zeros((20, 30)), resolution=0.5)
+    positions = np.random.default_rng(0).uniform(-1.0, 16.0, (50, 2))
+    distance, gradient = field.distance_gradient(positions)
+    assert np.all(np.isfinite(distance)) and np.all(distance > 10.0)
+    np.testing.assert_array_equal(gradient, 0.0)
+
+
+def test_clearance_does_not_overestimate_the_free_space():
+    rng = np.random.default_rng(1)
+    index = ObstacleIndex(rng.uniform(0.0, 10.0, (40, 2)), 0.2)
+    field = SignedDistanceField.from_points(index.points, (-1.0, -1.0), (11.0, 11.0), 0.1, 0.2)
+    positions = rng.uniform(0.0, 10.0, (2000, 2))
+    exact = index.clearance(positions)
+    assert np.all(field.clearance(positions) <= exact + 1e-12)
+    assert np.any(field.distance(positions) > exact)
+    bubbles = BubbleConstraint(len(positions))
+    bubbles.setup_free_space(field, positions, [0.0, 2.0])
+    assert np.all(bubbles.radius <= np.maximum(exact, 0.0) + 1e-12)
@@ -0,0 +1,32 @@
+import os
+import subprocess
+import sys
+
+repository = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def loaded_modules(statement):
+    """
+    Top level modules loaded by statement in a fresh interpreter.
+    """
+    script = statement + "\nimport sys\n" \
+        "print(' '.join(sorted({name.split('.')[0] for name in sys.modules})))"
+    output = subprocess.run([sys.executable, '-c', script], cwd=repository, check=True,
+                            capture_output=True, text=True).stdout
+    return set(output.split())
+
+
+def test_solvers_load_neither_matplotlib_nor_numba():
+    modules = loaded_modules("import trajectory_optimization")
+    assert {'numpy', 'scipy', 'osqp', 'ilqr', 'cilqr', 'sqp'} <= modules
+    assert 'matplotlib' not in modules
+    assert 'numba' not in modules
+
+
+def test_numba_is_imported_on_first_use_of_the_kernel():
+    modules = loaded_modules(
+        "import riccati\n"
+        "if riccati.numba_available:\n"
+        "    riccati.get_riccati_numba()")
+    import riccati
+    assert ('numba' in modules) == riccati.numba_available
@@ -0,0 +1,61 @@
+import copy
+import numpy as np
+import pytest
+from benchmarks.run import build_problems
+from ilqr import iterative_LQR
+
+
+def solve(seed, adaptive_LM):
+    problem = build_problems('example_dubins', 200, 1, seed)[0]
+    optimizer = iterative_LQR(problem.system, problem.target_states, problem.system.dt)
+    optimizer.inputs = np.array(problem.init_inputs)
+    optimizer.states[0] = problem.target_states[0]
+    optimizer.adaptive_LM = adaptive_LM
+    optimizer()
+    return optimizer
+
+
+@pytest.mark.parametrize('seed', [1, 2])
+def test_rejected_search_is_only_repeated_for_a_changed_step(seed):
+    plain = solve(seed, adaptive_LM=False)
+    adaptive = solve(seed, adaptive_LM=True)
+    # the last search fails only at steps below the tol_fun scale
+    assert plain.status['converged'] and not plain.status['no_descent']
+    assert adaptive.min_cost <= plain.min_cost + 1e-6
+    # one more line search at most for each tenfold change of the step
+    assert adaptive.status['rollouts'] <= plain.status['rollouts'] + 2*plain.line_search_trials
+    assert adaptive.status['converged'] != adaptive.status['no_descent']
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_batched_line_search_keeps_the_best_accepted_step(seed):
+    problem = build_problems('example_acc', 120, 1, seed)[0]
+    serial = iterative_LQR(problem.system, problem.target_states, problem.system.dt)
+    serial.inputs = np.array(problem.init_inputs)
+    serial.states = problem.system.rollout(problem.target_states[0], serial.inputs)
+    serial.min_cost = serial.cost()
+    serial.backward_pass()
+    batched = copy.deepcopy(serial)
+    batched.parallel_line_search = True
+    serial.forward_pass()
+    batched.forward_pass()
+    assert batched.line_search_trials == batched.line_search_alphas().shape[0]
+    assert serial.alpha > 0.0 and batched.alpha > 0.0
+    assert batched.min_cost <= serial.min_cost*(1 + 1e-12)
+    np.testing.assert_allclose(batched.min_cost, batched.cost())
+
+
+@pytest.mark.parametrize('scenario, horizon', [('example_acc', 120), ('example_jerk', 100)])
+def test_batched_line_search_reaches_the_serial_minimum(scenario, horizon):
+    for seed in range(3):
+        problem = build_problems(scenario, horizon, 1, seed)[0]
+        costs = []
+        for parallel_line_search in (False, True):
+            optimizer = iterative_LQR(problem.system, problem.target_states, problem.system.dt)
+            optimizer.inputs = np.array(problem.init_inputs)
+            optimizer.states[0] = problem.target_states[0]
+            optimizer.parallel_line_search = parallel_line_search
+            optimizer()
+            assert optimizer.status['converged']
+            costs.append(optimizer.min_cost)
+        np.testing.assert_allclose(costs[1], costs[0], rtol=1e-6)
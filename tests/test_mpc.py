@@ -0,0 +1,66 @@
+import numpy as np
+from benchmarks.run import build_problems
+from ilqr import iterative_LQR
+from mpc import receding_horizon_MPC, shift
+from sqp import sequential_QP_optimizer
+
+
+def test_shift_repeats_the_last_step():
+    a = np.arange(8.0).reshape(4, 2)
+    np.testing.assert_array_equal(shift(a), [[2, 3], [4, 5], [6, 7], [6, 7]])
+
+
+def ilqr_controller(horizon=40):
+    problem = build_problems('example_acc', horizon + 20, 1, 0)[0]
+    optimizer = iterative_LQR(problem.system, problem.target_states[:horizon], problem.system.dt)
+    optimizer.inputs = np.array(problem.init_inputs[:horizon - 1])
+    return problem, optimizer
+
+
+def test_ilqr_warm_start_shifts_the_plan():
+    problem, optimizer = ilqr_controller()
+    controller = receding_horizon_MPC(optimizer)
+    x0 = problem.target_states[0]
+    u0 = controller(x0, problem.target_states[:40])
+    np.testing.assert_array_equal(u0, optimizer.inputs[0])
+    states = optimizer.states.copy()
+    inputs = optimizer.inputs.copy()
+    k = optimizer.k.copy()
+    # starting on the plan, the closed-loop rollout reproduces the shifted plan
+    controller.warm_start_ilqr(states[1])
+    np.testing.assert_allclose(optimizer.inputs[:-1], inputs[1:], atol=1e-9)
+    np.testing.assert_allclose(optimizer.inputs[-1], inputs[-1])
+    np.testing.assert_allclose(optimizer.states[:-1], states[1:], atol=1e-9)
+    np.testing.assert_array_equal(optimizer.k[:-1], k[1:])
+
+
+def test_ilqr_ticks_are_limited_to_max_iter():
+    problem, optimizer = ilqr_controller()
+    controller = receding_horizon_MPC(optimizer, maxIter=1)
+    full_iterations = optimizer.maxIter
+    x = problem.target_states[0]
+    for tick in range(5):
+        u = controller(x, problem.target_states[tick:tick + 40])
+        if tick > 0:
+            assert optimizer.status['iterations'] <= 1
+        np.testing.assert_allclose(optimizer.states[0], x)
+        x = problem.system.model_f(x, u)
+    assert controller.ticks == 5
+    assert optimizer.maxIter == full_iterations
+
+
+def test_sqp_warm_start_continues_from_the_shifted_solution():
+    problem = build_problems('random_example', 40, 1, 0)[0]
+    optimizer = sequential_QP_optimizer(
+        problem.system, problem.constraint, problem.target_states, problem.system.dt)
+    optimizer.set_init_inputs(np.array(problem.init_inputs, dtype=float))
+    controller = receding_horizon_MPC(optimizer, maxIter=2)
+    controller(problem.target_states[0], problem.target_states)
+    planned = optimizer.states.copy()
+    first_reduction = optimizer.status['cost_reduction']
+    controller(planned[1], shift(problem.target_states))
+    assert optimizer.status['iterations'] <= 2
+    # the shifted solution is already close to the new optimum
+    assert optimizer.status['cost_reduction'] < 0.01*first_reduction
+    np.testing.assert_allclose(optimizer.states[0], planned[1], atol=1e-6)
+    assert np.max(np.abs(optimizer.states[:-1, :2] - planned[1:, :2])) < 0.2
@@ -0,0 +1,33 @@
+import numpy as np
+from benchmarks.run import build_problems
+from pool_runner import TrajectoryProblem, solve_problems
+
+
+def mixed_problems():
+    """
+    Problems of different sizes and solve times, so the workers finish them
+    out of order.
+    """
+    problems = []
+    for seed in range(3):
+        problems.append(build_problems('example_acc', 120 - 40*seed, 1, seed)[0])
+        problems.append(build_problems('random_example', 30 + 10*seed, 1, seed)[0])
+        acc = build_problems('example_acc', 40, 1, seed)[0]
+        problems.append(TrajectoryProblem(acc.system, acc.target_states, acc.init_inputs,
+                                          solver='cilqr'))
+    return problems
+
+
+def test_results_map_back_to_their_problems():
+    problems = mixed_problems()
+    serial = sorted(solve_problems(problems, processes=1), key=lambda result: result.index)
+    assert [result.index for result in serial] == list(range(len(problems)))
+    results = list(solve_problems(problems, processes=3))
+    assert sorted(result.index for result in results) == list(range(len(problems)))
+    for result in results:
+        problem = problems[result.index]
+        assert result.states.shape[0] == problem.target_states.shape[0]
+        np.testing.assert_allclose(result.states[0], problem.target_states[0])
+        assert result.cost == serial[result.index].cost
+        assert result.converged == serial[result.index].converged
+        np.testing.assert_array_equal(result.inputs, serial[result.index].inputs)
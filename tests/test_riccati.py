@@ -0,0 +1,136 @@
+import numpy as np
+import pytest
+import riccati
+from riccati import riccati_backward, riccati_numpy
+
+kernels = ['numpy', pytest.param('numba', marks=pytest.mark.skipif(
+    not riccati.numba_available, reason="numba is not installed"))]
+
+
+def random_problem(seed, T=30, n=4, m=2, per_step_lxx=False, second_order=False):
+    rng = np.random.default_rng(seed)
+    fx = np.eye(n) + 0.1*rng.normal(size=(T, n, n))
+    fu = 0.2*rng.normal(size=(T, n, m))
+    lx = rng.normal(size=(T, n))
+    lu = rng.normal(size=(T, m))
+    A = rng.normal(size=(n, n))
+    lxx = np.dot(A, A.T) + np.eye(n)
+    if per_step_lxx:
+        lxx = lxx*rng.uniform(0.5, 2.0, (T, 1, 1))
+    luu = np.diag(rng.uniform(1.0, 2.0, m))
+    lux = 0.1*rng.normal(size=(m, n))
+    f_hess = None
+    if second_order:
+        f_hess = 0.01*rng.normal(size=(T, n, m + n, m + n))
+        f_hess = 0.5*(f_hess + np.swapaxes(f_hess, -1, -2))
+    B = rng.normal(size=(n, n))
+    terminal = (rng.normal(size=n), np.dot(B, B.T) + np.eye(n))
+    return fx, fu, lx, lu, lxx, luu, lux, f_hess, terminal
+
+
+def baseline_recursion(fx, fu, lx, lu, lxx, luu, lux, mu, terminal, f_hess=None):
+    """
+    Backward pass of iterative_LQR before the preallocated kernels, one
+    step at a time with an explicit inverse of Quu.
+    """
+    T, n, m = fu.shape
+    Vx, Vxx = terminal
+    k = np.zeros((T, m))
+    K = np.zeros((T, m, n))
+    for i in range(T - 1, -1, -1):
+        Qx = lx[i] + np.dot(fx[i].T, Vx)
+        Qu = lu[i] + np.dot(fu[i].T, Vx)
+        Vxx_augmented = Vxx + mu*np.eye(n)
+        Qxx = lxx[i] if lxx.ndim == 3 else lxx
+        Qxx = Qxx + np.dot(np.dot(fx[i].T, Vxx_augmented), fx[i])
+        Quu = luu + np.dot(np.dot(fu[i].T, Vxx_augmented), fu[i])
+        Qux = lux + np.dot(np.dot(fu[i].T, Vxx_augmented), fx[i])
+        if f_hess is not None:
+            second = np.tensordot(Vx, f_hess[i], axes=1)
+            Quu = Quu + second[:m, :m]
+            Qux = Qux + second[:m, m:]
+            Qxx = Qxx + second[m:, m:]
+        Quu_inv = np.linalg.inv(Quu)
+        k[i] = -np.dot(Quu_inv, Qu)
+        K[i] = -np.dot(Quu_inv, Qux)
+        Vx = Qx + np.dot(K[i].T, Qu)
+        Vxx = Qxx + np.dot(K[i].T, Qux)
+    return k, K, Vx, Vxx
+
+
+def run_kernel(problem, mu, use_numba):
+    fx, fu, lx, lu, lxx, luu, lux, f_hess, terminal = problem
+    T, n, m = fu.shape
+    k = np.zeros((T, m))
+    K = np.zeros((T, m, n))
+    Vx = np.zeros((T + 1, n))
+    Vxx = np.zeros((T + 1, n, n))
+    Vx[-1], Vxx[-1] = terminal
+    failed = riccati_backward(fx, fu, lx, lu, lxx, luu, lux, mu, k, K, Vx, Vxx, f_hess,
+                              use_numba=use_numba)
+    return failed, k, K, Vx, Vxx
+
+
+@pytest.mark.parametrize('kernel', kernels)
+@pytest.mark.parametrize('mu', [0.0, 0.5])
+@pytest.mark.parametrize('per_step_lxx', [False, True])
+@pytest.mark.parametrize('second_order', [False, True])
+def test_kernel_matches_the_baseline_recursion(kernel, mu, per_step_lxx, second_order):
+    problem = random_problem(0, per_step_lxx=per_step_lxx, second_order=second_order)
+    failed, k, K, Vx, Vxx = run_kernel(problem, mu, kernel == 'numba')
+    fx, fu, lx, lu, lxx, luu, lux, f_hess, terminal = problem
+    k_ref, K_ref, Vx_ref, Vxx_ref = baseline_recursion(
+        fx, fu, lx, lu, lxx, luu, lux, mu, terminal, f_hess)
+    assert failed == -1
+    np.testing.assert_allclose(k, k_ref, rtol=1e-9, atol=1e-9)
+    np.testing.assert_allclose(K, K_ref, rtol=1e-9, atol=1e-9)
+    np.testing.assert_allclose(Vx[0], Vx_ref, rtol=1e-9, atol=1e-9)
+    np.testing.assert_allclose(Vxx[0], Vxx_ref, rtol=1e-9, atol=1e-9)
+
+
+@pytest.mark.parametrize('kernel', kernels)
+def test_kernels_report_the_same_failed_step(kernel):
+    problem = random_problem(1)
+    problem[5][...] = -100.0*np.eye(2)
+    failed, k, K, Vx, Vxx = run_kernel(problem, 0.0, kernel == 'numba')
+    assert failed == run_kernel(problem, 0.0, False)[0]
+    assert failed == problem[0].shape[0] - 1
+
+
+def test_batch_matches_single_problems():
+    problems = [random_problem(seed, per_step_lxx=True, second_order=True) for seed in range(3)]
+    stacked = [np.stack([problem[j] for problem in problems]) for j in range(8)]
+    fx, fu, lx, lu, lxx, luu, lux, f_hess = stacked
+    B, T, n, m = fu.shape
+    k = np.zeros((B, T, m))
+    K = np.zeros((B, T, m, n))
+    Vx = np.zeros((B, T + 1, n))
+    Vxx = np.zeros((B, T + 1, n, n))
+    for b, problem in enumerate(problems):
+        Vx[b, -1], Vxx[b, -1] = problem[-1]
+    # the batch kernel shares luu and lux between the problems
+    lux = np.zeros((m, n))
+    luu = problems[0][5]
+    mu = np.array([0.0, 0.5, 1.0])
+    failed = riccati_numpy(fx, fu, lx, lu, lxx, luu, lux, mu, k, K, Vx, Vxx, f_hess)
+    np.testing.assert_array_equal(failed, -1)
+    for b, problem in enumerate(problems):
+        single = (problem[0], problem[1], problem[2], problem[3], problem[4], luu, lux,
+                  problem[7], problem[8])
+        failed, k_b, K_b, Vx_b, Vxx_b = run_kernel(single, mu[b], False)
+        np.testing.assert_allclose(k[b], k_b, rtol=1e-9, atol=1e-9)
+        np.testing.assert_allclose(K[b], K_b, rtol=1e-9, atol=1e-9)
+        np.testing.assert_allclose(Vxx[b], Vxx_b, rtol=1e-9, atol=1e-9)
+
+
+def test_falls_back_to_numpy_without_numba(monkeypatch):
+    def unavailable():
+        raise AssertionError("the numba kernel must not be compiled")
+    monkeypatch.setattr(riccati, 'numba_available', False)
+    monkeypatch.setattr(riccati, 'get_riccati_numba', unavailable)
+    problem = random_problem(2, second_order=True)
+    failed, k, K, Vx, Vxx = run_kernel(problem, 0.5, True)
+    reference = run_kernel(problem, 0.5, False)
+    assert failed == -1
+    np.testing.assert_array_equal(k, reference[1])
+    np.testing.assert_array_equal(Vxx, reference[4])
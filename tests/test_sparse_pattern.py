@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+import scipy.sparse as sparse
+from scipy.linalg import block_diag
+from benchmarks.run import build_problems
+from sparse_pattern import SparsityPattern
+from sqp import sequential_QP_optimizer
+
+
+def test_values_are_scattered_into_a_fixed_structure():
+    pattern = SparsityPattern((6, 5))
+    pattern.add('diagonal', np.arange(5), np.arange(5))
+    pattern.add_blocks('blocks', [1, 4], [3, 0], (2, 2))
+    pattern.compile()
+    rng = np.random.default_rng(0)
+    for values in ({'diagonal': rng.normal(size=5), 'blocks': rng.normal(size=(2, 2, 2))},
+                   {'diagonal': 0.0, 'blocks': rng.normal(size=(2, 2, 2))}):
+        A = pattern.to_csc(values)
+        expected = np.zeros((6, 5))
+        expected[np.arange(5), np.arange(5)] = values['diagonal']
+        expected[1:3, 3:5] = values['blocks'][0]
+        expected[4:6, 0:2] = values['blocks'][1]
+        np.testing.assert_array_equal(A.toarray(), expected)
+        # zeros stay explicit entries
+        assert A.nnz == 13
+        np.testing.assert_array_equal(A.indices, pattern.indices)
+        np.testing.assert_array_equal(A.indptr, pattern.indptr)
+
+
+def test_overlapping_groups_are_rejected():
+    pattern = SparsityPattern((3, 3))
+    pattern.add('a', np.arange(3), np.arange(3))
+    pattern.add('b', [1], [1])
+    with pytest.raises(ValueError):
+        pattern.compile()
+
+
+def make_optimizer(problem, init_input_fixed):
+    optimizer = sequential_QP_optimizer(
+        problem.system, problem.constraint, problem.target_states, problem.system.dt)
+    optimizer.set_init_inputs(np.array(problem.init_inputs, dtype=float))
+    optimizer.init_input_fixed = init_input_fixed
+    return optimizer
+
+
+def dense_A(optimizer):
+    """
+    Constraint matrix stacked from dense blocks, the way the SQP assembled
+    it before the fixed pattern.
+    """
+    n = optimizer.n_states
+    m = optimizer.m_inputs
+    T = optimizer.horizon
+    Ad, Bd = optimizer.system.linearize(optimizer.states, optimizer.inputs)
+    dynamics = np.hstack([np.hstack([block_diag(*Ad), np.zeros(((T - 1)*n, n))]) -
+                          np.hstack([np.zeros(((T - 1)*n, n)), np.eye((T - 1)*n)]),
+                          block_diag(*Bd)])
+    init = np.eye(n, T*n + (T - 1)*m)
+    if optimizer.init_input_fixed:
+        init_u = np.zeros((m, T*n + (T - 1)*m))
+        init_u[:, T*n:T*n + m] = np.eye(m)
+        init = np.vstack([init, init_u])
+    C = optimizer.constraint.get_linear_constraint(optimizer.states).toarray()
+    C = np.hstack([C, np.zeros((C.shape[0], T*n - C.shape[1]))])
+    return np.vstack([init, dynamics, block_diag(C, np.eye((T - 1)*m))])
+
+
+@pytest.mark.parametrize('init_input_fixed', [False, True])
+def test_reused_pattern_matches_a_fresh_assembly(init_input_fixed):
+    problem = build_problems('random_example', 20, 1, 0)[0]
+    optimizer = make_optimizer(problem, init_input_fixed)
+    optimizer.states = problem.system.rollout(optimizer.x0, optimizer.inputs)
+    first, l, u = optimizer.compute_A_l_u()
+    pattern = optimizer.A_pattern
+    rng = np.random.default_rng(1)
+    optimizer.inputs = optimizer.inputs + 0.1*rng.normal(size=optimizer.inputs.shape)
+    optimizer.states = problem.system.rollout(optimizer.x0, optimizer.inputs)
+    A, l, u = optimizer.compute_A_l_u()
+    assert optimizer.A_pattern is pattern
+    np.testing.assert_array_equal(A.indptr, first.indptr)
+    np.testing.assert_array_equal(A.indices, first.indices)
+
+    fresh = make_optimizer(problem, init_input_fixed)
+    fresh.states = optimizer.states.copy()
+    fresh.inputs = optimizer.inputs.copy()
+    A_fresh, l_fresh, u_fresh = fresh.compute_A_l_u()
+    assert sparse.issparse(A_fresh)
+    np.testing.assert_array_equal(A.toarray(), A_fresh.toarray())
+    np.testing.assert_array_equal(l, l_fresh)
+    np.testing.assert_array_equal(u, u_fresh)
+    np.testing.assert_allclose(A.toarray(), dense_A(optimizer), atol=1e-12)
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+from constraints import SpeedConstraint, StackedConstraint
+from spatial_index import ObstacleIndex, NearestObstacleConstraint
+
+
+def line_states(x, y=0.0):
+    states = np.zeros((len(x), 4))
+    states[:, 0] = x
+    states[:, 1] = y
+    return states
+
+
+@pytest.mark.parametrize('radius, margin', [(0.0, 0.0), (0.3, -0.3), (0.3, -0.5)])
+def test_nonpositive_obstacle_radius_is_rejected(radius, margin):
+    index = ObstacleIndex(np.array([[0.0, 1.0], [1.0, 1.0]]), radius)
+    with pytest.raises(ValueError):
+        NearestObstacleConstraint(index, 3, k=1, margin=margin)
+
+
+def test_update_keeps_the_row_of_an_obstacle():
+    points = np.array([[0.0, 1.0], [1.0, 1.0], [2.0, 1.0], [3.0, 1.0], [4.0, 1.0]])
+    constraint = NearestObstacleConstraint(ObstacleIndex(points, 0.2), 2, k=2)
+    constraint.setup(line_states([0.4, 2.9]))
+    np.testing.assert_array_equal(constraint.obstacles, [[0, 1], [3, 2]])
+    # both steps are queried again: step 0 now has 1 nearer than 0,
+    # step 1 swaps obstacle 2 for obstacle 4
+    changed = constraint.update(line_states([0.9, 3.6]))
+    np.testing.assert_array_equal(constraint.obstacles, [[0, 1], [3, 4]])
+    np.testing.assert_array_equal(changed, [[False, False], [False, True]])
+    np.testing.assert_array_equal(constraint.centers, points[constraint.obstacles])
+    assert constraint.update(line_states([0.9, 3.6])) is None
+
+
+def test_stacked_update_marks_the_changed_rows():
+    points = np.array([[0.0, 1.0], [1.0, 1.0], [2.0, 1.0]])
+    obstacles = NearestObstacleConstraint(ObstacleIndex(points, 0.2), 2, k=1)
+    speed = SpeedConstraint(2)
+    speed.setup(0.0, 2.0)
+    constraint = StackedConstraint([speed, obstacles])
+    obstacles.setup(line_states([0.0, 1.0]))
+    assert constraint.update(line_states([0.1, 1.1])) is None
+    changed = constraint.update(line_states([0.1, 1.9]))
+    np.testing.assert_array_equal(changed, [[False, False], [False, True]])
@@ -0,0 +1,74 @@
+import json
+import numpy as np
+import pytest
+from benchmarks.run import build_problems
+from instrumentation import SolverTrace
+from systems import Car
+from sqp import sequential_QP_optimizer
+from spatial_index import ObstacleIndex, NearestObstacleConstraint
+
+
+def straight_line_problem(start_offset, horizon=60, dt=0.2):
+    """
+    Reference at 1 m/s along the x axis through three obstacles, starting
+    start_offset to the side of it; zero inputs drive straight ahead.
+    """
+    system = Car()
+    system.set_dt(dt)
+    system.set_cost(np.diag([50.0, 50.0, 10.0, 1.0]), np.diag([300.0, 1000.0]))
+    system.Q_f = system.Q*horizon/100
+    system.set_control_limit([-1, -0.3], [1, 0.3])
+    target_states = np.zeros((horizon, 4))
+    target_states[:, 0] = dt*np.arange(horizon)
+    target_states[:, 2] = 1.0
+    target_states[0, 1] = start_offset
+    index = ObstacleIndex(np.array([[3.0, 0.0], [6.0, 0.0], [9.0, 0.0]]), 0.5)
+    constraint = NearestObstacleConstraint(index, horizon, k=2)
+    constraint.setup(target_states)
+    optimizer = sequential_QP_optimizer(system, constraint, target_states, dt)
+    optimizer.set_init_inputs(np.zeros((horizon - 1, 2)))
+    return optimizer, index
+
+
+def test_constraints_are_linearized_at_the_rollout():
+    # the target states pass through the obstacle centers, the rollout does not
+    optimizer, index = straight_line_problem(0.3)
+    optimizer()
+    assert optimizer.status['qp_status'] == 'solved'
+    assert optimizer.status['converged']
+    assert optimizer.min_cost < 1e4
+    assert index.clearance(optimizer.states[:, :2]).min() > -0.01
+
+
+def test_infeasible_qp_stops_unconverged():
+    # the rollout passes through the obstacle centers, where the linearized
+    # constraints cannot be satisfied
+    optimizer, index = straight_line_problem(0.0)
+    optimizer()
+    assert optimizer.status['qp_status'] == 'primal infeasible'
+    assert not optimizer.status['converged']
+    assert optimizer.qp_x is None
+    rollout = optimizer.sim(optimizer.x0, optimizer.inputs)
+    np.testing.assert_allclose(optimizer.states, rollout)
+    assert np.isclose(optimizer.min_cost, optimizer.cost())
+
+
+def test_screening_fallback_matches_the_unscreened_solve():
+    problem = build_problems('corner_example', 400, 1, 0)[0]
+    results = []
+    for screening in (False, True):
+        optimizer = sequential_QP_optimizer(problem.system, problem.constraint,
+                                            problem.target_states, problem.system.dt)
+        optimizer.set_init_inputs(np.array(problem.init_inputs, dtype=float))
+        optimizer.screening = screening
+        optimizer.trace = SolverTrace()
+        optimizer()
+        violation = problem.constraint.get_residuals(optimizer.states)[0].max()
+        results.append((optimizer, violation))
+        json.loads(optimizer.trace.to_json(), parse_constant=pytest.fail)
+    (full, full_violation), (screened, screened_violation) = results
+    assert screened.status['screening_fallbacks'] > 0
+    assert screened.status['converged']
+    assert screened.status['qp_rows'] < full.status['qp_rows']
+    assert screened.min_cost <= 1.01*full.min_cost
+    assert screened_violation <= full_violation + 0.2
@@ -0,0 +1,22 @@
+import numpy as np
+import pytest
+from benchmarks.run import build_problems, setup_solver
+
+
+@pytest.mark.parametrize('solver', ['ilqr', 'cilqr'])
+def test_ilqr_solvers_stop_at_the_time_budget(solver):
+    optimizer = setup_solver(solver, build_problems('example_acc', 1000, 1, 0))[0]
+    optimizer.time_budget = 0.03
+    optimizer()
+    assert optimizer.status['timed_out']
+    assert optimizer.status['solve_time'] < 0.03 + 0.02
+    assert np.all(np.isfinite(optimizer.states))
+
+
+def test_sqp_reports_a_qp_stopped_by_its_time_limit():
+    optimizer = setup_solver('sqp', build_problems('random_example', 2000, 1, 0))[0]
+    optimizer.time_budget = 0.05
+    optimizer()
+    if optimizer.status['qp_status'] == 'run time limit reached':
+        assert optimizer.status['timed_out']
+    assert optimizer.status['timed_out'] or optimizer.status['converged']
@@ -0,0 +1,16 @@
+"""
+Entry point to the solvers. Importing it loads numpy, scipy and osqp only:
+plotting lives in plotting.py and the demo scripts, and numba is imported
+the first time the compiled iLQR backward pass is used.
+"""
+from systems import System, Car, CarAcceleration, DubinsCar
+from costs import stage_costs, trajectory_cost
+from constraints import Constraint, BubbleConstraint
+from ilqr import iterative_LQR
+from cilqr import iterative_LQR as constrained_iterative_LQR
+from al_ilqr import augmented_Lagrangian_iLQR
+from batch_ilqr import batch_iterative_LQR
+from sqp import sequential_QP_optimizer
+from mpc import receding_horizon_MPC
+from pool_runner import TrajectoryProblem, SolveResult, solve_problems
+from instrumentation import SolverTrace